@@ -0,0 +1,108 @@
+from metrics import ADMISSION_LEVEL, ADMISSION_REQUESTS, ADMISSION_SHED, ADMISSION_QUEUE_SECONDS
+from contextlib import asynccontextmanager
+import asyncio, time
+
+class Overloaded(Exception):
+    '''
+    request shed by the admission controller, served as 503
+    '''
+
+# degradation levels, each includes the ones before it
+FULL = 0
+SMALLER_K = 1
+SKIP_RERANK = 2
+VECTOR_ONLY = 3
+
+class AdmissionController:
+    def __init__(self,
+                 max_concurrent: int=32,
+                 max_queue: int=128,
+                 max_queue_delay: float=None,
+                 degrade_at: tuple=(1.0, 1.5, 2.0),
+                 cooldown: float=5.0,
+                 degraded_k: int=None
+                ):
+        '''
+        bounds the requests running the pipeline and degrades quality under pressure
+            max_concurrent = requests running at once, the rest wait in a queue
+            max_queue = waiting requests when every slot is busy, further requests are shed (Overloaded)
+            max_queue_delay = seconds a request may wait before it is shed, None waits forever
+            degrade_at = pressure, (running+waiting)/max_concurrent, at which levels
+                SMALLER_K, SKIP_RERANK and VECTOR_ONLY start, e.g., 1.0 = every slot is busy,
+                VECTOR_ONLY drops full-text search from VECTOR_AND_FULLTEXT and the sparse
+                (BM25) prefetch and fusion from HYBRID
+            cooldown = seconds between stepping down one level, so quality returns gradually
+            degraded_k = contexts per request from SMALLER_K on, default half of QA_Manager.k
+        the level rises as soon as pressure crosses a threshold
+        '''
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_delay = max_queue_delay
+        self.degrade_at = tuple(degrade_at)
+        self.cooldown = cooldown
+        self.degraded_k = degraded_k
+        self.running = 0
+        self.waiting = 0
+        self.level = FULL
+        self._changed = time.monotonic()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.admitted = 0
+        self.shed = 0
+
+    @property
+    def pressure(self) -> float:
+        return (self.running+self.waiting)/self.max_concurrent
+
+    def _update(self) -> None:
+        target = sum(self.pressure >= threshold for threshold in self.degrade_at)
+        now = time.monotonic()
+        if target > self.level:
+            self.level, self._changed = target, now
+        elif target < self.level and now-self._changed >= self.cooldown:
+            self.level, self._changed = self.level-1, now
+        ADMISSION_LEVEL.set(self.level)
+        ADMISSION_REQUESTS.set(self.running, state='running')
+        ADMISSION_REQUESTS.set(self.waiting, state='waiting')
+
+    def _shed(self, reason: str):
+        self.shed += 1
+        ADMISSION_SHED.inc(reason=reason)
+        return Overloaded(reason)
+
+    @asynccontextmanager
+    async def admit(self):
+        '''
+        waits for a slot and yields the degradation level for the request,
+        raises Overloaded if the queue is full or the wait exceeds max_queue_delay
+        '''
+        if self.running >= self.max_concurrent and self.waiting >= self.max_queue:
+            raise self._shed('queue_full')
+        self.waiting += 1
+        self._update()
+        s = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.max_queue_delay):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            raise self._shed('queue_timeout') from None
+        finally:
+            self.waiting -= 1
+        ADMISSION_QUEUE_SECONDS.observe(time.perf_counter()-s)
+        self.running += 1
+        self.admitted += 1
+        self._update()
+        try:
+            yield self.level
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            self._update()
+
+    def stats(self) -> dict:
+        return {
+            'level': self.level,
+            'running': self.running,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'shed': self.shed
+        }
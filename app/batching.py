@@ -0,0 +1,42 @@
+def token_budget_batches(lengths: list[int], max_tokens: int, max_batch_size: int=None) -> list[list[int]]:
+    '''
+    splits indexes of sequences with the given token lengths into consecutive batches, 
+    with padding='longest' each batch costs batch size x longest sequence tokens, 
+    so batches are closed before that exceeds max_tokens
+    '''
+    batches, batch, longest = [], [], 0
+    for i, length in enumerate(lengths):
+        new_longest = max(longest, length)
+        full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (new_longest*(len(batch)+1) > max_tokens or full):
+            batches.append(batch)
+            batch, new_longest = [], length
+        batch.append(i)
+        longest = new_longest
+    if batch:
+        batches.append(batch)
+    return batches
+
+def bucketed_batches(lengths: list[int], max_tokens: int, max_padding: float=0.25, max_batch_size: int=None) -> list[list[int]]:
+    '''
+    splits indexes of sequences into batches of similar length: sequences are sorted by length, 
+    and a batch is closed before batch size x longest sequence exceeds max_tokens or its padding 
+    exceeds max_padding x its real tokens, None only applies the token budget
+    results must be scattered back by index, batches are not in input order
+    '''
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches, batch, tokens = [], [], 0
+    for i in order:
+        length = lengths[i]
+        # sorted, so the new sequence is the longest
+        padded = length*(len(batch)+1)
+        full = max_batch_size is not None and len(batch) >= max_batch_size
+        wasteful = max_padding is not None and padded-tokens-length > max_padding*(tokens+length)
+        if batch and (padded > max_tokens or full or wasteful):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(i)
+        tokens += length
+    if batch:
+        batches.append(batch)
+    return batches
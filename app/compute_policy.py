@@ -0,0 +1,67 @@
+class AdaptiveComputePolicy:
+    def __init__(self,
+                 min_score: float=None,
+                 max_gap: float=None,
+                 max_contexts: int=None,
+                 min_contexts: int=1,
+                 qa_confidence: float=None,
+                 qa_batch_size: int=1
+                ):
+        '''
+        decides how many reranked contexts are sent to question answering
+            min_score = skip contexts with reranker score below min_score
+            max_gap = skip all contexts after a score drop larger than max_gap,
+                e.g., scores [0.98, 0.05, 0.03] with max_gap=0.5 only answers the first
+            max_contexts = never answer more than max_contexts
+            min_contexts = always answer at least min_contexts (if available)
+            qa_confidence = stop once an answer has QA score >= qa_confidence,
+                contexts are answered in rank order qa_batch_size at a time
+        thresholds assume the reranker's normalized [0, 1] scores
+        '''
+        self.min_score = min_score
+        self.max_gap = max_gap
+        self.max_contexts = max_contexts
+        self.min_contexts = min_contexts
+        self.qa_confidence = qa_confidence
+        self.qa_batch_size = qa_batch_size
+        self.requests = 0
+        self.contexts_retrieved = 0
+        self.contexts_answered = 0
+        self.early_exits = 0
+
+    def select(self, contexts: list[dict]) -> int:
+        '''
+        returns number of contexts (in rank order) to answer
+        '''
+        n = len(contexts)
+        if self.max_contexts is not None:
+            n = min(n, self.max_contexts)
+        scores = [float(context['score']) for context in contexts[:n]]
+        for i, score in enumerate(scores):
+            if self.min_score is not None and score < self.min_score:
+                n = i
+                break
+            if self.max_gap is not None and i+1 < len(scores) and score-scores[i+1] > self.max_gap:
+                n = i+1
+                break
+        return max(n, min(self.min_contexts, len(contexts)))
+
+    def is_confident(self, answers: list[dict]) -> bool:
+        if self.qa_confidence is None:
+            return False
+        return any(float(answer['score']) >= self.qa_confidence for answer in answers)
+
+    def record(self, retrieved: int, answered: int, early_exit: bool) -> None:
+        self.requests += 1
+        self.contexts_retrieved += retrieved
+        self.contexts_answered += answered
+        self.early_exits += int(early_exit)
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'contexts_retrieved': self.contexts_retrieved,
+            'contexts_answered': self.contexts_answered,
+            'avg_contexts_answered': self.contexts_answered/self.requests if self.requests else 0.0,
+            'early_exits': self.early_exits
+        }
@@ -0,0 +1,70 @@
+from nearest_neighbors_service.sparse_encoder import terms
+import re
+
+# sentence = text up to and including ., ! or ? (and closing quotes or brackets) plus whitespace
+_SENTENCE = re.compile(r'.*?(?:[.!?]+["\')\]]*(?:\s+|$)|$)', re.S)
+
+def sentences(text: str) -> list[tuple[int, int]]:
+    '''
+    (start, end) character offsets of the sentences of text, covering all of text
+    '''
+    spans = []
+    for match in _SENTENCE.finditer(text):
+        if match.end() > match.start():
+            spans.append((match.start(), match.end()))
+    return spans
+
+class ContextTrimmer:
+    def __init__(self, max_words: int=120):
+        '''
+        trims passages to the sentences most relevant to the question before extractive QA
+            max_words = passages longer than this are cut to the contiguous window of sentences
+                with at most max_words words sharing the most terms with the question
+        relevance is term overlap (stop words removed), so trimming needs no model inference,
+        a single sentence longer than max_words is kept whole
+        '''
+        self.max_words = max_words
+        self.passages = 0
+        self.trimmed = 0
+        self.words_in = 0
+        self.words_out = 0
+
+    def trim(self, question: str, text: str) -> tuple[str, int]:
+        '''
+        returns (window of text, character offset of the window in text)
+        '''
+        words = len(text.split())
+        self.passages += 1
+        self.words_in += words
+        if words <= self.max_words:
+            self.words_out += words
+            return text, 0
+        spans = sentences(text)
+        question_terms = set(terms(question))
+        lengths = [len(text[s:e].split()) for s, e in spans]
+        scores = [len(question_terms.intersection(terms(text[s:e]))) for s, e in spans]
+        # best window by sliding over sentences, ties keep the earliest window
+        best, best_score = (0, 1), -1
+        score, length, first = 0, 0, 0
+        for last in range(len(spans)):
+            score += scores[last]
+            length += lengths[last]
+            while length > self.max_words and first < last:
+                score -= scores[first]
+                length -= lengths[first]
+                first += 1
+            if score > best_score:
+                best, best_score = (first, last+1), score
+        start, end = spans[best[0]][0], spans[best[1]-1][1]
+        window = text[start:end]
+        self.trimmed += 1
+        self.words_out += len(window.split())
+        return window, start
+
+    def stats(self) -> dict:
+        return {
+            'passages': self.passages,
+            'trimmed': self.trimmed,
+            'words_in': self.words_in,
+            'words_out': self.words_out
+        }
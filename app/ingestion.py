@@ -0,0 +1,170 @@
+'''
+offline steps over the passage files, run after the passages are indexed and before serving
+
+passages are json lines with at least id (passage index 0, 1, ..., as for the titles and hrefs)
+and text, sorted by id, e.g., the files inserted into the vector database with DB_Entry.from_json
+
+writes the passage store (see passage_store.py) and the passage tokens for the reranker and
+QA tokenizers (see token_store.py):
+    python ingestion.py /data/passages.jsonl
+with --sparse-vectors host:port, adds BM25 sparse vectors to the passages in Qdrant for
+SearchType.HYBRID (the collection must be created with QDRANT_Client.create_index sparse=True)
+
+with --embeddings and --vector-db host:port, indexes passage embeddings in Qdrant first,
+reduced to fewer dimensions with --projection (see nearest_neighbors_service/projection.py,
+serve with EMBEDDING_PROJECTION set to the same file)
+'''
+from transformers import AutoTokenizer
+from token_store import TokenStore, RERANKER_TOKENS, QA_TOKENS
+from passage_store import PASSAGES
+from string_table import StringTable
+from nearest_neighbors_service.qdrantdb_client import QDRANT_Client, DB_Entry, Distance
+from nearest_neighbors_service.sparse_encoder import BM25_Encoder
+from nearest_neighbors_service.projection import Projection, load_projection
+import numpy as np
+import argparse, asyncio, json
+
+# must match the tokenizers of the models loaded by the app
+RERANKER_TOKENIZER = 'cross-encoder/ms-marco-MiniLM-L6-v2'
+QA_TOKENIZER = 'distilbert/distilbert-base-cased-distilled-squad'
+
+def read_passages(path: str):
+    '''
+    yields the text of passages 0, 1, ... from the json lines in path,
+    passages missing from the file are empty
+    '''
+    expected = 0
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            passage = json.loads(line)
+            i = int(passage['id'])
+            if i < expected:
+                raise ValueError(f'passages must be sorted by id, found {i} after {expected-1}')
+            for _ in range(expected, i):
+                yield ''
+            yield passage['text']
+            expected = i+1
+
+def _batches(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def passage_tokens(texts, tokenizer, batch_size: int=1024):
+    '''
+    yields (token ids, character spans) without special tokens for each text,
+    empty passages get no tokens and are tokenized at query time
+    '''
+    for batch in _batches(texts, batch_size):
+        tokens = tokenizer(batch, add_special_tokens=False, return_offsets_mapping=True)
+        for ids, spans in zip(tokens['input_ids'], tokens['offset_mapping']):
+            yield np.array(ids, dtype=np.int32), np.array(spans, dtype=np.int32).reshape(-1, 2)
+
+def build_token_store(passages_path: str, tokenizer_name: str, path: str) -> int:
+    '''
+    tokenizes the passages with tokenizer_name and writes the token store to path,
+    returns the number of passages
+    '''
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    return TokenStore.build(passage_tokens(read_passages(passages_path), tokenizer), path, tokenizer.name_or_path)
+
+def build_passage_store(passages_path: str, path: str) -> int:
+    '''
+    writes the passage text indexed by id to path, returns the number of passages
+    '''
+    return StringTable.build(read_passages(passages_path), path)
+
+def read_embeddings(path: str):
+    '''
+    yields (passage id, embedding, other fields) from json lines with id and embedding
+    '''
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                passage = json.loads(line)
+                embedding = np.asarray(passage.pop('embedding'), dtype=np.float32)
+                yield passage['id'], embedding, {name: str(value) for name, value in passage.items()}
+
+async def index_embeddings(
+            embeddings_path: str, 
+            client: QDRANT_Client, 
+            index: str='wiki', 
+            projection: Projection=None, 
+            sparse: bool=False,
+            batch_size: int=10000
+        ) -> int:
+    '''
+    creates index and inserts the passage embeddings, point ids = passage ids,
+    projection = reduces embeddings before insert_group, the index has the projected width
+    sparse = create the index with BM25 sparse vectors, see write_sparse_vectors
+    returns the number of passages
+    '''
+    n = 0
+    for batch in _batches(read_embeddings(embeddings_path), batch_size):
+        embeddings = np.stack([embedding for _, embedding, _ in batch])
+        if projection is not None:
+            embeddings = projection(embeddings)
+        if n == 0:
+            await client.create_index(index, embeddings.shape[1], Distance.COSINE, np.float32, sparse=sparse)
+        entries = [DB_Entry(str(i), embedding, fields) for (i, _, fields), embedding in zip(batch, embeddings)]
+        if not await client.insert_group(entries):
+            raise RuntimeError(f'failed to insert passages {entries[0].key} to {entries[-1].key}')
+        n += len(entries)
+    return n
+
+async def write_sparse_vectors(passages_path: str, client: QDRANT_Client, index: str='wiki', batch_size: int=10000) -> int:
+    '''
+    sets the BM25 sparse vector of each passage, point ids = passage ids,
+    returns the number of passages
+    '''
+    avg_length = BM25_Encoder.average_length(text for text in read_passages(passages_path) if text)
+    encoder = BM25_Encoder(avg_length=avg_length)
+    passages = ((i, text) for i, text in enumerate(read_passages(passages_path)) if text)
+    n = 0
+    for batch in _batches(passages, batch_size):
+        ids = [i for i, _ in batch]
+        if not await client.update_sparse(index, ids, [encoder.encode_passage(text) for _, text in batch]):
+            raise RuntimeError(f'failed to update sparse vectors of passages {ids[0]} to {ids[-1]}')
+        n += len(batch)
+    return n
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('passages', help='json lines with id and text, sorted by id')
+    parser.add_argument('--passage-store', default=PASSAGES)
+    parser.add_argument('--reranker-tokens', default=RERANKER_TOKENS)
+    parser.add_argument('--qa-tokens', default=QA_TOKENS)
+    parser.add_argument('--embeddings', default=None, help='json lines with id and embedding to index in --vector-db')
+    parser.add_argument('--vector-db', default=None, help='host:port of Qdrant for --embeddings')
+    parser.add_argument('--projection', default=None, help='projection.py output applied to --embeddings')
+    parser.add_argument('--sparse-vectors', default=None, help='host:port of Qdrant to add BM25 sparse vectors to')
+    parser.add_argument('--index', default='wiki', help='Qdrant collection for --embeddings and --sparse-vectors')
+    args = parser.parse_args()
+    if args.embeddings:
+        host, port = args.vector_db.rsplit(':', 1)
+        projection = load_projection(args.projection)
+        n = asyncio.run(index_embeddings(
+                args.embeddings, 
+                QDRANT_Client(host, port), 
+                args.index, 
+                projection, 
+                sparse = args.sparse_vectors is not None
+            ))
+        width = f'{projection.width} dimensions' if projection is not None else 'full width'
+        print(f'indexed {n} passage embeddings ({width}) in {args.index}')
+    n = build_passage_store(args.passages, args.passage_store)
+    print(f'wrote {n} passages to {args.passage_store}')
+    for name, path in [(RERANKER_TOKENIZER, args.reranker_tokens), (QA_TOKENIZER, args.qa_tokens)]:
+        n = build_token_store(args.passages, name, path)
+        print(f'wrote {n} passages tokenized with {name} to {path}')
+    if args.sparse_vectors:
+        host, port = args.sparse_vectors.rsplit(':', 1)
+        n = asyncio.run(write_sparse_vectors(args.passages, QDRANT_Client(host, port), args.index))
+        print(f'wrote BM25 sparse vectors of {n} passages to {args.index}')
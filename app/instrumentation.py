@@ -0,0 +1,119 @@
+from metrics import STAGE_SECONDS, BACKEND_EVENTS
+from contextlib import contextmanager
+import contextvars, logging, time
+
+logger = logging.getLogger(__name__)
+
+class Trace:
+    '''
+    stage timings (ms) for a single request, stages that run more than once are summed
+        labels = added to the stage metrics, e.g., search_type
+        spans = (stage, start ms since the trace started, duration ms) for each stage, if enabled
+        degraded = stages dropped from the response, e.g., fulltext_search:timeout
+    '''
+    def __init__(self, spans: bool=False):
+        self.stages = {}
+        self.labels = {}
+        self.degraded = []
+        self.spans = [] if spans else None
+        self.start = time.perf_counter()
+
+    def add(self, name: str, ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0)+ms
+
+    def server_timing(self) -> str:
+        '''
+        value for the Server-Timing http header, e.g., embed;dur=4.1, rerank;dur=35.2
+        '''
+        return ', '.join(f'{name};dur={ms:.2f}' for name, ms in self.stages.items())
+
+    def describe(self) -> str:
+        '''
+        spans in start order, e.g., embed@0.1+4.2ms, vector_search@4.4+8.0ms, ...
+        '''
+        if self.spans is None:
+            return self.server_timing()
+        return ', '.join(f'{name}@{start:.1f}+{ms:.1f}ms' for name, start, ms in sorted(self.spans, key = lambda x: x[1]))
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+def start_trace(spans: bool=False) -> Trace:
+    '''
+    starts recording stages for the current request, tasks created afterwards share the trace
+    '''
+    trace = Trace(spans)
+    _trace.set(trace)
+    return trace
+
+def current_trace() -> Trace | None:
+    return _trace.get()
+
+@contextmanager
+def request_trace(**labels):
+    '''
+    adds labels (e.g., search_type) to stages recorded in the current trace, or if there is
+    none (library callers, e.g., benchmarks), records the enclosed call in its own trace,
+    so separate calls don't share stages and degradation, yields the trace
+    '''
+    trace, token = _trace.get(), None
+    if trace is None:
+        trace = Trace()
+        token = _trace.set(trace)
+    trace.labels.update(labels)
+    try:
+        yield trace
+    finally:
+        if token is not None:
+            try:
+                _trace.reset(token)
+            except ValueError:
+                # async generator resumed in another context
+                _trace.set(None)
+
+def degrade(name: str, reason: str) -> None:
+    '''
+    records that stage name was dropped from the current response because of reason,
+    degraded responses should not be cached
+    '''
+    BACKEND_EVENTS.inc(stage=name, event=reason)
+    note_degraded(f'{name}:{reason}')
+    logger.warning(f'{name} dropped from response: {reason}')
+
+def note_degraded(description: str) -> None:
+    '''
+    marks the current response as degraded, e.g., admission:level2
+    '''
+    trace = _trace.get()
+    if trace is not None:
+        trace.degraded.append(description)
+
+def is_degraded() -> bool:
+    trace = _trace.get()
+    return trace is not None and bool(trace.degraded)
+
+def backend_name(component) -> str:
+    '''
+    backend label for a model or client, its class name, e.g., QDRANT_Client, OpenVINO_Reranker
+    '''
+    return type(component).__name__
+
+@contextmanager
+def stage(name: str, backend: str=''):
+    '''
+    times the enclosed block, adds it to the current trace (if any) as stage name, and
+    records it in the stage latency histogram labeled with backend and the trace labels
+    '''
+    s = time.perf_counter()
+    try:
+        yield
+    finally:
+        e = time.perf_counter()
+        trace = _trace.get()
+        search_type = ''
+        if trace is not None:
+            trace.add(name, 1000*(e-s))
+            if trace.spans is not None:
+                trace.spans.append((name, 1000*(s-trace.start), 1000*(e-s)))
+            search_type = trace.labels.get('search_type', '')
+        STAGE_SECONDS.observe(e-s, stage=name, search_type=search_type, backend=backend)
+        logger.debug(f'{name} ({backend}): {1000*(e-s):.2f} ms')
@@ -1,30 +1,273 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import os
-from nearest_neighbors_service.ann_service import SearchType
+from contextlib import asynccontextmanager
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from pydantic import BaseModel
+import os, json, logging, time
+from nearest_neighbors_service.ann_service import SearchType, Fusion
 from qa_manager import QA_Manager
+from response_cache import ResponseCache, make_store
+from semantic_cache import SemanticCache
+from compute_policy import AdaptiveComputePolicy
+from context_trimming import ContextTrimmer
+from admission import AdmissionController, Overloaded
+from instrumentation import start_trace, current_trace
+from metrics import REGISTRY, CONTENT_TYPE, REQUEST_SECONDS, record_stats
+
+def optional_env(name, cast):
+    '''
+    returns cast(value) of environment variable name, or None if unset
+    '''
+    value = os.getenv(name, '')
+    return cast(value) if value else None
+
+def host_ports(value: str) -> list[tuple]:
+    '''
+    parses host1:port1,host2:port2
+    '''
+    return [tuple(entry.strip().rsplit(':', 1)) for entry in value.split(',') if entry.strip()]
+
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    format='%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
 
 vdb_host = os.getenv("VDB_HOST", "localhost")
 vdb_port = os.getenv('VDB_PORT', '6333')
+# VDB_GRPC_PORT (e.g., 6334) queries Qdrant over gRPC instead of REST
+vdb_grpc_port = optional_env('VDB_GRPC_PORT', str)
 ft_host = os.getenv("FT_HOST", "localhost")
 ft_port = os.getenv("FT_PORT", 9200)
 qa_type = os.getenv('QA_TYPE', 'openvino')
 inference_host = os.getenv('INFERENCE_HOST', 'localhost')
 inference_port = os.getenv('INFERENCE_PORT', 9000)
+# FAKE_BACKENDS=1 replaces models, Qdrant, OpenSearch and Triton with in-process fakes,
+# FAKE_*_MS set their injected latency, for benchmarking the server without network or models
+fake_backends = os.getenv('FAKE_BACKENDS', '') == '1'
 # for running Node.js server on same machine
 allow_CORS_origin = os.getenv('ALLOW_CORS_ORIGIN', 'http://localhost:3000')
+# response cache, set RESPONSE_CACHE_SIZE=0 to disable
+# RESPONSE_CACHE_STORE = path to sqlite file or redis://host:port for persistent tier
+response_cache_size = int(os.getenv('RESPONSE_CACHE_SIZE', 10000))
+response_cache_mb = int(os.getenv('RESPONSE_CACHE_MB', 64))
+response_cache_ttl = float(os.getenv('RESPONSE_CACHE_TTL', 3600))
+response_cache_store = os.getenv('RESPONSE_CACHE_STORE', '')
+# semantic cache reuses responses for questions with cosine similarity >= threshold, opt-in
+# (SEMANTIC_CACHE_SIZE > 0) as similar questions about different entities or numbers can
+# exceed the threshold, check the false hit rate first (benchmarks/semantic_false_hits.py)
+semantic_cache_size = int(os.getenv('SEMANTIC_CACHE_SIZE', 0))
+semantic_cache_threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+semantic_cache_ttl = float(os.getenv('SEMANTIC_CACHE_TTL', 3600))
+# number of (question, passage) pairs to cache reranker scores and answer spans for, 0 disables
+score_cache_size = int(os.getenv('SCORE_CACHE_SIZE', 100000))
+# hybrid search: FUSION = CONCAT, RRF or NORM
+# RERANK_TOP_N = number of fused results to rerank, unset reranks all, 0 skips reranking
+fusion = Fusion.from_string(os.getenv('FUSION', 'CONCAT'))
+rerank_top_n = optional_env('RERANK_TOP_N', int)
+# adaptive question answering compute, unset values are not applied, see AdaptiveComputePolicy
+# batch endpoint: questions per pipeline run, concurrent runs, and max questions per request
+batch_size = int(os.getenv('BATCH_SIZE', 32))
+batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', 2))
+batch_max_questions = int(os.getenv('BATCH_MAX_QUESTIONS', 1000))
+compute_policy_args = {
+    'min_score': optional_env('QA_MIN_RERANK_SCORE', float),
+    'max_gap': optional_env('QA_MAX_SCORE_GAP', float),
+    'max_contexts': optional_env('QA_MAX_CONTEXTS', int),
+    'qa_confidence': optional_env('QA_CONFIDENCE', float),
+}
+# passages longer than QA_CONTEXT_MAX_WORDS are trimmed to the sentences most relevant to the 
+# question before question answering, unset answers full passages
+qa_context_max_words = optional_env('QA_CONTEXT_MAX_WORDS', int)
+# retrieval deadlines: a search slower than its timeout is dropped, hybrid search then answers
+# from the other backend (reported in the X-Degraded header and not cached)
+# *_REPLICAS = host:port,... of backend replicas, searches are hedged to a replica after running
+# longer than HEDGE_PERCENTILE of recent latencies, and failed searches are retried there
+vector_timeout = optional_env('VECTOR_SEARCH_TIMEOUT_MS', lambda ms: float(ms)/1000)
+fulltext_timeout = optional_env('FULLTEXT_SEARCH_TIMEOUT_MS', lambda ms: float(ms)/1000)
+hedge_percentile = optional_env('HEDGE_PERCENTILE', float)
+vdb_replicas = host_ports(os.getenv('VDB_REPLICAS', ''))
+ft_replicas = host_ports(os.getenv('FT_REPLICAS', ''))
+# admission control, unset ADMISSION_MAX_CONCURRENT disables it, see AdmissionController
+# beyond ADMISSION_MAX_QUEUE waiting requests (or ADMISSION_MAX_QUEUE_MS of waiting) requests get 503,
+# ADMISSION_DEGRADE_AT = pressures where smaller k, no reranking and vector only search start
+admission_max_concurrent = optional_env('ADMISSION_MAX_CONCURRENT', int)
+admission_args = {
+    'max_queue': int(os.getenv('ADMISSION_MAX_QUEUE', 128)),
+    'max_queue_delay': optional_env('ADMISSION_MAX_QUEUE_MS', lambda ms: float(ms)/1000),
+    'degrade_at': tuple(float(p) for p in os.getenv('ADMISSION_DEGRADE_AT', '1.0,1.5,2.0').split(',')),
+    'cooldown': float(os.getenv('ADMISSION_COOLDOWN_S', 5)),
+    'degraded_k': optional_env('ADMISSION_DEGRADED_K', int),
+}
+# OpenVINO compiled model cache, reused across restarts and workers, empty disables
+ov_cache_dir = os.getenv('OV_CACHE_DIR', './models/ov_cache') or None
+# query embedding model runtime: torch, openvino (FP32), openvino_int8 or triton,
+# OpenVINO models are exported with nearest_neighbors_service/embedding_models.py
+embedding_type = os.getenv('EMBEDDING_TYPE', 'torch')
+# EMBEDDING_PROJECTION = projection from nearest_neighbors_service/projection.py, for a vector
+# index built from reduced width embeddings (ingestion.py --projection), unset uses full width
+embedding_projection = os.getenv('EMBEDDING_PROJECTION', '') or None
+# reranker runtime: openvino (in process) or triton
+# models set to triton (EMBEDDING_TYPE, RERANKER_TYPE, QA_TYPE) run on the Triton server at
+# INFERENCE_HOST:INFERENCE_PORT, whose dynamic batching combines requests from all API workers
+reranker_type = os.getenv('RERANKER_TYPE', 'openvino')
+# PIPELINED=1 overlaps the stages of /ask requests: full-text search runs during query embedding, 
+# and reranking and question answering start on the first search results while the other search runs
+pipelined = os.getenv('PIPELINED', '0') == '1'
+# questions per synthetic warmup batch before /ready succeeds, 0 skips warmup
+warmup_batch_size = int(os.getenv('WARMUP_BATCH_SIZE', 8))
+# requests slower than SLOW_REQUEST_MS are logged with their stage spans, 0 logs every request
+slow_request_ms = optional_env('SLOW_REQUEST_MS', float)
 
-manager = QA_Manager.make_default_manager(
-                        vdb_host, 
-                        vdb_port, 
-                        ft_host,
-                        ft_port,
-                        qa_type,
-                        inference_host, 
-                        inference_port
+response_cache = None
+if response_cache_size > 0:
+    response_cache = ResponseCache(
+                        max_entries = response_cache_size,
+                        max_bytes = response_cache_mb*2**20,
+                        ttl = response_cache_ttl,
+                        store = make_store(response_cache_store)
                     )
 
-app = FastAPI()
+semantic_cache = None
+if semantic_cache_size > 0:
+    # Snowflake/snowflake-arctic-embed-s produces 384 dimensional embeddings
+    semantic_cache = SemanticCache(
+                        dim = 384,
+                        max_entries = semantic_cache_size,
+                        threshold = semantic_cache_threshold,
+                        ttl = semantic_cache_ttl
+                    )
+
+compute_policy = None
+if any(value is not None for value in compute_policy_args.values()):
+    compute_policy = AdaptiveComputePolicy(**compute_policy_args)
+
+context_trimmer = None
+if qa_context_max_words is not None:
+    context_trimmer = ContextTrimmer(qa_context_max_words)
+
+admission = None
+if admission_max_concurrent is not None:
+    admission = AdmissionController(admission_max_concurrent, **admission_args)
+
+manager = None
+# models and page info loaded before forking workers, see preload
+preloaded = None
+
+async def load_manager() -> QA_Manager:
+    if fake_backends:
+        fake = QA_Manager.make_fake_manager(
+                            embed_ms = float(os.getenv('FAKE_EMBED_MS', 0)),
+                            search_ms = float(os.getenv('FAKE_SEARCH_MS', 0)),
+                            rerank_ms_per_pair = float(os.getenv('FAKE_RERANK_MS_PER_PAIR', 0)),
+                            qa_ms = float(os.getenv('FAKE_QA_MS', 0)),
+                            qa_ms_per_pair = float(os.getenv('FAKE_QA_MS_PER_PAIR', 0)),
+                            search_tail_ms = float(os.getenv('FAKE_SEARCH_TAIL_MS', 0)),
+                            search_tail_probability = float(os.getenv('FAKE_SEARCH_TAIL_PROBABILITY', 0)),
+                            replicas = int(os.getenv('FAKE_REPLICAS', 0)),
+                            ids_only = os.getenv('FAKE_IDS_ONLY', '0') == '1',
+                            vector_timeout = vector_timeout,
+                            fulltext_timeout = fulltext_timeout,
+                            hedge_percentile = hedge_percentile,
+                            response_cache = response_cache,
+                            semantic_cache = semantic_cache,
+                            compute_policy = compute_policy,
+                            batch_size = batch_size,
+                            max_concurrent_batches = batch_concurrency,
+                            admission = admission,
+                            context_trimmer = context_trimmer,
+                            pipelined = pipelined
+                        )
+        fake.nearest_neighbor_service.fusion = fusion
+        fake.nearest_neighbor_service.rerank_top_n = rerank_top_n
+        return fake
+    config = dict(
+                            vector_db_host = vdb_host, 
+                            vector_db_port = vdb_port, 
+                            vector_db_grpc_port = vdb_grpc_port,
+                            fulltext_host = ft_host,
+                            fulltext_port = ft_port,
+                            qa_type = qa_type,
+                            inference_host = inference_host, 
+                            inference_port = inference_port,
+                            response_cache = response_cache,
+                            semantic_cache = semantic_cache,
+                            score_cache_size = score_cache_size,
+                            fusion = fusion,
+                            rerank_top_n = rerank_top_n,
+                            compute_policy = compute_policy,
+                            batch_size = batch_size,
+                            max_concurrent_batches = batch_concurrency,
+                            ov_cache_dir = ov_cache_dir,
+                            embedding_type = embedding_type,
+                            embedding_projection = embedding_projection,
+                            reranker_type = reranker_type,
+                            vector_db_replicas = vdb_replicas,
+                            fulltext_replicas = ft_replicas,
+                            vector_timeout = vector_timeout,
+                            fulltext_timeout = fulltext_timeout,
+                            hedge_percentile = hedge_percentile,
+                            admission = admission,
+                            context_trimmer = context_trimmer,
+                            pipelined = pipelined
+                        )
+    if preloaded is not None:
+        return QA_Manager.make_default_manager(**config, **preloaded)
+    return await QA_Manager.load_default_manager(**config)
+
+def preload() -> None:
+    '''
+    loads models (read, not compiled) and page info once in the pre-fork master (prefork.py),
+    forked workers share them copy-on-write, compile the models (compile_preloaded) and 
+    create their manager from them in lifespan
+    '''
+    global preloaded
+    if fake_backends:
+        return
+    preloaded = {
+        'models': QA_Manager.load_default_models(
+                            qa_type, 
+                            score_cache_size, 
+                            ov_cache_dir, 
+                            embedding_type, 
+                            reranker_type, 
+                            inference_host, 
+                            inference_port, 
+                            compile = False
+                        ),
+        'hrefs': QA_Manager.load_page_info('/data/popular_hrefs.txt', shared=True),
+        'titles': QA_Manager.load_page_info('/data/popular_titles.txt', shared=True),
+    }
+
+def compile_preloaded(num_threads: int=None) -> None:
+    '''
+    compiles preloaded OpenVINO models in a forked worker, with num_threads inference threads
+    '''
+    if preloaded is not None:
+        QA_Manager.compile_models(preloaded['models'], num_threads)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''
+    loads models (concurrently, in worker threads) and warms them up after the server starts,
+    / answers liveness checks meanwhile and /ready returns 503 until this finishes
+    '''
+    global manager
+    s = time.perf_counter()
+    loaded = await load_manager()
+    logger.info(f'models loaded in {time.perf_counter()-s:.1f} s')
+    if warmup_batch_size > 0:
+        await loaded.warmup(warmup_batch_size)
+        logger.info(f'ready in {time.perf_counter()-s:.1f} s')
+    manager = loaded
+    yield
+
+def get_manager() -> QA_Manager:
+    if manager is None:
+        raise HTTPException(status_code=503, detail='loading models')
+    return manager
+
+app = FastAPI(lifespan=lifespan)
 
 if allow_CORS_origin:
     origins = [allow_CORS_origin]
@@ -36,10 +279,58 @@ if allow_CORS_origin:
         allow_headers=["*"],
     )
 
+@app.middleware('http')
+async def add_server_timing(request: Request, call_next):
+    '''
+    reports per stage latency (embed, vector_search, fulltext_search, rerank, qa) in the
+    Server-Timing header, streaming responses only include stages finished before the first byte
+    records request latency and logs slow requests, X-Degraded lists searches dropped from
+    the response, e.g., fulltext_search:timeout
+    '''
+    trace = start_trace(spans=slow_request_ms is not None)
+    response = await call_next(request)
+    elapsed = time.perf_counter()-trace.start
+    if trace.stages:
+        response.headers['Server-Timing'] = trace.server_timing()
+    if trace.degraded:
+        response.headers['X-Degraded'] = ', '.join(trace.degraded)
+    # label by route template, unmatched paths share one label
+    route = request.scope.get('route')
+    path = route.path if route is not None else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, path=path, status=response.status_code)
+    if slow_request_ms is not None and 1000*elapsed >= slow_request_ms:
+        logger.warning(f'slow request {request.url.path} {1000*elapsed:.1f} ms: {trace.describe()}')
+    return response
+
+@app.exception_handler(Overloaded)
+async def shed(request: Request, exc: Overloaded):
+    '''
+    request rejected by admission control
+    '''
+    return JSONResponse(status_code=503, content={'detail': 'overloaded'}, headers={'Retry-After': '1'})
+
+@app.exception_handler(TimeoutError)
+async def search_timeout(request: Request, exc: TimeoutError):
+    '''
+    every search backend missed its deadline
+    '''
+    return JSONResponse(status_code=504, content={'detail': 'search backends timed out'})
+
 @app.get("/")
 async def root():
+    '''
+    liveness, the process is up (models may still be loading)
+    '''
     return {"message": "loaded successfully"}
 
+@app.get('/ready')
+async def ready():
+    '''
+    readiness, models are loaded and warmed up
+    '''
+    get_manager()
+    return {'ready': True}
+
 @app.get('/ask')
 async def get_answer(question: str, search_type: str) -> list[dict]:
     '''
@@ -48,6 +339,76 @@ async def get_answer(question: str, search_type: str) -> list[dict]:
         VEC = vector only
         FT = full-text only
         VEC_FT = hybrid search with reranking
+        HYBRID = hybrid search in one vector database request (BM25 sparse vectors), with reranking
+    '''
+    search_type = SearchType.from_string(search_type)
+    return await get_manager().answer(question, search_type)
+
+@app.get('/ask/stream')
+async def stream_answer(question: str, search_type: str, stream_format: str=Query('sse', alias='format')):
+    '''
+    same as /ask, but streams results as they are computed:
+        - contexts event with the retrieved passages (title, href, text) after reranking
+        - one answer event per context as soon as question answering on it finishes
+        - done event, with the searches dropped from the response (degraded) if any
+    format = sse for Server-Sent Events, ndjson for newline delimited json 
     '''
     search_type = SearchType.from_string(search_type)
-    return await manager.answer(question, search_type)
+    stream = get_manager().answer_stream(question, search_type)
+    # wait for the contexts event before responding, so shed or failed requests get an error status
+    first = await anext(stream)
+
+    async def events():
+        yield first
+        async for event in stream:
+            yield event
+
+    def done() -> dict:
+        trace = current_trace()
+        return {'degraded': trace.degraded} if trace and trace.degraded else {}
+    
+    async def sse():
+        async for event, data in events():
+            yield f'event: {event}\ndata: {json.dumps(data, default=float)}\n\n'
+        yield f'event: done\ndata: {json.dumps(done())}\n\n'
+
+    async def ndjson():
+        async for event, data in events():
+            yield json.dumps({'event': event, 'data': data}, default=float)+'\n'
+        yield json.dumps({'event': 'done', 'data': done()})+'\n'
+
+    if stream_format == 'ndjson':
+        return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+    return StreamingResponse(sse(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+class BatchRequest(BaseModel):
+    questions: list[str]
+    search_type: str = 'VEC_FT'
+
+@app.post('/ask/batch')
+async def get_answers_batch(request: BatchRequest) -> list[list[dict]]:
+    '''
+    returns possible answers for each question, in the same order as request.questions,
+    see /ask for search_type
+    '''
+    if len(request.questions) > batch_max_questions:
+        raise HTTPException(status_code=413, detail=f'at most {batch_max_questions} questions per request')
+    search_type = SearchType.from_string(request.search_type)
+    return await get_manager().answer_batch(request.questions, search_type)
+
+@app.get('/stats')
+async def get_stats() -> dict:
+    '''
+    returns cache hit/miss/eviction counters
+    '''
+    return get_manager().stats()
+
+@app.get('/metrics')
+async def get_metrics() -> Response:
+    '''
+    Prometheus metrics: stage and request latency histograms, inference token and 
+    batch size counters, and the /stats counters
+    '''
+    if manager is not None:
+        record_stats(manager.stats())
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
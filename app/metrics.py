@@ -0,0 +1,187 @@
+'''
+minimal Prometheus metrics (counters, gauges and histograms with labels),
+rendered in the text exposition format for the /metrics endpoint
+'''
+import bisect, math, threading
+
+def _format_labels(names: tuple, values: tuple, extra: str='') -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{'+','.join(labels)+'}' if labels else ''
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: list[str]=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        # label values are escaped once, when a label set is first seen
+        return tuple(str(labels.get(name, '')).replace('\\', '\\\\').replace('"', '\\"') for name in self.labelnames)
+
+    def get(self, **labels) -> float:
+        '''
+        current value of a counter or gauge, 0 if the labels were never set
+        '''
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                    for key, value in self._values.items()]
+
+    def render(self) -> str:
+        header = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        return '\n'.join(header+self.samples())
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0)+amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0)+amount
+
+# seconds, from 1 ms to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: list[str]=(), buckets: tuple=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))+(math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # [count per bucket, sum, count], buckets are made cumulative when rendered
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0]*len(self.buckets), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = 'le="'+_format_value(bound)+'"'
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f'metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values())+'\n'
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+        'qa_stage_duration_seconds',
+        'latency of pipeline stages (embed, vector_search, fulltext_search, rerank, trim, qa, postprocess)',
+        ['stage', 'search_type', 'backend']
+    ))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+        'qa_http_request_duration_seconds',
+        'http request latency, time to first byte for streaming responses',
+        ['path', 'status']
+    ))
+INFERENCE_TOKENS = REGISTRY.register(Counter(
+        'qa_inference_tokens_total',
+        'tokens sent to models, kind = input (real tokens) or padded (including padding)',
+        ['model', 'kind']
+    ))
+INFERENCE_BATCH_SIZE = REGISTRY.register(Histogram(
+        'qa_inference_batch_size',
+        'sequences per inference batch',
+        ['model'],
+        buckets = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+    ))
+BACKEND_EVENTS = REGISTRY.register(Counter(
+        'qa_backend_events_total',
+        'retrieval backend events, event = hedge, failover, timeout or error (the search was dropped)',
+        ['stage', 'event']
+    ))
+ADMISSION_LEVEL = REGISTRY.register(Gauge(
+        'qa_admission_degradation_level',
+        'active degradation level, 0 = full quality, 1 = smaller k, 2 = no reranking, 3 = vector only'
+    ))
+ADMISSION_REQUESTS = REGISTRY.register(Gauge(
+        'qa_admission_requests',
+        'requests admitted and running, or waiting for a slot',
+        ['state']
+    ))
+ADMISSION_SHED = REGISTRY.register(Counter(
+        'qa_admission_shed_total',
+        'requests rejected with 503, reason = queue_full or queue_timeout',
+        ['reason']
+    ))
+ADMISSION_QUEUE_SECONDS = REGISTRY.register(Histogram(
+        'qa_admission_queue_seconds',
+        'time requests waited for an admission slot'
+    ))
+COMPONENT_STATS = REGISTRY.register(Gauge(
+        'qa_component_stats',
+        'cache and compute policy counters from /stats, updated on scrape',
+        ['component', 'stat']
+    ))
+
+def record_batch(model: str, lengths: list[int]) -> None:
+    '''
+    records batch size and token counts of one inference batch padded to its longest sequence
+    '''
+    if not lengths:
+        return
+    INFERENCE_BATCH_SIZE.observe(len(lengths), model=model)
+    INFERENCE_TOKENS.inc(sum(lengths), model=model, kind='input')
+    INFERENCE_TOKENS.inc(max(lengths)*len(lengths), model=model, kind='padded')
+
+def record_stats(stats: dict) -> None:
+    '''
+    copies numeric values of {component: {stat: value}} (QA_Manager.stats) into COMPONENT_STATS
+    '''
+    for component, values in stats.items():
+        for stat, value in values.items():
+            if isinstance(value, (int, float)):
+                COMPONENT_STATS.set(value, component=component, stat=stat)
@@ -2,13 +2,30 @@ from sentence_transformers import SentenceTransformer
 from qdrantdb_client import QDRANT_Client
 from opensearch_client import OPENSEARCH_Client
 from reranking_models import OpenVINO_Reranker
+from embedding_models import OpenVINO_Embedding, INT8_FILE_NAME
+from triton_inference_models import Triton_Embedding_Client, Triton_Reranker_Client
+from score_cache import ScoreCache
+from token_store import load_token_store, RERANKER_TOKENS
+from passage_store import PassageStore, load_passage_store, PASSAGES
+from fusion import Fusion, fuse, dedup
+from sparse_encoder import BM25_Encoder
+from projection import Projection, load_projection
+from instrumentation import stage, backend_name, degrade
+from hedging import Hedger
+from fake_clients import FakeEmbedding, Fake_VDB_Client, Fake_Reranker, Latency, synthetic_passages
 from enum import Enum
-import time, logging, asyncio
+import asyncio, inspect, threading
+
+# synthetic inputs for warmup
+WARMUP_QUESTION = 'when was the first passenger railway opened?'
+WARMUP_PASSAGE = ' '.join(['The first public railway to carry passengers opened in 1825.']*16)
 
 class SearchType(Enum):
     VECTOR_AND_FULLTEXT = 0
     VECTOR_ONLY = 1
     FULLTEXT_ONLY = 2
+    # dense and BM25 sparse vectors searched and fused by Qdrant in one request
+    HYBRID = 3
 
     @classmethod
     def from_string(cls, s):
@@ -17,7 +34,24 @@ class SearchType(Enum):
             _type = SearchType.VECTOR_ONLY
         elif s == 'FT':
             _type = SearchType.FULLTEXT_ONLY
+        elif s == 'HYBRID':
+            _type = SearchType.HYBRID
         return _type
+    
+    @property
+    def uses_vectors(self) -> bool:
+        '''
+        needs the query embedding
+        '''
+        return self in [SearchType.VECTOR_AND_FULLTEXT, SearchType.VECTOR_ONLY, SearchType.HYBRID]
+    
+    @property
+    def uses_sparse(self) -> bool:
+        return self == SearchType.HYBRID
+    
+    @property
+    def uses_fulltext(self) -> bool:
+        return self in [SearchType.VECTOR_AND_FULLTEXT, SearchType.FULLTEXT_ONLY]
 
 class NearestNeighborService:
     def __init__(self, 
@@ -26,19 +60,118 @@ class NearestNeighborService:
                  fulltext_client,
                  reranking_model=None, 
                  search_idx='wiki', 
+                 fusion: Fusion=Fusion.CONCAT,
+                 rerank_top_n: int=None,
+                 vector_db_replicas: list=None,
+                 fulltext_replicas: list=None,
+                 vector_timeout: float=None,
+                 fulltext_timeout: float=None,
+                 hedge_percentile: float=None,
+                 passage_store: PassageStore=None,
+                 sparse_encoder=None,
+                 projection: Projection=None,
                 ):
+        '''
+        fusion = how results from vector and full-text search are merged in hybrid search
+        rerank_top_n = number of fused results to rerank, None reranks all, 0 skips reranking
+        *_replicas = clients for replicas of each backend, used for hedging and failover
+        *_timeout = seconds each search may take, in hybrid search a late or failed backend is 
+            dropped and the response is built from the other one (see instrumentation.degrade)
+        hedge_percentile = sends a search to the next replica once it runs longer than this 
+            percentile of recent latencies, see Hedger
+        passage_store = local passage text, then backends only return ids and scores (see 
+            VDB_Client.configure_query) and text is added after fusion, to the contexts that 
+            are reranked and the top k
+        sparse_encoder = query sparse vectors for SearchType.HYBRID, default BM25_Encoder
+        projection = reduces query embeddings to the width of the vector index, the projection
+            applied to passage embeddings before indexing (see projection.py), embed still
+            returns full width embeddings (e.g., for the semantic cache)
+        '''
         self.embedding_model = embedding_model
         self.vector_db_client = vector_db_client
         self.fulltext_client = fulltext_client
         self.reranking_model = reranking_model
         self.search_idx = search_idx
-        # set logging
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
-        console_handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-        console_handler.setFormatter(formatter) 
-        self.logger.addHandler(console_handler)
+        self.fusion = fusion
+        self.rerank_top_n = rerank_top_n
+        self.vector_db_replicas = vector_db_replicas or []
+        self.fulltext_replicas = fulltext_replicas or []
+        self.hedgers = {
+            'vector_search': Hedger('vector_search', vector_timeout, hedge_percentile),
+            'fulltext_search': Hedger('fulltext_search', fulltext_timeout, hedge_percentile),
+            'hybrid_search': Hedger('hybrid_search', vector_timeout, hedge_percentile)
+        }
+        self.passage_store = passage_store
+        self.sparse_encoder = sparse_encoder or BM25_Encoder()
+        self.projection = projection
+        # synchronous models are called from the event loop and from worker threads (query_pipelined),
+        # one call at a time per model as compiled OpenVINO models are not thread safe, see _call
+        self._locks = {'embed': threading.Lock(), 'rerank': threading.Lock()}
+        if passage_store is not None:
+            for client in self._clients('vector_search')+self._clients('fulltext_search'):
+                client.configure_query(return_fields=['id'])
+    
+    @staticmethod
+    def load_embedding_model(embedding_type='torch', cache_dir=None, inference_host='localhost', inference_port='9000', compile=True):
+        '''
+        embedding_type = torch (SentenceTransformer), openvino (FP32), openvino_int8, or triton 
+        for the model on Nvidia Triton Inference Server at inference_host:inference_port,
+        OpenVINO models are exported by embedding_models.py and assumed to be stored in models folder
+        (triton reads the tokenizer and configs from there)
+        cache_dir = OpenVINO compiled model cache
+        compile = False defers OpenVINO compilation to the model's compile_model
+        '''
+        embedding_name = 'Snowflake/snowflake-arctic-embed-s'
+        if embedding_type == 'torch':
+            return SentenceTransformer(embedding_name)
+        embedding_path = './models/snowflake-arctic-embed-s_OV'
+        if embedding_type == 'triton':
+            return Triton_Embedding_Client(inference_host, inference_port, 'snowflake-arctic-embed-s', embedding_path)
+        if embedding_type == 'openvino_int8':
+            return OpenVINO_Embedding(embedding_path, INT8_FILE_NAME, cache_dir, compile=compile)
+        if embedding_type == 'openvino':
+            return OpenVINO_Embedding(embedding_path, cache_dir=cache_dir, compile=compile)
+        raise ValueError(f'unknown embedding type {embedding_type}')
+    
+    @staticmethod
+    def load_reranker(score_cache_size=0, 
+                      cache_dir=None, 
+                      token_store_path=RERANKER_TOKENS, 
+                      reranker_type='openvino', 
+                      inference_host='localhost', 
+                      inference_port='9000',
+                      compile=True
+                     ):
+        '''
+        INT8 cross-encoder, assumes model is stored in models folder
+        cache_dir = OpenVINO compiled model cache, skips compilation on later startups
+        token_store_path = passage tokens from ingestion.py, used if the file exists
+        reranker_type = openvino (in process) or triton for the model on Nvidia Triton Inference 
+            Server at inference_host:inference_port
+        compile = False defers OpenVINO compilation to the model's compile_model
+        '''
+        reranker_name = 'cross-encoder/ms-marco-MiniLM-L6-v2'
+        reranker_path = './models/ms-marco-MiniLM-L6-v2_INT8_PTQ'
+        score_cache = ScoreCache(score_cache_size) if score_cache_size > 0 else None
+        if reranker_type == 'triton':
+            return Triton_Reranker_Client(
+                        inference_host, 
+                        inference_port, 
+                        'ms-marco-MiniLM-L6-v2', 
+                        reranker_name, 
+                        score_cache, 
+                        token_store=load_token_store(token_store_path)
+                    )
+        if reranker_type != 'openvino':
+            raise ValueError(f'unknown reranker type {reranker_type}')
+        return OpenVINO_Reranker(
+                    reranker_name, 
+                    reranker_path, 
+                    score_cache, 
+                    cache_dir=cache_dir, 
+                    token_store=load_token_store(token_store_path),
+                    compile=compile
+                )
     
     @classmethod
     def make_default_service(cls, 
@@ -46,78 +179,388 @@ class NearestNeighborService:
             vector_db_port,
             fulltext_host,
             fulltext_port, 
+            score_cache_size=0,
+            fusion=Fusion.CONCAT,
+            rerank_top_n=None,
+            embedding_model=None,
+            reranker=None,
+            vector_db_replicas=None,
+            fulltext_replicas=None,
+            vector_timeout=None,
+            fulltext_timeout=None,
+            hedge_percentile=None,
+            passage_store_path=PASSAGES,
+            vector_db_grpc_port=None,
+            projection_path=None,
         ):
         '''
         returns hybrid search (embeddings and BM25) service with reranking, runs on CPU
+        score_cache_size > 0 caches reranker scores for that many (question, passage) pairs
+        fusion and rerank_top_n select how hybrid results are merged and reranked, e.g.,
+            Fusion.CONCAT, None = rerank all results with the cross-encoder (default)
+            Fusion.RRF, 0 = reciprocal rank fusion without reranking (lowest latency)
+            Fusion.RRF, n = rerank only the top n fused results
+        embedding_model and reranker = preloaded models, loaded here if not provided
+        *_replicas = (host, port) of backend replicas, see __init__ for timeouts and hedging
+        passage_store_path = passage text from ingestion.py, if the file exists backends return ids only
+        vector_db_grpc_port = Qdrant gRPC port (primary and replicas), None uses REST
+        projection_path = embedding projection from projection.py, for an index built at reduced width
         '''
         # embedding model
-        embedding_name = 'Snowflake/snowflake-arctic-embed-s'
-        embedding_model = SentenceTransformer(embedding_name)
+        if embedding_model is None:
+            embedding_model = cls.load_embedding_model()
         # vector db
-        vdb_client = QDRANT_Client(vector_db_host, vector_db_port)
+        vdb_client = QDRANT_Client(vector_db_host, vector_db_port, vector_db_grpc_port)
         # full-text search
         ft_client = OPENSEARCH_Client(fulltext_host, fulltext_port)
-        # reranker, assumes model is stored in models folder
-        reranker_name = 'cross-encoder/ms-marco-MiniLM-L6-v2'
-        reranker_path = './models/ms-marco-MiniLM-L6-v2_INT8_PTQ'
-        reranker = OpenVINO_Reranker(reranker_name, reranker_path)
+        # reranker
+        if reranker is None:
+            reranker = cls.load_reranker(score_cache_size)
         return NearestNeighborService(
                     embedding_model, 
                     vdb_client, 
                     ft_client,
-                    reranking_model = reranker
+                    reranking_model = reranker,
+                    fusion = fusion,
+                    rerank_top_n = rerank_top_n,
+                    vector_db_replicas = [QDRANT_Client(host, port, vector_db_grpc_port) for host, port in vector_db_replicas or []],
+                    fulltext_replicas = [OPENSEARCH_Client(host, port) for host, port in fulltext_replicas or []],
+                    vector_timeout = vector_timeout,
+                    fulltext_timeout = fulltext_timeout,
+                    hedge_percentile = hedge_percentile,
+                    passage_store = load_passage_store(passage_store_path),
+                    projection = load_projection(projection_path)
                 )
     
+    @classmethod
+    def make_fake_service(cls,
+            passages=None,
+            num_passages=10000,
+            embed_ms=0.0,
+            vector_search_ms=0.0,
+            fulltext_search_ms=0.0,
+            rerank_ms_per_pair=0.0,
+            jitter_ms=0.0,
+            fusion=Fusion.CONCAT,
+            rerank_top_n=None,
+            tail_ms=0.0,
+            tail_probability=0.0,
+            replicas=0,
+            vector_timeout=None,
+            fulltext_timeout=None,
+            hedge_percentile=None,
+            ids_only=False,
+        ):
+        '''
+        returns hybrid search service with in-process fakes for the embedding model, Qdrant,
+        OpenSearch and the reranker, for benchmarking without network or models
+            passages = corpus (dicts with id, title, text), o.w. num_passages synthetic passages
+            *_ms = injected latency of each stage, jitter_ms = +/- uniform noise
+            tail_ms, tail_probability = extra search latency added with this probability
+            replicas = fake replicas per search backend, see __init__ for timeouts and hedging
+            ids_only = backends return ids and text comes from an in-memory PassageStore,
+                passage ids must be 0, ..., len(passages)-1
+        '''
+        passages = passages or synthetic_passages(num_passages)
+        embedding_model = FakeEmbedding(latency=Latency(per_item_ms=embed_ms, jitter_ms=jitter_ms))
+        search_latency = lambda ms, seed: Latency(
+                            ms, 
+                            jitter_ms, 
+                            seed = seed, 
+                            tail_ms = tail_ms, 
+                            tail_probability = tail_probability
+                        )
+        # replicas share the index of the primary
+        vdb_clients = [Fake_VDB_Client(passages, search_latency(vector_search_ms, 1), embedding_model)]
+        ft_clients = [Fake_VDB_Client(passages, search_latency(fulltext_search_ms, 2), embedding_model)]
+        for i in range(replicas):
+            vdb_clients.append(vdb_clients[0].replica(search_latency(vector_search_ms, 10+2*i)))
+            ft_clients.append(ft_clients[0].replica(search_latency(fulltext_search_ms, 11+2*i)))
+        reranker = Fake_Reranker(Latency(per_item_ms=rerank_ms_per_pair, jitter_ms=jitter_ms, seed=3))
+        return NearestNeighborService(
+                    embedding_model, 
+                    vdb_clients[0], 
+                    ft_clients[0],
+                    reranking_model = reranker,
+                    fusion = fusion,
+                    rerank_top_n = rerank_top_n,
+                    vector_db_replicas = vdb_clients[1:],
+                    fulltext_replicas = ft_clients[1:],
+                    vector_timeout = vector_timeout,
+                    fulltext_timeout = fulltext_timeout,
+                    hedge_percentile = hedge_percentile,
+                    passage_store = PassageStore([p['text'] for p in passages]) if ids_only else None
+                )
+    
+    async def warmup(self, batch_size: int=8) -> None:
+        '''
+        runs the embedding model and reranker on a synthetic batch, so first requests 
+        don't pay for lazy initialization, bypasses the score cache and stage metrics
+        synchronous models run in a worker thread so the event loop keeps serving liveness checks
+        '''
+        questions = [WARMUP_QUESTION]*batch_size
+        await self._call('embed', lambda model: model.encode(questions, prompt_name='query'), in_thread=True)
+        if self.reranking_model is not None:
+            pairs = [(q, {'id': '-1', 'text': WARMUP_PASSAGE}) for q in questions]
+            await self._call('rerank', lambda model: model.predict_pairs(pairs), in_thread=True)
+    
+    async def _call(self, name: str, call, in_thread: bool=False):
+        '''
+        returns call(model) for the embedding model (name = embed) or reranker (rerank)
+        async models (e.g., Triton clients) are awaited, synchronous models run on the event loop,
+        or in a worker thread if in_thread or the model is busy in another thread (e.g., a batch),
+        so the event loop never waits for the model's lock
+        '''
+        model = self.embedding_model if name == 'embed' else self.reranking_model
+        if getattr(model, 'is_async', False):
+            return await call(model)
+        lock = self._locks[name]
+        if not in_thread and lock.acquire(blocking=False):
+            try:
+                return call(model)
+            finally:
+                lock.release()
+        
+        def run():
+            with lock:
+                return call(model)
+        
+        return await asyncio.to_thread(run)
+    
+    async def embed(self, question: str, in_thread: bool=False):
+        '''
+        returns query embedding for question, in_thread = see _call
+        '''
+        with stage('embed', backend_name(self.embedding_model)):
+            embedding = await self._call('embed', lambda model: model.encode(question, prompt_name='query'), in_thread)
+        # for generic SentenceTransformer models use the version below instead
+        # embedding = self.embedding_model.encode(question)
+        return embedding
+
+    async def embed_batch(self, questions: list[str]):
+        '''
+        returns query embeddings for questions, computed in one batch in a worker thread,
+        so large batches don't block other requests on the event loop
+        '''
+        with stage('embed', backend_name(self.embedding_model)):
+            embeddings = await self._call('embed', lambda model: model.encode(questions, prompt_name='query'), in_thread=True)
+        return embeddings
+
     async def query(
                 self, 
                 question: str, 
                 k: int, 
                 search_type: SearchType=SearchType.VECTOR_AND_FULLTEXT,
-                rerank: bool=True
+                rerank: bool=True,
+                embedding=None
                 ) -> list[dict]:
         '''
         returns top k relevant documents for question using search_type and rerank
+        embedding = precomputed query embedding, computed if needed and not provided
         '''
         
-        clients, embeddings = [], []
-        if search_type in [SearchType.VECTOR_AND_FULLTEXT, SearchType.VECTOR_ONLY]:
+        searches = []
+        if search_type.uses_vectors:
             # search vector embeddings
-            s = time.time()
-            embedding = self.embedding_model.encode(question, prompt_name='query')
-            # for generic SentenceTransformer models use the version below instead
-            # embedding = self.embedding_model.encode(question)
-            embed_t = time.time()-s
-            self.logger.info(f'emedding time {embed_t}')
-            clients.append(self.vector_db_client)
-            embeddings.append(embedding)
+            if embedding is None:
+                embedding = await self.embed(question)
+            searches.append(self._vector_search(search_type, question, embedding))
 
-        if search_type in [SearchType.VECTOR_AND_FULLTEXT, SearchType.FULLTEXT_ONLY]:
+        if search_type.uses_fulltext:
             # full-text search
-            clients.append(self.fulltext_client)
-            embeddings.append(question)
+            searches.append(('fulltext_search', question))
         
-        contexts = []
-        s = time.time()
-        async with asyncio.TaskGroup() as tg:
-            tasks = [tg.create_task(
-                        client.query(
-                            self.search_idx, 
-                            embed, 
-                            k
-                        )
-                    ) for client, embed in zip(clients, embeddings)] 
-        for task in tasks:
-            contexts.extend(task.result())
-        search_t = time.time()-s
-        total_contexts = len(contexts)
-        self.logger.info(f'search time for {total_contexts} contexts: {search_t}')
+        # merge results and remove passages found by both searches
+        contexts = fuse(await self._search(searches, 'query', k), self.fusion)
 
-        rerank_t = 0
-        if rerank:
-            s = time.time()
-            contexts = self.reranking_model.rerank(question, contexts)
-            rerank_t = time.time()-s
-            self.logger.info(f'reranking time for {total_contexts}: {rerank_t}')
+        if rerank and self.reranking_model and self.rerank_top_n != 0:
+            n = len(contexts) if self.rerank_top_n is None else self.rerank_top_n
+            # results after the top n keep their fused order
+            head = self._hydrate(contexts[:n])
+            contexts = await self._rerank(question, head) + contexts[n:]
 
-        return contexts[:k]
+        return self._hydrate(contexts[:k])
+    
+    async def query_pipelined(
+                self,
+                question: str,
+                k: int,
+                search_type: SearchType=SearchType.VECTOR_AND_FULLTEXT,
+                rerank: bool=True,
+                embedding=None
+                ):
+        '''
+        query with overlapped stages, async generator yielding (contexts, final):
+            - full-text search starts while the query is embedded in a worker thread
+            - when all results are reranked (rerank_top_n None), each backend's results are
+              reranked in a worker thread as soon as its search returns, while the other search
+              is still running, and yielded as (contexts reranked so far, False), their scores
+              are final but contexts found by later searches may still rank above them
+            - (top k contexts, True) last, the same contexts in the same order as query
+        embedding = precomputed query embedding, or an awaitable (e.g., a task) returning it
+        '''
+        searches = [name for name, used in [('vector_search', search_type.uses_vectors and not search_type.uses_sparse),
+                                            ('hybrid_search', search_type.uses_sparse),
+                                            ('fulltext_search', search_type.uses_fulltext)] if used]
+        tasks = []
+        for name in searches:
+            if name != 'fulltext_search':
+                tasks.append(asyncio.create_task(self._embed_and_search(question, k, search_type, embedding)))
+            else:
+                tasks.append(asyncio.create_task(self._search_backend(name, 'query', question, k)))
+        overlap = rerank and self.reranking_model and self.rerank_top_n is None
+        # reranked contexts by passage id
+        reranked = {}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if not overlap:
+                    continue
+                for task in [task for task in tasks if task in done]:
+                    if task.cancelled() or task.exception() is not None:
+                        continue
+                    new = [context for context in dedup(task.result()) if str(context['id']) not in reranked]
+                    if new:
+                        new = await self._rerank(question, self._hydrate(new), in_thread=True)
+                        reranked.update((str(context['id']), context) for context in new)
+                    if pending and reranked:
+                        partial = sorted(reranked.values(), key=lambda x: x['score'], reverse=True)
+                        yield partial[:k], False
+        finally:
+            for task in tasks:
+                task.cancel()
+        outcomes = [task.exception() or task.result() for task in tasks]
+        contexts = fuse(self._collect(searches, outcomes), self.fusion)
+        if overlap:
+            # as reranking the fused results: sorted by score, ties keep the fused order
+            contexts = [reranked[str(context['id'])] for context in contexts]
+            contexts.sort(key=lambda x: x['score'], reverse=True)
+        elif rerank and self.reranking_model and self.rerank_top_n != 0:
+            n = self.rerank_top_n
+            head = self._hydrate(contexts[:n])
+            contexts = await self._rerank(question, head, in_thread=True) + contexts[n:]
+        yield self._hydrate(contexts[:k]), True
+    
+    async def _embed_and_search(self, question: str, k: int, search_type: SearchType, embedding=None):
+        if embedding is None:
+            embedding = await self.embed(question, in_thread=True)
+        elif inspect.isawaitable(embedding):
+            embedding = await embedding
+        name, query = self._vector_search(search_type, question, embedding)
+        return await self._search_backend(name, 'query', query, k)
+    
+    def _vector_search(self, search_type: SearchType, question: str, embedding) -> tuple:
+        '''
+        (stage name, query) of the vector database search for search_type
+        '''
+        if self.projection is not None:
+            embedding = self.projection(embedding)
+        if search_type.uses_sparse:
+            return 'hybrid_search', (embedding, self.sparse_encoder.encode_query(question))
+        return 'vector_search', embedding
+    
+    async def _rerank(self, question: str, contexts: list[dict], in_thread: bool=False) -> list[dict]:
+        with stage('rerank', backend_name(self.reranking_model)):
+            return await self._call('rerank', lambda model: model.rerank(question, contexts), in_thread)
+    
+    def _hydrate(self, contexts: list[dict]) -> list[dict]:
+        '''
+        adds passage text from the passage store to contexts returned as ids only
+        '''
+        if self.passage_store is not None:
+            self.passage_store.hydrate(contexts)
+        return contexts
+    
+    def _clients(self, name: str) -> list:
+        '''
+        primary client followed by replicas for search stage name
+        '''
+        if name in ['vector_search', 'hybrid_search']:
+            return [self.vector_db_client]+self.vector_db_replicas
+        return [self.fulltext_client]+self.fulltext_replicas
+    
+    async def _search(self, searches: list[tuple], method: str, k: int) -> list:
+        '''
+        runs (stage name, query) searches concurrently with client.method(index, query, k), 
+        returns results of the searches that succeeded, in order
+        if some searches fail or miss their deadline, they are dropped and recorded with 
+        instrumentation.degrade, if all fail the first error is raised
+        '''
+        outcomes = await asyncio.gather(
+                        *[self._search_backend(name, method, query, k) for name, query in searches], 
+                        return_exceptions=True
+                    )
+        return self._collect([name for name, _ in searches], outcomes)
+    
+    @staticmethod
+    def _collect(names: list[str], outcomes: list) -> list:
+        '''
+        results of the searches that succeeded, in order, outcomes are results or exceptions
+        failed searches are recorded with instrumentation.degrade, if all fail the first error is raised
+        '''
+        results, errors = [], []
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, BaseException):
+                errors.append((name, outcome))
+            else:
+                results.append(outcome)
+        if not results:
+            raise errors[0][1]
+        for name, error in errors:
+            degrade(name, 'timeout' if isinstance(error, TimeoutError) else 'error')
+        return results
     
+    async def _search_backend(self, name: str, method: str, query, k: int):
+        clients = self._clients(name)
+        if name == 'hybrid_search':
+            # dense and sparse search in one request, e.g., QDRANT_Client.query_hybrid
+            method = f'{method}_hybrid'
+        with stage(name, backend_name(clients[0])):
+            return await self.hedgers[name].run(
+                        clients, 
+                        lambda client: getattr(client, method)(self.search_idx, query, k)
+                    )
+    
+    async def query_batch(
+                self, 
+                questions: list[str], 
+                k: int, 
+                search_type: SearchType=SearchType.VECTOR_AND_FULLTEXT,
+                rerank: bool=True,
+                embeddings=None
+                ) -> list[list[dict]]:
+        '''
+        query for several questions: embeds all questions in one batch, searches each backend 
+        with one query_group call, and reranks all (question, context) pairs together
+        embeddings = precomputed query embeddings, computed if needed and not provided
+        '''
+        searches = []
+        if search_type.uses_vectors:
+            if embeddings is None:
+                embeddings = await self.embed_batch(questions)
+            if self.projection is not None:
+                embeddings = self.projection(embeddings)
+            if search_type.uses_sparse:
+                sparse = [self.sparse_encoder.encode_query(question) for question in questions]
+                searches.append(('hybrid_search', list(zip(embeddings, sparse))))
+            else:
+                searches.append(('vector_search', list(embeddings)))
+        if search_type.uses_fulltext:
+            searches.append(('fulltext_search', questions))
+
+        # results[j][i] = results for question i from backend j
+        results = await self._search(searches, 'query_group', k)
+        contexts_lists = [fuse([r[i] for r in results], self.fusion) for i in range(len(questions))]
+
+        if rerank and self.reranking_model and self.rerank_top_n != 0:
+            n = self.rerank_top_n
+            heads = [self._hydrate(contexts[:n] if n is not None else contexts) for contexts in contexts_lists]
+            with stage('rerank', backend_name(self.reranking_model)):
+                # in a worker thread, see embed_batch
+                heads = await self._call('rerank', lambda model: model.rerank_batch(questions, heads), in_thread=True)
+            contexts_lists = [head+contexts[len(head):] for head, contexts in zip(heads, contexts_lists)]
+
+        return [self._hydrate(contexts[:k]) for contexts in contexts_lists]
@@ -0,0 +1,157 @@
+'''
+OpenVINO version of SentenceTransformer embedding models
+
+exports a SentenceTransformer model to OpenVINO, optionally with INT8 post-training quantization:
+    python embedding_models.py Snowflake/snowflake-arctic-embed-s ./models/snowflake-arctic-embed-s_OV --int8
+calibration uses SQuAD questions and passages unless --calibration is a text file (one sentence per line)
+'''
+from transformers import AutoTokenizer
+from optimum.intel import OVModelForFeatureExtraction
+from batching import token_budget_batches
+from metrics import record_batch
+from reranking_models import ov_config, compile_ov_model
+import numpy as np
+import argparse, json, os
+
+INT8_FILE_NAME = 'openvino_model_int8.xml'
+
+def _read_json(path: str, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def sentence_config(model_path: str, tokenizer) -> dict:
+    '''
+    prompts, max_seq_length, pooling (cls or mean) and normalize of the SentenceTransformer 
+    configs saved in model_path
+    '''
+    sbert_config = _read_json(f'{model_path}/sentence_bert_config.json', {})
+    modules = _read_json(f'{model_path}/modules.json', [])
+    pooling_path = next((module['path'] for module in modules if module['type'].endswith('Pooling')), '1_Pooling')
+    pooling = _read_json(f'{model_path}/{pooling_path}/config.json', {})
+    return {
+        'prompts': _read_json(f'{model_path}/config_sentence_transformers.json', {}).get('prompts', {}),
+        'max_seq_length': sbert_config.get('max_seq_length', tokenizer.model_max_length),
+        'pooling': 'cls' if pooling.get('pooling_mode_cls_token') else 'mean',
+        'normalize': any(module['type'].endswith('Normalize') for module in modules)
+    }
+
+def pool(hidden: np.ndarray, attention_mask: np.ndarray, pooling: str) -> np.ndarray:
+    '''
+    sentence embeddings from token embeddings, pooling = cls or mean
+    '''
+    if pooling == 'cls':
+        return hidden[:, 0]
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    return (hidden*mask).sum(axis=1)/np.maximum(mask.sum(axis=1), 1e-9)
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    return embeddings/np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+class OpenVINO_Embedding:
+    def __init__(self, model_path, file_name='openvino_model.xml', cache_dir=None, max_batch_tokens=16384, compile=True):
+        '''
+        SentenceTransformer compatible encode for models exported by this module
+            model_path = directory with the OpenVINO model, tokenizer and SentenceTransformer configs
+            file_name = openvino_model.xml (FP32) or openvino_model_int8.xml (INT8)
+            cache_dir = optional OpenVINO compiled model cache directory
+            max_batch_tokens = max tokens (including padding) per inference batch
+            compile = False only reads the model, compile_model compiles it later (e.g., after fork)
+        prompts, pooling (cls or mean), normalization and max sequence length follow the
+        original model's SentenceTransformer configuration
+        '''
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = OVModelForFeatureExtraction.from_pretrained(
+                        model_path,
+                        file_name=file_name,
+                        ov_config=ov_config(cache_dir),
+                        compile=compile
+                    )
+        self.max_batch_tokens = max_batch_tokens
+        config = sentence_config(model_path, self.tokenizer)
+        self.prompts = config['prompts']
+        self.max_seq_length = config['max_seq_length']
+        self.pooling = config['pooling']
+        self.normalize = config['normalize']
+
+    def compile_model(self, num_threads: int=None) -> None:
+        compile_ov_model(self.model, num_threads)
+
+    def encode(self, sentences, prompt_name: str=None, **kwargs) -> np.ndarray:
+        '''
+        returns embedding of sentences (str) or matrix of embeddings for a list of sentences
+        prompt_name = key of the model's prompts, e.g., query
+        '''
+        single = isinstance(sentences, str)
+        prompt = self.prompts.get(prompt_name, '') if prompt_name else ''
+        texts = [prompt+s for s in ([sentences] if single else sentences)]
+        tokens = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+        lengths = [len(ids) for ids in tokens['input_ids']]
+        embeddings = [None]*len(texts)
+        for batch in token_budget_batches(lengths, self.max_batch_tokens):
+            record_batch('embedding', [lengths[i] for i in batch])
+            inputs = self.tokenizer.pad(
+                        {name: [values[i] for i in batch] for name, values in tokens.items()},
+                        padding='longest',
+                        return_tensors='np'
+                    )
+            hidden = np.asarray(self.model(**inputs).last_hidden_state)
+            for i, embedding in zip(batch, pool(hidden, inputs['attention_mask'], self.pooling)):
+                embeddings[i] = embedding
+        embeddings = np.stack(embeddings).astype(np.float32)
+        if self.normalize:
+            embeddings = normalize(embeddings)
+        return embeddings[0] if single else embeddings
+
+def calibration_texts(n: int=300) -> list[str]:
+    '''
+    SQuAD questions and passages, the query and passage distribution the model sees
+    '''
+    from datasets import load_dataset
+    squad = load_dataset('squad', split=f'validation[:{n}]')
+    return [row['question'] for row in squad]+list(dict.fromkeys(row['context'] for row in squad))
+
+def export_openvino_embedding(model_name: str, output_dir: str, int8: bool=False, texts: list[str]=None) -> None:
+    '''
+    writes model_name as OpenVINO FP32 (openvino_model.xml) and optionally INT8 (openvino_model_int8.xml)
+    to output_dir, together with the tokenizer and SentenceTransformer configs used by OpenVINO_Embedding
+    texts = calibration sentences for INT8 quantization, SQuAD by default
+    '''
+    from sentence_transformers import SentenceTransformer
+    # saves tokenizer, prompts, pooling and normalization configs
+    SentenceTransformer(model_name).save(output_dir)
+    OVModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(output_dir)
+    if not int8:
+        return
+    import nncf, openvino as ov
+    model = ov.Core().read_model(f'{output_dir}/openvino_model.xml')
+    tokenizer = AutoTokenizer.from_pretrained(output_dir)
+    input_names = {model_input.get_any_name() for model_input in model.inputs}
+    max_seq_length = _read_json(f'{output_dir}/sentence_bert_config.json', {}).get('max_seq_length', 512)
+
+    def transform(text):
+        tokens = tokenizer(text, truncation=True, max_length=max_seq_length, return_tensors='np')
+        return {name: values for name, values in tokens.items() if name in input_names}
+
+    texts = texts or calibration_texts()
+    quantized = nncf.quantize(
+                    model,
+                    nncf.Dataset(texts, transform),
+                    model_type=nncf.ModelType.TRANSFORMER,
+                    subset_size=len(texts)
+                )
+    ov.save_model(quantized, f'{output_dir}/{INT8_FILE_NAME}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_name', help='SentenceTransformer model, e.g., Snowflake/snowflake-arctic-embed-s')
+    parser.add_argument('output_dir')
+    parser.add_argument('--int8', action='store_true', help='also write an INT8 post-training quantized model')
+    parser.add_argument('--calibration', default=None, help='text file with one calibration sentence per line')
+    args = parser.parse_args()
+    texts = None
+    if args.calibration:
+        with open(args.calibration, 'r') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    export_openvino_embedding(args.model_name, args.output_dir, args.int8, texts)
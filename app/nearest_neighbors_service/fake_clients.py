@@ -0,0 +1,248 @@
+from vdb_client import VDB_Client, DB_Entry
+from reranking_models import Reranker
+from sparse_encoder import terms, term_index
+import numpy as np
+import asyncio, heapq, random, time, zlib
+
+class Latency:
+    def __init__(self, 
+                 mean_ms: float=0.0, 
+                 jitter_ms: float=0.0, 
+                 per_item_ms: float=0.0, 
+                 seed: int=0, 
+                 tail_ms: float=0.0, 
+                 tail_probability: float=0.0
+                ):
+        '''
+        injected delay of mean_ms + per_item_ms x number of items, +/- uniform jitter_ms,
+        plus tail_ms with probability tail_probability (slow requests, for testing hedging)
+        '''
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.per_item_ms = per_item_ms
+        self.tail_ms = tail_ms
+        self.tail_probability = tail_probability
+        self.rng = random.Random(seed)
+
+    def seconds(self, items: int=1) -> float:
+        ms = self.mean_ms+self.per_item_ms*items+self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if self.tail_probability and self.rng.random() < self.tail_probability:
+            ms += self.tail_ms
+        return max(ms, 0.0)/1000
+
+    async def wait(self, items: int=1) -> None:
+        '''
+        non-blocking delay, emulates network calls
+        '''
+        delay = self.seconds(items)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def block(self, items: int=1) -> None:
+        '''
+        blocking delay, emulates model compute in the calling thread
+        '''
+        delay = self.seconds(items)
+        if delay > 0:
+            time.sleep(delay)
+
+def synthetic_passages(n: int, words_per_passage: int=60, vocabulary_size: int=2000, seed: int=0) -> list[dict]:
+    '''
+    deterministic corpus of n passages with ids 0, ..., n-1
+    '''
+    rng = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(vocabulary_size)]
+    return [{'id': str(i),
+             'title': f'Passage {i}',
+             'text': ' '.join(rng.choices(vocabulary, k=words_per_passage))} for i in range(n)]
+
+class FakeEmbedding:
+    def __init__(self, dim: int=384, latency: Latency=None):
+        '''
+        stand-in for SentenceTransformer, deterministic unit vectors seeded by a hash of the text
+        '''
+        self.dim = dim
+        self.latency = latency or Latency()
+
+    def _embed(self, text: str) -> np.ndarray:
+        rng = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+        vector = rng.standard_normal(self.dim).astype(np.float32)
+        return vector/np.linalg.norm(vector)
+
+    def encode(self, sentences, prompt_name: str=None, **kwargs):
+        if isinstance(sentences, str):
+            self.latency.block()
+            return self._embed(sentences)
+        self.latency.block(len(sentences))
+        return np.stack([self._embed(s) for s in sentences])
+
+class Fake_VDB_Client(VDB_Client):
+    def __init__(self,
+                 passages: list[dict]=None,
+                 latency: Latency=None,
+                 embedding_model: FakeEmbedding=None,
+                 results: list[dict]=None
+                ):
+        '''
+        in memory stand-in for vector and full-text search backends
+            passages = initial corpus (dicts with id and text), embedded with embedding_model
+            latency = injected delay per query
+            results = if provided, every query returns these results (fixed result set)
+        string queries are scored by term overlap (full-text), vector queries by dot product,
+        hybrid queries by reciprocal rank fusion of both (sparse vectors as hashed terms)
+        '''
+        self.latency = latency or Latency()
+        self.embedding_model = embedding_model or FakeEmbedding()
+        self.results = results
+        self.index = 'wiki'
+        self.return_fields = None
+        self.entries = {}
+        self._positions = {} # key -> insertion order, for ranking ties
+        self._postings = {} # term -> keys of the entries containing it
+        self._sparse_postings = {} # sparse vector index (hashed term) -> keys
+        self._matrix, self._keys = None, None
+        super().__init__('fake', '0')
+        for passage in passages or []:
+            embedding = self.embedding_model._embed(passage['text'])
+            self._add(DB_Entry(passage['id'], embedding, passage))
+
+    def _connect(self, host, port, *args):
+        return True
+
+    def replica(self, latency: Latency=None) -> 'Fake_VDB_Client':
+        '''
+        client sharing this client's index, with its own latency
+        '''
+        replica = Fake_VDB_Client(latency=latency, embedding_model=self.embedding_model, results=self.results)
+        replica.index, replica.entries = self.index, self.entries
+        replica._positions, replica._postings = self._positions, self._postings
+        replica._sparse_postings = self._sparse_postings
+        return replica
+
+    async def create_index(self, name, dim, distance, quantization, fields=None):
+        self.index = name
+        return True
+
+    async def delete_index(self, name):
+        self.entries = {}
+        self._positions, self._postings, self._sparse_postings = {}, {}, {}
+        self._matrix = None
+        return True
+
+    def configure_query(self, return_fields=None):
+        self.return_fields = return_fields
+        return True
+
+    async def insert(self, entry):
+        self._add(entry)
+        self._matrix = None
+        return True
+
+    def _add(self, entry):
+        '''
+        adds entry to the entries and its terms (and their sparse indices) to the postings,
+        so queries don't scan passage texts
+        '''
+        key = str(entry.key)
+        if key in self.entries:
+            for term in set(terms(self.entries[key].fields.get('text', ''))):
+                self._postings[term].discard(key)
+                self._sparse_postings[term_index(term)].discard(key)
+        self.entries[key] = entry
+        self._positions.setdefault(key, len(self._positions))
+        for term in set(terms(entry.fields.get('text', ''))):
+            self._postings.setdefault(term, set()).add(key)
+            self._sparse_postings.setdefault(term_index(term), set()).add(key)
+
+    def _ranked(self, postings, terms, k):
+        '''
+        top k entries by number of terms they contain, ties in insertion order, entries
+        without any of the terms fill up to k (same order as scoring every entry)
+        '''
+        counts = {}
+        for term in terms:
+            for key in postings.get(term, ()):
+                counts[key] = counts.get(key, 0)+1
+        top = heapq.nsmallest(k, counts, key = lambda key: (-counts[key], self._positions[key]))
+        hits = [(key, float(counts[key])) for key in top]
+        for key in self.entries:
+            if len(hits) >= k:
+                break
+            if key not in counts:
+                hits.append((key, 0.0))
+        return hits
+
+    def _vector_search(self, vector, k):
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.stack([self.entries[key].embedding for key in self._keys])
+        scores = self._matrix @ np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-scores)[:k]
+        return [(self._keys[i], float(scores[i])) for i in top]
+
+    def _fulltext_search(self, text, k):
+        return self._ranked(self._postings, set(terms(text)), k)
+
+    def _sparse_search(self, sparse, k):
+        return self._ranked(self._sparse_postings, set(sparse[0]), k)
+
+    def _hybrid_search(self, query, k):
+        vector, sparse = query
+        scores = {}
+        for hits in [self._vector_search(vector, k), self._sparse_search(sparse, k)]:
+            for rank, (key, _) in enumerate(hits, start=1):
+                scores[key] = scores.get(key, 0.0)+1/(60+rank)
+        return sorted(scores.items(), key = lambda x: x[1], reverse = True)[:2*k]
+
+    async def query(self, index, vector, k):
+        await self.latency.wait()
+        if self.results is not None:
+            return [dict(doc) for doc in self.results[:k]]
+        if not self.entries:
+            return []
+        if isinstance(vector, str):
+            return self._docs(self._fulltext_search(vector, k))
+        return self._docs(self._vector_search(vector, k))
+
+    async def query_hybrid(self, index, query, k):
+        await self.latency.wait()
+        if self.results is not None:
+            return [dict(doc) for doc in self.results[:2*k]]
+        if not self.entries:
+            return []
+        return self._docs(self._hybrid_search(query, k))
+
+    async def query_group_hybrid(self, index, queries, k):
+        return await asyncio.gather(*[self.query_hybrid(index, query, k) for query in queries])
+
+    def _docs(self, hits):
+        docs = []
+        for key, score in hits:
+            fields = self.entries[key].fields
+            if self.return_fields is not None:
+                fields = {name: fields[name] for name in self.return_fields if name in fields}
+            doc = dict(fields)
+            doc['score'] = score
+            docs.append(doc)
+        return docs
+
+class Fake_Reranker(Reranker):
+    def __init__(self, latency: Latency=None, score_cache=None):
+        '''
+        stand-in cross-encoder, scores are term overlap normalized to [0, 1]
+        latency.per_item_ms emulates compute per (query, passage) pair
+        '''
+        self.latency = latency or Latency()
+        self.score_cache = score_cache
+
+    def predict(self, query, contexts):
+        return self.predict_pairs([(query, context) for context in contexts])
+
+    def predict_pairs(self, pairs):
+        self.latency.block(len(pairs))
+        scores = []
+        for query, context in pairs:
+            query_terms = set(terms(query))
+            overlap = len(query_terms.intersection(terms(context['text'])))
+            scores.append(round(overlap/max(len(query_terms), 1), 4))
+        return scores
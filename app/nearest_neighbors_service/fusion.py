@@ -0,0 +1,79 @@
+from enum import Enum
+
+class Fusion(Enum):
+    CONCAT = 0      # concatenate results, scores are not comparable so a reranker should order them
+    RRF = 1         # reciprocal rank fusion
+    NORMALIZED = 2  # sum of min-max normalized scores
+
+    @classmethod
+    def from_string(cls, s):
+        _type = Fusion.CONCAT
+        if s == 'RRF':
+            _type = Fusion.RRF
+        elif s == 'NORM':
+            _type = Fusion.NORMALIZED
+        return _type
+
+def dedup(contexts: list[dict]) -> list[dict]:
+    '''
+    removes repeated passages (same id), keeping the first occurrence
+    '''
+    seen, unique = set(), []
+    for context in contexts:
+        key = str(context['id'])
+        if key not in seen:
+            seen.add(key)
+            unique.append(context)
+    return unique
+
+def reciprocal_rank_fusion(result_lists: list[list[dict]], c: int=60) -> list[dict]:
+    '''
+    score(d) = sum over lists containing d of 1/(c + rank of d), rank starts at 1
+    only uses ranks, so cosine and BM25 scores never need to be compared
+    '''
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, context in enumerate(dedup(results), start=1):
+            key = str(context['id'])
+            scores[key] = scores.get(key, 0.0) + 1/(c+rank)
+            docs.setdefault(key, context)
+    return _sorted_by_score(scores, docs)
+
+def normalized_score_fusion(result_lists: list[list[dict]], weights: list[float]=None) -> list[dict]:
+    '''
+    min-max normalizes each list's scores to [0, 1] then takes the weighted sum,
+    passages missing from a list get 0 for that list
+    '''
+    weights = weights or [1.0]*len(result_lists)
+    scores, docs = {}, {}
+    for results, weight in zip(result_lists, weights):
+        results = dedup(results)
+        if not results:
+            continue
+        raw = [float(context['score']) for context in results]
+        low, high = min(raw), max(raw)
+        for context, score in zip(results, raw):
+            key = str(context['id'])
+            normalized = (score-low)/(high-low) if high > low else 1.0
+            scores[key] = scores.get(key, 0.0) + weight*normalized
+            docs.setdefault(key, context)
+    return _sorted_by_score(scores, docs)
+
+def _sorted_by_score(scores: dict, docs: dict) -> list[dict]:
+    fused = []
+    for key in sorted(scores, key=scores.get, reverse=True):
+        context = dict(docs[key])
+        context['score'] = round(scores[key], 6)
+        fused.append(context)
+    return fused
+
+def fuse(result_lists: list[list[dict]], fusion: Fusion=Fusion.CONCAT) -> list[dict]:
+    '''
+    merges results from each search backend into one deduplicated list
+    a single list keeps its original order and scores
+    '''
+    if len(result_lists) == 1 or fusion == Fusion.CONCAT:
+        return dedup([context for results in result_lists for context in results])
+    if fusion == Fusion.RRF:
+        return reciprocal_rank_fusion(result_lists)
+    return normalized_score_fusion(result_lists)
@@ -0,0 +1,87 @@
+from metrics import BACKEND_EVENTS
+from collections import deque
+import numpy as np
+import asyncio, time
+
+class Hedger:
+    def __init__(self,
+                 name: str,
+                 timeout: float=None,
+                 hedge_percentile: float=None,
+                 min_samples: int=50,
+                 window: int=1000
+                ):
+        '''
+        deadline and hedged requests for one retrieval backend with optional replicas
+            name = stage name for metrics, e.g., vector_search
+            timeout = seconds until the call fails with TimeoutError, None waits forever
+            hedge_percentile = if the call is still running after this percentile (e.g., 95) of
+                recent latencies, the same request is also sent to the next replica and the
+                first result wins, None disables hedging
+            min_samples = latencies observed before hedging starts
+            window = number of recent latencies kept
+        a failed attempt is retried on the next replica right away
+        '''
+        self.name = name
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.hedges = 0
+        self.failovers = 0
+
+    def hedge_delay(self) -> float | None:
+        if self.hedge_percentile is None or len(self.latencies) < self.min_samples:
+            return None
+        return float(np.percentile(self.latencies, self.hedge_percentile))
+
+    async def run(self, clients: list, call):
+        '''
+        returns the first successful call(client) for client in clients (primary first, then
+        replicas), raises TimeoutError after timeout or the last error if every attempt failed
+        '''
+        async with asyncio.timeout(self.timeout):
+            return await self._race(clients, call)
+
+    async def _race(self, clients: list, call):
+        started = {} # attempt -> start time
+        pending, error = set(), None
+
+        def launch():
+            attempt = asyncio.ensure_future(call(clients[len(started)]))
+            started[attempt] = time.perf_counter()
+            pending.add(attempt)
+
+        launch()
+        try:
+            while pending:
+                delay = self.hedge_delay() if len(started) < len(clients) else None
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # slow attempt, hedge to the next replica
+                    self.hedges += 1
+                    BACKEND_EVENTS.inc(stage=self.name, event='hedge')
+                    launch()
+                    continue
+                for attempt in done:
+                    pending.discard(attempt)
+                    if attempt.exception() is None:
+                        self.latencies.append(time.perf_counter()-started[attempt])
+                        return attempt.result()
+                    error = attempt.exception()
+                if not pending and len(started) < len(clients):
+                    self.failovers += 1
+                    BACKEND_EVENTS.inc(stage=self.name, event='failover')
+                    launch()
+            raise error
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+
+    def stats(self) -> dict:
+        delay = self.hedge_delay()
+        return {
+            'hedges': self.hedges,
+            'failovers': self.failovers,
+            'hedge_delay_ms': 1000*delay if delay is not None else 0.0
+        }
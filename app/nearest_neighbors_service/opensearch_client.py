@@ -1,14 +1,6 @@
 from opensearchpy import AsyncOpenSearch
 from vdb_client import VDB_Client, DB_Entry
 import json
-import time
-
-class FakeEmbedding:
-    def __init__(self):
-        pass
-
-    def encode(self, s):
-        return s
 
 class OPENSEARCH_Client(VDB_Client):
     def __init__(self, host, port, *args):
@@ -22,6 +14,7 @@ class OPENSEARCH_Client(VDB_Client):
             ssl_assert_hostname = False,
             ssl_show_warn =False
         )
+        self.source = True
     
     def _connect(self, host, port, *args):
         pass
@@ -46,8 +39,12 @@ class OPENSEARCH_Client(VDB_Client):
     async def delete_index(self, name):
         return await super().delete_index(name)
     
-    async def configure_query(self, return_fields = None):
-        pass
+    def configure_query(self, return_fields = None):
+        '''
+        return_fields = _source fields returned with each hit, None returns the whole document
+        '''
+        self.source = True if return_fields is None else list(return_fields)
+        return True
 
     async def insert(self, entry):
         response = await self.client.index(
@@ -68,23 +65,40 @@ class OPENSEARCH_Client(VDB_Client):
         response = await self.client.bulk(body=cmd)
         return response
     
-    async def query(self, index, vector, k):
-        s = time.time()
-        query = {
+    @staticmethod
+    def _match_query(text, k, source=True):
+        return {
             "size": k,
+            "_source": source,
             "query": {
                 "match": {
                     "text": {
-                        "query": vector
+                        "query": text
                     } 
                 }    
             }
         }
-        response = await self.client.search(body=query, index=index)
-        response = response['hits']['hits']
+    
+    @staticmethod
+    def _to_docs(hits) -> list[dict]:
         docs = []
-        for res in response:
+        for res in hits:
             doc = res['_source']
             doc['score'] = res['_score']
             docs.append(doc)
-        return docs
\ No newline at end of file
+        return docs
+    
+    async def query(self, index, vector, k):
+        response = await self.client.search(body=self._match_query(vector, k, self.source), index=index)
+        return self._to_docs(response['hits']['hits'])
+    
+    async def query_group(self, index, vectors, k):
+        '''
+        searches for all queries in one multi-search request
+        '''
+        body = []
+        for text in vectors:
+            body.append({'index': index})
+            body.append(self._match_query(text, k, self.source))
+        response = await self.client.msearch(body=body)
+        return [self._to_docs(res['hits']['hits']) for res in response['responses']]
\ No newline at end of file
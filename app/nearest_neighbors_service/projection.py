@@ -0,0 +1,137 @@
+'''
+embedding dimensionality reduction: a linear projection fitted offline (PCA) or a prefix of the
+dimensions (Matryoshka truncation, for models trained for it), applied to passage embeddings
+before indexing (ingestion.py --projection) and to query embeddings (NearestNeighborService),
+so vector indexes store and compare fewer dimensions
+
+reports recall@k against full width brute force search for several widths and writes the
+projection for --width, e.g.,
+    python projection.py /data/embeddings.jsonl --questions ../squad_questions.jsonl --width 128
+embeddings.jsonl = passages with an embedding field, as inserted into the vector database
+without --questions, held-out passages are the queries
+'''
+import numpy as np
+import argparse, json
+
+class Projection:
+    def __init__(self, components: np.ndarray, mean: np.ndarray=None, normalize: bool=True):
+        '''
+        maps embeddings x to (x-mean) @ components, components = dim x width matrix
+        normalize = rescale projected embeddings to unit length, so cosine and dot product
+            search agree as for the model's normalized embeddings
+        '''
+        self.components = components.astype(np.float32)
+        self.mean = mean.astype(np.float32) if mean is not None else None
+        self.normalize = normalize
+
+    @property
+    def width(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def pca(cls, embeddings: np.ndarray, width: int) -> 'Projection':
+        '''
+        top width principal components of embeddings (n x dim)
+        '''
+        mean = embeddings.mean(axis=0)
+        centered = embeddings-mean
+        # eigenvectors of the dim x dim covariance, in increasing order of eigenvalue
+        _, vectors = np.linalg.eigh(centered.T @ centered)
+        return cls(vectors[:, ::-1][:, :width].copy(), mean)
+
+    @classmethod
+    def truncation(cls, dim: int, width: int) -> 'Projection':
+        '''
+        first width dimensions, for Matryoshka embedding models
+        '''
+        return cls(np.eye(dim, width, dtype=np.float32))
+
+    def __call__(self, embeddings: np.ndarray) -> np.ndarray:
+        '''
+        projects one embedding or a matrix of embeddings
+        '''
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.mean is not None:
+            embeddings = embeddings-self.mean
+        projected = embeddings @ self.components
+        if self.normalize:
+            norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+            projected = projected/np.maximum(norms, 1e-12)
+        return projected
+
+    def save(self, path: str) -> None:
+        arrays = {'components': self.components, 'normalize': np.array(self.normalize)}
+        if self.mean is not None:
+            arrays['mean'] = self.mean
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'Projection':
+        with np.load(path) as arrays:
+            mean = arrays['mean'] if 'mean' in arrays else None
+            return cls(arrays['components'], mean, bool(arrays['normalize']))
+
+def load_projection(path: str) -> Projection | None:
+    return Projection.load(path) if path else None
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    '''
+    indices of the k corpus vectors with the largest dot product with each query, brute force
+    '''
+    scores = queries @ corpus.T
+    return np.argpartition(-scores, k-1, axis=1)[:, :k]
+
+def recall_at_k(corpus: np.ndarray, queries: np.ndarray, projection: Projection, k: int) -> float:
+    '''
+    fraction of the full width top k also found in the projected top k
+    '''
+    truth = top_k(corpus, queries, k)
+    found = top_k(projection(corpus), projection(queries), k)
+    return float(np.mean([len(set(t) & set(f))/k for t, f in zip(truth, found)]))
+
+def read_embeddings(path: str, limit: int) -> np.ndarray:
+    embeddings = []
+    with open(path, 'r') as f:
+        for line in f:
+            if len(embeddings) == limit:
+                break
+            if line.strip():
+                embeddings.append(json.loads(line)['embedding'])
+    return np.array(embeddings, dtype=np.float32)
+
+def embed_questions(path: str, limit: int, embedding_type: str) -> np.ndarray:
+    from ann_service import NearestNeighborService
+    with open(path, 'r') as f:
+        questions = [json.loads(line)['question'] for line in f if line.strip()][:limit]
+    model = NearestNeighborService.load_embedding_model(embedding_type)
+    return np.asarray(model.encode(questions, prompt_name='query'), dtype=np.float32)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('embeddings', help='json lines with an embedding field')
+    parser.add_argument('--sample', type=int, default=50000, help='passages to fit and search')
+    parser.add_argument('--questions', default=None, help='jsonl with a question field, embedded as queries')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--embedding-type', default='torch', help='query embedding model, see load_embedding_model')
+    parser.add_argument('--method', choices=['pca', 'truncate'], default='pca')
+    parser.add_argument('--widths', default='32,64,96,128,192,256', help='comma separated widths to report')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--width', type=int, default=None, help='width of the projection to write')
+    parser.add_argument('--output', default='./models/projection.npz')
+    args = parser.parse_args()
+    if args.questions:
+        corpus = read_embeddings(args.embeddings, args.sample)
+        queries = embed_questions(args.questions, args.queries, args.embedding_type)
+    else:
+        embeddings = read_embeddings(args.embeddings, args.sample+args.queries)
+        corpus, queries = embeddings[:-args.queries], embeddings[-args.queries:]
+    dim = corpus.shape[1]
+    fit = lambda width: Projection.pca(corpus, width) if args.method == 'pca' else Projection.truncation(dim, width)
+    print(f'{len(corpus)} passages, {len(queries)} queries, {dim} dimensions')
+    print('width | recall@k | index MB per million vectors (float32)')
+    for width in [int(w) for w in args.widths.split(',')]:
+        print(f'{width} | {recall_at_k(corpus, queries, fit(width), args.k):.4f} | {width*4*10**6/2**20:.0f}')
+    if args.width:
+        fit(args.width).save(args.output)
+        print(f'wrote {args.method} projection to {args.width} dimensions to {args.output}')
@@ -1,26 +1,53 @@
 from vdb_client import VDB_Client, Distance, DB_Entry
 from qdrant_client import AsyncQdrantClient, models
 import numpy as np
-import time
+import asyncio
+
+# name of the BM25 sparse vectors stored next to the (unnamed) dense vectors, see sparse_encoder.py
+SPARSE_VECTOR = 'bm25'
+
+def sparse_vector(sparse: tuple) -> models.SparseVector:
+    indices, values = sparse
+    return models.SparseVector(indices=list(indices), values=list(values))
 
 class QDRANT_Client(VDB_Client):
     distance_mapping = {Distance.COSINE: models.Distance.COSINE, Distance.DOTPRODUCT: models.Distance.DOT}
     quatization_mapping = {np.float32: models.Datatype.FLOAT32, np.float16: models.Datatype.FLOAT16}
 
-    def __init__(self, host: str, port: str, *args):
-        super().__init__(host, port, *args)
+    def __init__(self, 
+                 host: str, 
+                 port: str, 
+                 grpc_port: str=None, 
+                 upsert_batch_size: int=256, 
+                 max_concurrent_upserts: int=4
+                ):
+        '''
+        Qdrant at host:port (REST), with grpc_port requests use gRPC instead, over one HTTP/2 
+        channel shared by all requests, with vectors sent as packed floats instead of json
+        insert_group upserts upsert_batch_size points per request, max_concurrent_upserts at once
+        '''
+        self.prefer_grpc = grpc_port is not None
+        self.grpc_port = grpc_port
+        self.upsert_batch_size = upsert_batch_size
+        self.max_concurrent_upserts = max_concurrent_upserts
+        super().__init__(host, port)
+        self.with_payload = True
     
     def _connect(self, host: str, port: str, *args) -> bool:
         try:
-            url = f"http://{host}:{port}"
-            print(url)
-            self.client = AsyncQdrantClient(url=url)
+            if self.prefer_grpc:
+                self.client = AsyncQdrantClient(host=host, port=int(port), grpc_port=int(self.grpc_port), prefer_grpc=True)
+            else:
+                self.client = AsyncQdrantClient(url=f"http://{host}:{port}")
         except Exception as e:
             print(e)
             return False
         return True
     
-    async def create_index(self, name, dim, distance, quantization, fields = None, kw_args=None) -> bool:
+    async def create_index(self, name, dim, distance, quantization, fields = None, kw_args=None, sparse=False) -> bool:
+        '''
+        sparse = also store BM25 sparse vectors (DB_Entry.sparse), for query_hybrid
+        '''
         self.index = name
         DIST = QDRANT_Client.distance_mapping[distance]
         QUANTIZATION = QDRANT_Client.quatization_mapping[quantization]
@@ -36,6 +63,10 @@ class QDRANT_Client(VDB_Client):
                     datatype=QUANTIZATION,
                     hnsw_config=hnsw_config
                 ),
+                # Qdrant multiplies query weights by inverse document frequency
+                sparse_vectors_config={
+                    SPARSE_VECTOR: models.SparseVectorParams(modifier=models.Modifier.IDF)
+                } if sparse else None
             )
         except Exception as e:
             print(e)
@@ -49,38 +80,125 @@ class QDRANT_Client(VDB_Client):
         return True
 
     def configure_query(self, return_fields = None):
-        # not currently implemented
+        '''
+        return_fields = payload fields returned with each result, None returns the whole payload
+        '''
+        self.with_payload = True if return_fields is None else list(return_fields)
         return True
     
-    async def insert_group(self, entries):
-        points = [models.PointStruct(
-                    id=int(e.key),
-                    vector=e.embedding.tolist(),
-                    payload=e.fields
-                ) for e in entries]
-        try:
-            await self.client.upsert(collection_name=self.index, points=points)
-        except Exception as e:
-            print(e)
-        return True
+    async def insert_group(self, entries, wait=False):
+        '''
+        upserts entries in batches, concurrently, wait = False returns once Qdrant has 
+        received the points instead of after they are applied (searchable)
+        '''
+        def upsert(batch):
+            points = [models.PointStruct(
+                        id=int(e.key),
+                        vector=self._vectors(e),
+                        payload=e.fields
+                    ) for e in batch]
+            return self.client.upsert(collection_name=self.index, points=points, wait=wait)
+
+        return await self._in_batches(entries, upsert)
+
+    async def update_sparse(self, index, ids, sparse_vectors, wait=False):
+        '''
+        sets the BM25 sparse vectors ((indices, values), see sparse_encoder.py) of existing points
+        '''
+        def update(batch):
+            points = [models.PointVectors(id=int(i), vector={SPARSE_VECTOR: sparse_vector(sparse)}) for i, sparse in batch]
+            return self.client.update_vectors(collection_name=index, points=points, wait=wait)
+
+        return await self._in_batches(list(zip(ids, sparse_vectors)), update)
+
+    async def _in_batches(self, items, request):
+        '''
+        awaits request(batch) for batches of upsert_batch_size items, max_concurrent_upserts at once
+        '''
+        semaphore = asyncio.Semaphore(self.max_concurrent_upserts)
+
+        async def run(batch):
+            async with semaphore:
+                try:
+                    await request(batch)
+                except Exception as e:
+                    print(e)
+                    return False
+            return True
+
+        n = self.upsert_batch_size
+        results = await asyncio.gather(*[run(items[i:i+n]) for i in range(0, len(items), n)])
+        return all(results)
+
+    @staticmethod
+    def _vectors(entry):
+        if entry.sparse is None:
+            return entry.embedding.tolist()
+        return {'': entry.embedding.tolist(), SPARSE_VECTOR: sparse_vector(entry.sparse)}
 
     async def insert(self, entry):
         return await self.insert_group([entry])
     
     async def query(self, index, vector, k, ef=200):
         #params = models.SearchParams(hnsw_ef=ef)
-        s = time.time()
+        # the client takes numpy arrays, with gRPC vectors are sent as packed floats
         results = await self.client.query_points(
             collection_name=index,
-            query=vector.tolist(),
+            query=vector,
             limit=k,
+            with_payload=self.with_payload
+        )
+        return self._to_docs(results.points)
+    
+    async def query_group(self, index, vectors, k):
+        '''
+        searches for all vectors in one request
+        '''
+        requests = [models.QueryRequest(query=vector.tolist(), limit=k, with_payload=self.with_payload) for vector in vectors]
+        results = await self.client.query_batch_points(collection_name=index, requests=requests)
+        return [self._to_docs(result.points) for result in results]
+    
+    async def query_hybrid(self, index, query, k):
+        '''
+        hybrid search in one request, query = (dense vector, BM25 sparse vector): both searches
+        run in Qdrant (prefetch, k results each) and are merged with reciprocal rank fusion,
+        returns up to 2*k results like separate vector and full-text searches
+        '''
+        results = await self.client.query_points(
+            collection_name=index,
+            prefetch=self._prefetch(query, k),
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=2*k,
+            with_payload=self.with_payload
         )
-        t = time.time()-s
-        t = 1000*round(t,4)
-        print(f'vector db search: {t}')
+        return self._to_docs(results.points)
+
+    async def query_group_hybrid(self, index, queries, k):
+        '''
+        query_hybrid for all queries in one request
+        '''
+        requests = [models.QueryRequest(
+                        prefetch=self._prefetch(query, k),
+                        query=models.FusionQuery(fusion=models.Fusion.RRF),
+                        limit=2*k,
+                        with_payload=self.with_payload
+                    ) for query in queries]
+        results = await self.client.query_batch_points(collection_name=index, requests=requests)
+        return [self._to_docs(result.points) for result in results]
+
+    @staticmethod
+    def _prefetch(query, k) -> list:
+        vector, sparse = query
+        return [
+            models.Prefetch(query=np.asarray(vector).tolist(), limit=k),
+            models.Prefetch(query=sparse_vector(sparse), using=SPARSE_VECTOR, limit=k)
+        ]
+
+    @staticmethod
+    def _to_docs(points) -> list[dict]:
         docs = []
-        for point in results.points:
-            doc = point.payload
+        for point in points:
+            doc = dict(point.payload or {})
             doc["score"] = point.score  
             docs.append(doc)
         return docs
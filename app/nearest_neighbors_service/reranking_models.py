@@ -1,65 +1,182 @@
 from sentence_transformers import CrossEncoder
 from transformers import AutoTokenizer
 from optimum.intel import OVModelForSequenceClassification
+from batching import bucketed_batches
+from metrics import record_batch
+from token_store import PairEncoder, TokenStore
 from abc import ABC
+import numpy as np
+
+def ov_config(cache_dir: str=None) -> dict:
+    '''
+    OpenVINO compiles models on load (seconds on CPU), with CACHE_DIR the compiled model 
+    is stored and reused by later processes with the same model and device
+    '''
+    return {'CACHE_DIR': cache_dir} if cache_dir else {}
+
+def compile_ov_model(model, num_threads: int=None) -> None:
+    '''
+    compiles an optimum OpenVINO model loaded with compile=False, num_threads = inference 
+    threads (default all available cores)
+    '''
+    if num_threads:
+        model.ov_config['INFERENCE_NUM_THREADS'] = num_threads
+    model.compile()
+
+def normalize_score(logit) -> float:
+    '''
+    the model cross-encoder/ms-marco-MiniLM-L6-v2 returns similarity scores between [-10, 10]
+    this normalizes scores to be between [0-1]
+    '''
+    return round((float(logit)+10)/20, 4)
+
+def encode_pairs(tokenizer, encoder: PairEncoder, pairs: list[tuple], pad_to_multiple_of: int=None):
+    '''
+    tokenizes (query, context) pairs, with passage tokens from encoder's token store if given,
+    returns (lengths, pad), pad(batch) = padded model inputs of pairs[i] for i in batch
+    '''
+    queries = [query for query, _ in pairs]
+    texts = [context['text'] for _, context in pairs]
+    if encoder is not None:
+        encoded = encoder.encode(queries, texts, [context.get('id') for _, context in pairs])
+        lengths = [len(input_ids) for input_ids, _, _ in encoded]
+        return lengths, lambda batch: encoder.pad(encoded, batch, pad_to_multiple_of)
+    # tokenize once without padding, then pad each batch to its longest sequence
+    tokens = tokenizer(queries, texts, truncation=True)
+    lengths = [len(ids) for ids in tokens['input_ids']]
+    return lengths, lambda batch: tokenizer.pad(
+                {name: [values[i] for i in batch] for name, values in tokens.items()},
+                padding='longest',
+                pad_to_multiple_of=pad_to_multiple_of,
+                return_tensors='np'
+            )
+
+def sort_by_scores(pairs: list[tuple], scores: list[float], contexts_lists: list[list[dict]]) -> list[list[dict]]:
+    '''
+    sets the score of each (query, context) pair on its context and sorts each list of contexts 
+    in decreasing order of score, in place
+    '''
+    for (_, context), score in zip(pairs, scores):
+        context['score'] = score
+    for contexts in contexts_lists:
+        contexts.sort(key = lambda x: x['score'], reverse = True)
+    return contexts_lists
 
 class Reranker(ABC):
+    # optional ScoreCache for scores of (query, passage id) pairs
+    score_cache = None
+
     def predict(self, query: str, contexts: list[dict]) -> list[dict]:
         '''
         add similarity score between query and context for each context in contexts
         '''
         ...
-    
+
+    def predict_pairs(self, pairs: list[tuple]) -> list[float]:
+        '''
+        similarity score for each (query, context) pair, by default calls predict once per query
+        '''
+        groups = {}
+        for i, (query, _) in enumerate(pairs):
+            groups.setdefault(query, []).append(i)
+        scores = [None]*len(pairs)
+        for query, idxs in groups.items():
+            for i, score in zip(idxs, self.predict(query, [pairs[i][1] for i in idxs])):
+                scores[i] = score
+        return scores
+
+    def score(self, pairs: list[tuple]) -> list[float]:
+        '''
+        predict_pairs, skipping pairs in score_cache
+        '''
+        if self.score_cache is None:
+            return self.predict_pairs(pairs)
+        return self.score_cache.memoize(pairs, self.predict_pairs)
+
     def rerank(self, query: str, contexts: list[dict]) -> list[dict]:
         '''
         return contexts sorted in decreasing order of similarity to query
         '''
-        scores = self.predict(query, contexts)
-        for context, score in zip(contexts, scores):
-            context['score'] = score
-        contexts.sort(key = lambda x: x['score'], reverse = True)
-        return contexts
-    
+        return self.rerank_batch([query], [contexts])[0]
+
+    def rerank_batch(self, queries: list[str], contexts_lists: list[list[dict]]) -> list[list[dict]]:
+        '''
+        rerank for several queries, all pairs are scored together so models can batch across queries
+        '''
+        pairs = [(query, context) for query, contexts in zip(queries, contexts_lists) for context in contexts]
+        return sort_by_scores(pairs, self.score(pairs), contexts_lists)
+
 class HugginFace_Reranker(Reranker):
-    def __init__(self, model_name):
+    def __init__(self, model_name, score_cache=None, batch_size=32):
         '''
         wrapper for SentenceTransformers CrossEncoder models
         '''
         self.model = CrossEncoder(model_name)
-    
+        self.score_cache = score_cache
+        self.batch_size = batch_size
+
     def predict(self, query, contexts):
+        return self.predict_pairs([(query, context) for context in contexts])
+
+    def predict_pairs(self, pairs):
         scores = self.model.predict(
-                [(query, context['text']) for context in contexts]
+                [(query, context['text']) for query, context in pairs],
+                batch_size = self.batch_size
             )
         return scores
-    
+
     def rerank(self, query, contexts):
         return super().rerank(query, contexts)
-    
+
 class OpenVINO_Reranker(Reranker):
-    def __init__(self, model_name, model_path):
+    def __init__(self, 
+                 model_name, 
+                 model_path, 
+                 score_cache=None, 
+                 max_batch_tokens=16384, 
+                 cache_dir=None, 
+                 token_store: TokenStore=None,
+                 max_padding=0.25,
+                 compile=True
+                ):
         '''
         returns INT8 quantized verison of model_name running with OpenVino backend
             model_name = original SentenceTransformer CrossEncoder model name
             model_path = path to OpenVino model
+            score_cache = optional ScoreCache, skips inference for previously scored pairs
+            max_batch_tokens = max tokens (including padding) per inference batch
+            cache_dir = optional OpenVINO compiled model cache directory
+            token_store = optional passage tokens from ingestion, only queries are tokenized
+            max_padding = pairs are sorted by length and batched with at most this fraction of
+                padding tokens, None only applies max_batch_tokens (see batching.bucketed_batches)
+            compile = False only reads the model, compile_model compiles it later (e.g., after fork)
         '''
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = OVModelForSequenceClassification.from_pretrained(model_path)
-    
+        self.model = OVModelForSequenceClassification.from_pretrained(
+                        model_path, 
+                        ov_config=ov_config(cache_dir), 
+                        compile=compile
+                    )
+        self.score_cache = score_cache
+        self.max_batch_tokens = max_batch_tokens
+        self.max_padding = max_padding
+        self.encoder = PairEncoder(self.tokenizer, token_store) if token_store is not None else None
+
+    def compile_model(self, num_threads: int=None) -> None:
+        compile_ov_model(self.model, num_threads)
+
     def predict(self, query, contexts):
-        k = len(contexts)
-        inputs = self.tokenizer(
-                    [query]*k, 
-                    [context['text'] for context in contexts], 
-                    padding='longest',
-                    truncation=True,
-                    return_tensors='pt'
-                )
-        logits = self.model(**inputs).logits
-        # the model cross-encoder/ms-marco-MiniLM-L6-v2 returns similarity scores between [-10, 10]
-        # this normalizes scores to be between [0-1]
-        scores = [round((float(score)+10)/20, 4) for score in logits]
+        return self.predict_pairs([(query, context) for context in contexts])
+
+    def predict_pairs(self, pairs):
+        lengths, pad = encode_pairs(self.tokenizer, self.encoder, pairs)
+        scores = [None]*len(pairs)
+        for batch in bucketed_batches(lengths, self.max_batch_tokens, self.max_padding):
+            record_batch('reranker', [lengths[i] for i in batch])
+            logits = np.asarray(self.model(**pad(batch)).logits).reshape(-1)
+            for i, score in zip(batch, logits):
+                scores[i] = normalize_score(score)
         return scores
-    
+
     def rerank(self, query, contexts):
-        return super().rerank(query, contexts)
\ No newline at end of file
+        return super().rerank(query, contexts)
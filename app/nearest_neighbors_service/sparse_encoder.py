@@ -0,0 +1,68 @@
+'''
+BM25 as sparse vectors, for hybrid search in a single Qdrant query (SearchType.HYBRID)
+
+documents are stored with the BM25 term frequency part of each term's weight,
+    tf*(k1+1)/(tf+k1*(1-b+b*length/avg_length))
+queries are their terms with weight 1, and Qdrant multiplies by the inverse document frequency
+at query time (collection sparse vectors with the IDF modifier), so the dot product is the BM25
+score and IDF stays current as passages are added
+
+terms are lower cased words without stop words, hashed to 32 bit indices (no vocabulary),
+unlike OpenSearch's english analyzer there is no stemming
+'''
+from collections import Counter
+import re, zlib
+
+STOP_WORDS = frozenset('''
+a an and are as at be but by did do does for from had has have he her his how i if in into is
+it its of on or she that the their them then there these they this to was were what when where
+which who whom whose why will with
+'''.split())
+
+_word_regex = re.compile(r'\w+')
+
+def terms(text: str) -> list[str]:
+    '''
+    lower cased words of text without stop words, in order, shared by BM25 sparse vectors,
+    context trimming (context_trimming.py) and the fake search backends
+    '''
+    return [word for word in _word_regex.findall(text.lower()) if word not in STOP_WORDS]
+
+def term_index(term: str) -> int:
+    return zlib.crc32(term.encode('utf-8'))
+
+class BM25_Encoder:
+    def __init__(self, k1: float=1.2, b: float=0.75, avg_length: float=None):
+        '''
+        k1 and b = BM25 parameters, avg_length = mean number of terms per passage,
+        only needed to encode passages (see average_length)
+        '''
+        self.k1 = k1
+        self.b = b
+        self.avg_length = avg_length
+
+    @staticmethod
+    def average_length(texts) -> float:
+        lengths = [len(terms(text)) for text in texts]
+        return sum(lengths)/max(len(lengths), 1)
+
+    def encode_query(self, text: str) -> tuple[list[int], list[float]]:
+        '''
+        (indices, values) of the query terms
+        '''
+        indices = sorted({term_index(term) for term in terms(text)})
+        return indices, [1.0]*len(indices)
+
+    def encode_passage(self, text: str) -> tuple[list[int], list[float]]:
+        '''
+        (indices, values) with the BM25 term frequency weight of each term
+        '''
+        words = terms(text)
+        norm = self.k1*(1-self.b+self.b*len(words)/self.avg_length) if self.avg_length else self.k1
+        weights = {}
+        for term, tf in Counter(words).items():
+            # distinct terms may share an index, their weights add up
+            index = term_index(term)
+            weights[index] = weights.get(index, 0.0)+tf*(self.k1+1)/(tf+norm)
+        indices = sorted(weights)
+        return indices, [weights[i] for i in indices]
@@ -0,0 +1,180 @@
+'''
+async clients for the query embedding model and the cross-encoder reranker on Nvidia Triton
+Inference Server, so API workers only tokenize and post-process, and Triton's dynamic batching
+combines requests from all API workers
+
+the Triton model repository serves the models exported for the app, e.g., with the OpenVINO backend:
+    snowflake-arctic-embed-s = openvino_model.xml from embedding_models.py, output last_hidden_state
+    ms-marco-MiniLM-L6-v2 = the INT8 cross-encoder in models, output logits
+with dynamic_batching enabled; requests are padded to a multiple of pad_to_multiple_of tokens,
+so requests of similar length share a shape that the dynamic batcher can combine
+'''
+import tritonclient.http.aio as httpclient
+from transformers import AutoTokenizer
+from embedding_models import sentence_config, pool, normalize
+from reranking_models import encode_pairs, normalize_score, sort_by_scores
+from batching import token_budget_batches, bucketed_batches
+from metrics import record_batch
+from token_store import PairEncoder, TokenStore
+import numpy as np
+import asyncio
+
+def infer_inputs(inputs: dict) -> list:
+    '''
+    Triton INT64 inputs from padded tokenizer outputs
+    '''
+    infer_inputs = []
+    for name, values in inputs.items():
+        values = np.asarray(values, dtype=np.int64)
+        infer_input = httpclient.InferInput(name, list(values.shape), 'INT64')
+        infer_input.set_data_from_numpy(values)
+        infer_inputs.append(infer_input)
+    return infer_inputs
+
+class Triton_Client:
+    # awaited by NearestNeighborService instead of running on the event loop or in a thread
+    is_async = True
+
+    def __init__(self, host: str, port: str, model_name: str):
+        self.url = f'{host}:{port}'
+        self.model = model_name
+        self.client = None
+
+    async def infer(self, inputs: dict, output: str) -> np.ndarray:
+        '''
+        runs the model on inputs (name -> array), returns output as array
+        '''
+        # created on first use, as aiohttp sessions must be created on the event loop
+        # and models are loaded in worker threads
+        if self.client is None:
+            self.client = httpclient.InferenceServerClient(url=self.url)
+        results = await self.client.infer(
+            self.model,
+            infer_inputs(inputs),
+            outputs=[httpclient.InferRequestedOutput(output, binary_data=True)]
+        )
+        return results.as_numpy(output)
+
+class Triton_Embedding_Client(Triton_Client):
+    def __init__(self,
+                 host: str,
+                 port: str,
+                 model_name: str,
+                 model_path: str,
+                 max_batch_tokens: int=16384,
+                 pad_to_multiple_of: int=16
+                ):
+        '''
+        async SentenceTransformer compatible encode with the model on triton inference server at host:port
+            model_name = Triton model returning last_hidden_state
+            model_path = directory with the tokenizer and SentenceTransformer configs, e.g., the
+                directory written by embedding_models.py
+            max_batch_tokens = max tokens (including padding) per inference request
+            pad_to_multiple_of = sequence lengths are padded to a multiple of this
+        pooling and normalization run in the client, see OpenVINO_Embedding
+        '''
+        super().__init__(host, port, model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        config = sentence_config(model_path, self.tokenizer)
+        self.prompts = config['prompts']
+        self.max_seq_length = config['max_seq_length']
+        self.pooling = config['pooling']
+        self.normalize = config['normalize']
+        self.max_batch_tokens = max_batch_tokens
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    async def encode(self, sentences, prompt_name: str=None, **kwargs) -> np.ndarray:
+        '''
+        returns embedding of sentences (str) or matrix of embeddings for a list of sentences
+        prompt_name = key of the model's prompts, e.g., query
+        batches are sent concurrently
+        '''
+        single = isinstance(sentences, str)
+        prompt = self.prompts.get(prompt_name, '') if prompt_name else ''
+        texts = [prompt+s for s in ([sentences] if single else sentences)]
+        tokens = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+        lengths = [len(ids) for ids in tokens['input_ids']]
+        batches = token_budget_batches(lengths, self.max_batch_tokens)
+        for batch in batches:
+            record_batch('embedding', [lengths[i] for i in batch])
+        results = await asyncio.gather(*[self._encode(tokens, batch) for batch in batches])
+        embeddings = [None]*len(texts)
+        for batch, batch_embeddings in zip(batches, results):
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+        embeddings = np.stack(embeddings).astype(np.float32)
+        if self.normalize:
+            embeddings = normalize(embeddings)
+        return embeddings[0] if single else embeddings
+
+    async def _encode(self, tokens, batch: list[int]) -> np.ndarray:
+        inputs = self.tokenizer.pad(
+                    {name: [values[i] for i in batch] for name, values in tokens.items()},
+                    padding='longest',
+                    pad_to_multiple_of=self.pad_to_multiple_of,
+                    return_tensors='np'
+                )
+        hidden = await self.infer(inputs, 'last_hidden_state')
+        return pool(hidden, inputs['attention_mask'], self.pooling)
+
+class Triton_Reranker_Client(Triton_Client):
+    def __init__(self,
+                 host: str,
+                 port: str,
+                 model_name: str,
+                 tokenizer,
+                 score_cache=None,
+                 token_store: TokenStore=None,
+                 max_batch_tokens: int=16384,
+                 max_padding: float=0.25,
+                 pad_to_multiple_of: int=16
+                ):
+        '''
+        async version of OpenVINO_Reranker with the model on triton inference server at host:port
+            model_name = Triton model returning logits
+            tokenizer = tokenizer of the original cross-encoder
+            score_cache, token_store, max_batch_tokens and max_padding = see OpenVINO_Reranker
+            pad_to_multiple_of = sequence lengths are padded to a multiple of this
+        '''
+        super().__init__(host, port, model_name)
+        if isinstance(tokenizer, str):
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+        self.tokenizer = tokenizer
+        self.score_cache = score_cache
+        self.encoder = PairEncoder(tokenizer, token_store) if token_store is not None else None
+        self.max_batch_tokens = max_batch_tokens
+        self.max_padding = max_padding
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    async def predict_pairs(self, pairs: list[tuple]) -> list[float]:
+        '''
+        similarity score for each (query, context) pair, batches are sent concurrently
+        '''
+        lengths, pad = encode_pairs(self.tokenizer, self.encoder, pairs, self.pad_to_multiple_of)
+        batches = bucketed_batches(lengths, self.max_batch_tokens, self.max_padding)
+        for batch in batches:
+            record_batch('reranker', [lengths[i] for i in batch])
+        results = await asyncio.gather(*[self.infer(pad(batch), 'logits') for batch in batches])
+        scores = [None]*len(pairs)
+        for batch, logits in zip(batches, results):
+            for i, score in zip(batch, np.asarray(logits).reshape(-1)):
+                scores[i] = normalize_score(score)
+        return scores
+
+    async def score(self, pairs: list[tuple]) -> list[float]:
+        '''
+        predict_pairs, skipping pairs in score_cache
+        '''
+        if self.score_cache is None:
+            return await self.predict_pairs(pairs)
+        return await self.score_cache.amemoize(pairs, self.predict_pairs)
+
+    async def rerank(self, query: str, contexts: list[dict]) -> list[dict]:
+        '''
+        return contexts sorted in decreasing order of similarity to query
+        '''
+        return (await self.rerank_batch([query], [contexts]))[0]
+
+    async def rerank_batch(self, queries: list[str], contexts_lists: list[list[dict]]) -> list[list[dict]]:
+        pairs = [(query, context) for query, contexts in zip(queries, contexts_lists) for context in contexts]
+        return sort_by_scores(pairs, await self.score(pairs), contexts_lists)
@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from enum import Enum
 import numpy as np
-import json
+import json, asyncio
 from tqdm import tqdm
 
 class Distance(Enum):
@@ -13,10 +13,12 @@ class DB_Entry:
     '''
     struct for database entries
     '''
-    def __init__(self, key: str, embedding: np.array, fields: dict=None):
+    def __init__(self, key: str, embedding: np.array, fields: dict=None, sparse: tuple=None):
         self.key = key
         self.embedding = embedding
         self.fields = fields
+        # optional (indices, values) sparse vector, see sparse_encoder.py
+        self.sparse = sparse
 
     @classmethod
     def from_json(cls, json_obj: dict, quantization: np.dtype=np.float32):
@@ -56,17 +58,15 @@ class VDB_Client(ABC):
         ...
 
     async def insert_group(self, entries: list[DB_Entry]) -> bool:
-        results = []
-        for entry in entries:
-            results.append(self.insert(entry))
+        results = await asyncio.gather(*[self.insert(entry) for entry in entries])
         return all(results)
     
     @abstractmethod
     async def query(self, index: str, vector: np.array, k: int) -> dict:
         ...
 
-    async def query_group(self, index: str, vectors: list[np.array], k: int) -> dict:
-        docs = []
-        for vector in vectors:
-            docs.append(self.query(index, vector, k))
-        return docs
\ No newline at end of file
+    async def query_group(self, index: str, vectors: list[np.array], k: int) -> list[dict]:
+        '''
+        results of query for each vector, override to use the database's batch search
+        '''
+        return await asyncio.gather(*[self.query(index, vector, k) for vector in vectors])
\ No newline at end of file
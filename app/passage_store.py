@@ -0,0 +1,38 @@
+'''
+local passage text addressed by passage id, with a store the search backends only return ids and
+scores, and text is added (hydrated) to the few results that need it after fusion and reranking
+build the store with ingestion.py, it is a memory-mapped StringTable shared by all worker processes
+'''
+from collections.abc import Sequence
+from string_table import StringTable
+import os
+
+# default store location, used by NearestNeighborService.make_default_service when the file exists
+PASSAGES = '/data/passages.bin'
+
+class PassageStore:
+    def __init__(self, texts: Sequence[str]):
+        '''
+        texts = passage text indexed by passage id, e.g., a StringTable
+        '''
+        self.texts = texts
+        self.hydrated = 0
+
+    def text(self, passage_id) -> str:
+        return self.texts[int(passage_id)]
+
+    def hydrate(self, contexts: list[dict]) -> list[dict]:
+        '''
+        adds text to contexts without it, in place, returns contexts
+        '''
+        for context in contexts:
+            if 'text' not in context:
+                context['text'] = self.text(context['id'])
+                self.hydrated += 1
+        return contexts
+
+    def stats(self) -> dict:
+        return {'passages': len(self.texts), 'hydrated': self.hydrated}
+
+def load_passage_store(path: str) -> PassageStore | None:
+    return PassageStore(StringTable(path)) if path and os.path.exists(path) else None
@@ -0,0 +1,139 @@
+'''
+pre-fork server: the master process loads the models and page info once (main.preload), then
+forks workers that serve main.app on a shared listening socket, so read-only pages (model
+weights, tokenizers, token and string tables) are shared copy-on-write instead of loaded per worker
+
+    cd app && python prefork.py --workers 4 --port 8000
+
+- the master only reads OpenVINO models, each worker compiles them after fork (a cache load
+  with OV_CACHE_DIR), as inference thread pools don't survive fork
+- gc.freeze() before fork moves the master's objects to a permanent generation, so garbage
+  collections in workers don't write to (and copy) their pages
+- titles and hrefs are memory-mapped string tables (see QA_Manager.load_page_info) rather than
+  lists of strings, whose reference counts would dirty pages as workers read them
+- each worker is pinned to its own slice of cores (os.sched_setaffinity) and limits OpenVINO,
+  PyTorch and BLAS threads to it, so workers don't oversubscribe cores
+- workers that exit are restarted, SIGTERM or SIGINT stop all workers
+see benchmarks/prefork.py for per worker memory (RSS/PSS) and throughput vs number of workers
+'''
+import main
+from threadpoolctl import threadpool_limits
+import torch
+import uvicorn
+import argparse, gc, logging, os, select, signal, socket, sys
+
+logger = logging.getLogger('prefork')
+
+def core_slices(cores: list[int], workers: int) -> list[list[int]]:
+    '''
+    splits cores evenly between workers, with more workers than cores, workers share cores
+    '''
+    per_worker = max(1, len(cores)//workers)
+    return [[cores[(i*per_worker+j) % len(cores)] for j in range(per_worker)] for i in range(workers)]
+
+class WorkerServer(uvicorn.Server):
+    '''
+    uvicorn server that tells the master when lifespan startup (loading and warmup) finished
+    '''
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b'.')
+
+def run_worker(sock: socket.socket, cores: list[int], ready_fd: int) -> None:
+    '''
+    serves main.app on sock, with inference threads pinned to cores (None = all cores)
+    '''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    num_threads = None
+    if cores is not None:
+        num_threads = len(cores)
+        os.sched_setaffinity(0, cores)
+        threadpool_limits(num_threads)
+        torch.set_num_threads(num_threads)
+    main.compile_preloaded(num_threads)
+    config = uvicorn.Config(main.app, log_level=os.getenv('LOG_LEVEL', 'info').lower())
+    WorkerServer(config, ready_fd).run(sockets=[sock])
+
+def serve(host: str, port: int, workers: int, preload: bool=True, pin: bool=True) -> int:
+    '''
+    runs the master process until it's stopped, returns the exit status
+    preload = False loads models in each worker instead (same as uvicorn --workers), for comparison
+    pin = False lets every worker use all cores
+    '''
+    # objects allocated from here on stay out of collections, see gc.freeze
+    gc.disable()
+    if preload:
+        main.preload()
+    sock = socket.create_server((host, port), backlog=2048)
+    slices = core_slices(sorted(os.sched_getaffinity(0)), workers) if pin else [None]*workers
+    ready_r, ready_w = os.pipe()
+    gc.collect()
+    gc.freeze()
+    pids = {}
+    stopping = False
+
+    def spawn(i: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                os.close(ready_r)
+                run_worker(sock, slices[i], ready_w)
+            except BaseException:
+                logger.exception(f'worker {os.getpid()} failed')
+                status = 1
+            finally:
+                os._exit(status)
+        pids[pid] = i
+        logger.info(f'started worker {pid} on cores {slices[i] or "all"}')
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(workers):
+        spawn(i)
+    ready, status = 0, 0
+    while pids:
+        if select.select([ready_r], [], [], 1.0)[0]:
+            ready += len(os.read(ready_r, 1024))
+            if ready == workers:
+                logger.info(f'{workers} workers ready')
+        while pids:
+            pid, exit_status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            i = pids.pop(pid)
+            if stopping:
+                continue
+            code = os.waitstatus_to_exitcode(exit_status)
+            if ready < workers:
+                # failing during startup, restarting would fail again
+                logger.error(f'worker {pid} exited with status {code} before all workers were ready')
+                stop(None, None)
+                status = 1
+                continue
+            logger.warning(f'worker {pid} exited with status {code}, restarting')
+            spawn(i)
+    return status
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', 2)))
+    parser.add_argument('--no-preload', action='store_true', help='load models in each worker')
+    parser.add_argument('--no-pin', action='store_true', help="don't pin workers to cores")
+    args = parser.parse_args()
+    sys.exit(serve(args.host, args.port, args.workers, not args.no_preload, not args.no_pin))
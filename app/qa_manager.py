@@ -1,20 +1,70 @@
-from nearest_neighbors_service.ann_service import NearestNeighborService, SearchType
+from nearest_neighbors_service.ann_service import NearestNeighborService, SearchType, Fusion, WARMUP_QUESTION, WARMUP_PASSAGE
 from qa_service.qa_service import QA_Service
-import logging
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache
+from score_cache import ScoreCache
+from compute_policy import AdaptiveComputePolicy
+from instrumentation import request_trace, stage, is_degraded, note_degraded
+from admission import AdmissionController, FULL, SMALLER_K, SKIP_RERANK, VECTOR_ONLY
+from contextlib import asynccontextmanager
+from string_table import StringTable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, os, tempfile
 
 class QA_Manager:
-    def __init__(self, nearest_neighbor_service, qa_service, k: int=5):
+    def __init__(self, 
+                 nearest_neighbor_service, 
+                 qa_service, 
+                 k: int=5, 
+                 response_cache: ResponseCache=None,
+                 semantic_cache: SemanticCache=None,
+                 compute_policy: AdaptiveComputePolicy=None,
+                 batch_size: int=32,
+                 max_concurrent_batches: int=2,
+                 hrefs: list[str]=None,
+                 titles: list[str]=None,
+                 admission: AdmissionController=None,
+                 pipelined: bool=False
+                ):
         self.nearest_neighbor_service = nearest_neighbor_service
         self.qa_service = qa_service
         self.k = k
+        # optional cache of complete responses, keyed by normalized question, search type and k
+        self.response_cache = response_cache
+        # optional cache of responses for similar queries, keyed by query embedding
+        self.semantic_cache = semantic_cache
+        # optional policy to answer fewer contexts when the reranker is confident
+        self.compute_policy = compute_policy
+        # answer_batch answers batch_size questions per pipeline run, 
+        # with at most max_concurrent_batches runs at once across all requests
+        self.batch_size = batch_size
+        self._batch_semaphore = asyncio.Semaphore(max_concurrent_batches)
+        # optional load shedding and degradation for answer and answer_stream,
+        # checked after the response cache so cached responses are always served
+        self.admission = admission
+        # answer overlaps retrieval stages and question answering, see _answer_pipelined
+        self.pipelined = pipelined
         # these files store titles and urls for popular pages
-        self.hrefs = self.load_page_info('/data/popular_hrefs.txt')
-        self.titles = self.load_page_info('/data/popular_titles.txt')
+        self.hrefs = hrefs if hrefs is not None else self.load_page_info('/data/popular_hrefs.txt')
+        self.titles = titles if titles is not None else self.load_page_info('/data/popular_titles.txt')
     
-    def load_page_info(self, file):
+    @staticmethod
+    def load_page_info(file, shared=False):
         '''
-        for loading titles and urls of popular wiki pages
+        for loading titles and urls of popular wiki pages, indexed by passage id
+        uses the memory-mapped string table next to file (same name, .bin) if it exists,
+        shared by all worker processes, see string_table.py to build it
+        shared = without the table, build one in a temporary directory instead of a list of strings,
+            e.g., before forking workers (prefork.py), whose reference counting would copy list pages
         '''
+        table_path = os.path.splitext(file)[0]+'.bin'
+        if os.path.exists(table_path):
+            return StringTable(table_path)
+        if shared:
+            with tempfile.TemporaryDirectory() as tmp:
+                StringTable.from_text_file(file, os.path.join(tmp, 'table.bin'))
+                # the mapping stays valid after the file is removed
+                return StringTable(os.path.join(tmp, 'table.bin'))
         with open(file, 'r') as f:
             return f.read().split('\n')
     
@@ -27,47 +77,605 @@ class QA_Manager:
                      qa_type = 'openvino',
                      inference_host = 'localhost', 
                      inference_port = '9000',
+                     response_cache = None,
+                     semantic_cache = None,
+                     score_cache_size = 0,
+                     fusion = Fusion.CONCAT,
+                     rerank_top_n = None,
+                     compute_policy = None,
+                     batch_size = 32,
+                     max_concurrent_batches = 2,
+                     ov_cache_dir = None,
+                     embedding_type = 'torch',
+                     reranker_type = 'openvino',
+                     models = None,
+                     vector_db_replicas = None,
+                     fulltext_replicas = None,
+                     vector_timeout = None,
+                     fulltext_timeout = None,
+                     hedge_percentile = None,
+                     admission = None,
+                     context_trimmer = None,
+                     pipelined = False,
+                     hrefs = None,
+                     titles = None,
+                     vector_db_grpc_port = None,
+                     embedding_projection = None,
                     ):
         '''
         creates the following:
         - hybrid search for relevant documents
-            * embedding model = Snowflake/snowflake-arctic-embed-s running in PyTorch
+            * embedding model = Snowflake/snowflake-arctic-embed-s running in PyTorch,
+              or OpenVINO (FP32 or INT8) with embedding_type = openvino or openvino_int8,
+              or on Nvidia Triton Inference Server with embedding_type = triton
             * HNSW index in Qdrant
             * BM25 fulltext search in OpenSearch
             * reranking with INT8 quantized version of cross-encoder/ms-marco-MiniLM-L6-v2
-                running in OpenVino
+                running in OpenVino, on Triton with reranker_type = triton
         - extractive question answering with distilbert/distilbert-base-cased-distilled-squad
             * if qa_type = trition, then provide the host and port for Nvidia Triton Inference Server
               o.w. uses INT8 quantized version running in OpenVino
+        - the same Triton server (inference_host:inference_port) serves every model set to triton
+        - optional response_cache in front of the whole pipeline
+        - optional semantic_cache to reuse responses for paraphrased questions
+        - score_cache_size > 0 caches reranker scores and answer spans per (question, passage)
+        - fusion and rerank_top_n control merging and reranking hybrid results,
+          see NearestNeighborService.make_default_service
+        - optional compute_policy limits the number of contexts sent to question answering
+        - batch_size and max_concurrent_batches limit the work done by answer_batch
+        - ov_cache_dir = OpenVINO compiled model cache
+        - models = preloaded models from load_default_models, o.w. loaded here
+        - backend replicas ((host, port) lists), per backend timeouts (seconds) and hedging,
+          see NearestNeighborService
+        - optional admission controller to shed load and degrade quality under overload
+        - optional context_trimmer cuts long passages to the sentences relevant to the question
+          before question answering
+        - pipelined overlaps the stages of each /ask request, see QA_Manager._answer_pipelined
+        - hrefs and titles = preloaded page info (see load_page_info), o.w. loaded here
+        - vector_db_grpc_port = query Qdrant over gRPC on this port instead of REST
+        - embedding_projection = path of the projection (projection.py) applied to passage
+          embeddings in the vector index, query embeddings are projected the same way
         '''
+        if models is None:
+            models = cls.load_default_models(
+                        qa_type, 
+                        score_cache_size, 
+                        ov_cache_dir, 
+                        embedding_type, 
+                        reranker_type, 
+                        inference_host, 
+                        inference_port
+                    )
         ann_service = NearestNeighborService.make_default_service(
             vector_db_host, 
             vector_db_port, 
             fulltext_host, 
-            fulltext_port
+            fulltext_port,
+            score_cache_size,
+            fusion,
+            rerank_top_n,
+            embedding_model = models['embedding_model'],
+            reranker = models['reranker'],
+            vector_db_replicas = vector_db_replicas,
+            fulltext_replicas = fulltext_replicas,
+            vector_timeout = vector_timeout,
+            fulltext_timeout = fulltext_timeout,
+            hedge_percentile = hedge_percentile,
+            vector_db_grpc_port = vector_db_grpc_port,
+            projection_path = embedding_projection
         )
         # selecting triton will run question answering compute on triton inference server
         # this works with both GPU enabled and CPU only hosts, otherwise default to compute
         # on same CPU as backend 
         # in both cases, assumes model is stored in models folder
+        answer_cache = ScoreCache(score_cache_size) if score_cache_size > 0 else None
         if qa_type == 'triton':
-            qa_service = QA_Service.make_triton_service(inference_host, inference_port)
+            qa_service = QA_Service.make_triton_service(inference_host, inference_port, answer_cache, models['qa_model'])
         else:
-            qa_service = QA_Service.make_quantized_service()
-        return QA_Manager(ann_service, qa_service)
+            qa_service = QA_Service.make_quantized_service(answer_cache, models['qa_model'])
+        qa_service.context_trimmer = context_trimmer
+        return QA_Manager(
+                    ann_service, 
+                    qa_service, 
+                    response_cache=response_cache,
+                    semantic_cache=semantic_cache,
+                    compute_policy=compute_policy,
+                    batch_size=batch_size,
+                    max_concurrent_batches=max_concurrent_batches,
+                    admission=admission,
+                    pipelined=pipelined,
+                    hrefs=hrefs,
+                    titles=titles
+                )
+    
+    @staticmethod
+    def load_default_models(qa_type: str='openvino', 
+                            score_cache_size: int=0, 
+                            ov_cache_dir: str=None, 
+                            embedding_type: str='torch',
+                            reranker_type: str='openvino',
+                            inference_host: str='localhost',
+                            inference_port: str='9000',
+                            compile: bool=True
+                           ) -> dict:
+        '''
+        loads the embedding model, reranker and QA model (tokenizer for triton) concurrently, 
+        loading is mostly file reads and OpenVINO compilation, which release the GIL
+        models with type triton are clients of Nvidia Triton Inference Server at inference_host:inference_port
+        compile = False only reads OpenVINO models, see compile_models
+        '''
+        loaders = {
+            'embedding_model': lambda: NearestNeighborService.load_embedding_model(
+                                        embedding_type, 
+                                        ov_cache_dir, 
+                                        inference_host, 
+                                        inference_port,
+                                        compile
+                                    ),
+            'reranker': lambda: NearestNeighborService.load_reranker(
+                                        score_cache_size, 
+                                        ov_cache_dir, 
+                                        reranker_type = reranker_type, 
+                                        inference_host = inference_host, 
+                                        inference_port = inference_port,
+                                        compile = compile
+                                    ),
+            'qa_model': QA_Service.load_triton_tokenizer if qa_type == 'triton' 
+                        else lambda: QA_Service.load_quantized_model(ov_cache_dir, compile=compile)
+        }
+        with ThreadPoolExecutor(len(loaders)) as pool:
+            futures = {name: pool.submit(loader) for name, loader in loaders.items()}
+            return {name: future.result() for name, future in futures.items()}
+    
+    @staticmethod
+    def compile_models(models: dict, num_threads: int=None) -> None:
+        '''
+        compiles OpenVINO models from load_default_models(compile=False) with num_threads 
+        inference threads each, other models (PyTorch, Triton clients, tokenizers) are skipped
+        '''
+        for model in models.values():
+            if hasattr(model, 'compile_model'):
+                model.compile_model(num_threads)
+    
+    @classmethod
+    async def load_default_manager(cls, 
+                                   qa_type: str='openvino', 
+                                   score_cache_size: int=0, 
+                                   ov_cache_dir: str=None, 
+                                   embedding_type: str='torch', 
+                                   reranker_type: str='openvino',
+                                   inference_host: str='localhost',
+                                   inference_port: str='9000',
+                                   **kwargs
+                                  ):
+        '''
+        make_default_manager for use inside the event loop (e.g., app lifespan): models load in 
+        worker threads so the loop keeps running, clients are created on the loop
+        kwargs are passed to make_default_manager
+        '''
+        models = await asyncio.to_thread(
+                    cls.load_default_models, 
+                    qa_type, 
+                    score_cache_size, 
+                    ov_cache_dir, 
+                    embedding_type, 
+                    reranker_type, 
+                    inference_host, 
+                    inference_port
+                )
+        return cls.make_default_manager(
+                    qa_type = qa_type, 
+                    score_cache_size = score_cache_size, 
+                    inference_host = inference_host,
+                    inference_port = inference_port,
+                    models = models, 
+                    **kwargs
+                )
         
+    @classmethod
+    def make_fake_manager(cls,
+                     num_passages = 10000,
+                     embed_ms = 0.0,
+                     search_ms = 0.0,
+                     fulltext_search_ms = None,
+                     rerank_ms_per_pair = 0.0,
+                     qa_ms = 0.0,
+                     qa_ms_per_pair = 0.0,
+                     jitter_ms = 0.0,
+                     search_tail_ms = 0.0,
+                     search_tail_probability = 0.0,
+                     replicas = 0,
+                     vector_timeout = None,
+                     fulltext_timeout = None,
+                     hedge_percentile = None,
+                     ids_only = False,
+                     context_trimmer = None,
+                     **kwargs
+                    ):
+        '''
+        creates manager with in-process fakes for all models and backends, see 
+        NearestNeighborService.make_fake_service and QA_Service.make_fake_service
+        runs without network, GPUs, models or /data files; kwargs are passed to QA_Manager
+        fulltext_search_ms = full-text search latency if different from search_ms
+        '''
+        ann_service = NearestNeighborService.make_fake_service(
+            num_passages = num_passages,
+            embed_ms = embed_ms,
+            vector_search_ms = search_ms,
+            fulltext_search_ms = search_ms if fulltext_search_ms is None else fulltext_search_ms,
+            rerank_ms_per_pair = rerank_ms_per_pair,
+            jitter_ms = jitter_ms,
+            tail_ms = search_tail_ms,
+            tail_probability = search_tail_probability,
+            replicas = replicas,
+            vector_timeout = vector_timeout,
+            fulltext_timeout = fulltext_timeout,
+            hedge_percentile = hedge_percentile,
+            ids_only = ids_only
+        )
+        qa_service = QA_Service.make_fake_service(qa_ms, qa_ms_per_pair, jitter_ms=jitter_ms)
+        qa_service.context_trimmer = context_trimmer
+        hrefs = [f'https://en.wikipedia.org/wiki/Passage_{i}' for i in range(num_passages)]
+        titles = [f'Passage {i}' for i in range(num_passages)]
+        return QA_Manager(ann_service, qa_service, hrefs=hrefs, titles=titles, **kwargs)
+    
+    async def warmup(self, batch_size: int=8) -> None:
+        '''
+        runs every model once on a synthetic batch, see NearestNeighborService.warmup
+        '''
+        await asyncio.gather(
+            self.nearest_neighbor_service.warmup(batch_size),
+            self.qa_service.warmup(WARMUP_QUESTION, WARMUP_PASSAGE, batch_size)
+        )
+    
     async def answer(self, question: str, search_type: SearchType):
         '''
         returns k possible answers to question
         '''
-        contexts = await self.nearest_neighbor_service.query(question, self.k, search_type)
-        answers = await self.qa_service.get_answers(question, contexts)
-        ans = [{'score' : float(context['score']),
-                'ans' : answers[i]['answer'],
+        with request_trace(search_type=search_type.name):
+            if self.response_cache is None:
+                return await self._answer(question, search_type)
+            key = self.response_cache.key(question, search_type, self.k)
+            # responses missing a search backend (degraded) are returned but not cached
+            return await self.response_cache.get_or_compute(
+                        key, 
+                        lambda: self._answer(question, search_type),
+                        cacheable = lambda: not is_degraded()
+                    )
+    
+    async def answer_batch(self, questions: list[str], search_type: SearchType) -> list[list[dict]]:
+        '''
+        returns k possible answers for each question in questions, in input order
+        identical (normalized) questions are answered once, and uncached questions are 
+        answered batch_size at a time with batched embedding, search, reranking and QA
+        compute_policy limits contexts per question, but does not stop early on confident answers
+        '''
+        with request_trace(search_type=search_type.name):
+            return await self._answer_cached_batch(questions, search_type)
+
+    async def _answer_cached_batch(self, questions: list[str], search_type: SearchType) -> list[list[dict]]:
+        results = [None]*len(questions)
+        groups = {}
+        for i, question in enumerate(questions):
+            groups.setdefault(ResponseCache.key(question, search_type, self.k), []).append(i)
+        missing = []
+        for key, idxs in groups.items():
+            cached = await self.response_cache.fetch(key) if self.response_cache else None
+            if cached is None:
+                missing.append((key, idxs))
+            else:
+                for i in idxs:
+                    results[i] = cached
+
+        async def run(chunk):
+            async with self._batch_semaphore:
+                answers = await self._answer_batch([questions[idxs[0]] for _, idxs in chunk], search_type)
+            for (key, idxs), ans in zip(chunk, answers):
+                for i in idxs:
+                    results[i] = ans
+                if self.response_cache and not is_degraded():
+                    await self.response_cache.save(key, ans)
+        
+        chunks = [missing[i:i+self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        await asyncio.gather(*[run(chunk) for chunk in chunks])
+        return results
+    
+    async def _answer_batch(self, questions: list[str], search_type: SearchType) -> list[list[dict]]:
+        results = [None]*len(questions)
+        todo = list(range(len(questions)))
+        embeddings = None
+        if self.semantic_cache is not None and search_type.uses_vectors:
+            embeddings = await self.nearest_neighbor_service.embed_batch(questions)
+            todo = []
+            for i, embedding in enumerate(embeddings):
+                results[i] = self.semantic_cache.lookup(embedding, search_type, self.k)
+                if results[i] is None:
+                    todo.append(i)
+        if not todo:
+            return results
+        
+        todo_questions = [questions[i] for i in todo]
+        contexts_lists = await self.nearest_neighbor_service.query_batch(
+                            todo_questions, 
+                            self.k, 
+                            search_type,
+                            embeddings=[embeddings[i] for i in todo] if embeddings is not None else None
+                        )
+        if self.compute_policy:
+            selected = [contexts[:self.compute_policy.select(contexts)] for contexts in contexts_lists]
+            for contexts, answered in zip(contexts_lists, selected):
+                self.compute_policy.record(len(contexts), len(answered), len(answered) < len(contexts))
+            contexts_lists = selected
+        answers_lists = await self.qa_service.get_answers_batch(todo_questions, contexts_lists)
+        cacheable = embeddings is not None and not is_degraded()
+        with stage('postprocess'):
+            for i, contexts, answers in zip(todo, contexts_lists, answers_lists):
+                results[i] = [self._format_answer(context, answer) for context, answer in zip(contexts, answers)]
+                if cacheable:
+                    self.semantic_cache.insert(embeddings[i], search_type, self.k, results[i])
+        return results
+    
+    async def answer_stream(self, question: str, search_type: SearchType):
+        '''
+        async generator for incremental responses, yields (event, data) pairs:
+            ('contexts', passages) once retrieval and reranking finish
+            ('answer', answer) for each context as soon as question answering on it finishes
+        completed responses are added to the caches, but concurrent identical streams are not coalesced
+        '''
+        with request_trace(search_type=search_type.name):
+            async for event in self._answer_stream(question, search_type):
+                yield event
+
+    async def _answer_stream(self, question: str, search_type: SearchType):
+        cached, key = None, None
+        if self.response_cache:
+            key = self.response_cache.key(question, search_type, self.k)
+            cached = await self.response_cache.fetch(key)
+        if cached is not None:
+            async for event in self._replay(cached):
+                yield event
+            return
+        
+        async with self._admit() as level:
+            embedding, cached, contexts = await self._retrieve(question, search_type, level)
+            if cached is not None:
+                async for event in self._replay(cached):
+                    yield event
+                return
+            yield 'contexts', [self._passage(context) for context in contexts]
+            ans = []
+            async for batch, answers in self._answer_batches(question, contexts, batch_size=1):
+                for context, answer in zip(batch, answers):
+                    ans.append(self._format_answer(context, answer))
+                    yield 'answer', ans[-1]
+        if is_degraded():
+            return
+        if embedding is not None:
+            self.semantic_cache.insert(embedding, search_type, self.k, ans)
+        if key is not None:
+            await self.response_cache.save(key, ans)
+    
+    async def _replay(self, cached: list[dict]):
+        yield 'contexts', [self._passage(answer) for answer in cached]
+        for answer in cached:
+            yield 'answer', answer
+    
+    @asynccontextmanager
+    async def _admit(self):
+        '''
+        waits for admission and yields the degradation level, FULL without admission control
+        raises admission.Overloaded if the request is shed
+        '''
+        if self.admission is None:
+            yield FULL
+            return
+        async with self.admission.admit() as level:
+            if level > FULL:
+                note_degraded(f'admission:level{level}')
+            yield level
+    
+    async def _answer(self, question: str, search_type: SearchType):
+        async with self._admit() as level:
+            if self.pipelined:
+                embedding, cached, ans = await self._answer_pipelined(question, search_type, level)
+            else:
+                embedding, cached, ans = await self._answer_sequential(question, search_type, level)
+            if cached is not None:
+                return cached
+        if embedding is not None and not is_degraded():
+            self.semantic_cache.insert(embedding, search_type, self.k, ans)
+        return ans
+    
+    async def _answer_sequential(self, question: str, search_type: SearchType, level: int):
+        '''
+        returns (embedding, cached, answers), see _retrieve, answers are None if cached
+        '''
+        embedding, cached, contexts = await self._retrieve(question, search_type, level)
+        if cached is not None:
+            return None, cached, None
+        ans = []
+        async for batch, answers in self._answer_batches(question, contexts):
+            with stage('postprocess'):
+                ans.extend(self._format_answer(context, answer) for context, answer in zip(batch, answers))
+        return embedding, None, ans
+    
+    async def _answer_pipelined(self, question: str, search_type: SearchType, level: int):
+        '''
+        _answer_sequential with overlapped stages (see NearestNeighborService.query_pipelined):
+            - full-text search runs while the query is embedded and looked up in the semantic cache
+            - question answering starts, in a worker thread, on the top contexts reranked so far
+              while the slower search and its reranking run, answers of contexts that end up
+              in the final top k are kept, and the remaining top k contexts are answered last
+        compute_policy limits contexts (also those answered early), but does not stop early on 
+        confident answers
+        '''
+        service = self.nearest_neighbor_service
+        embedding = None
+        if self.semantic_cache is not None and search_type.uses_vectors:
+            embedding = asyncio.create_task(service.embed(question, in_thread=True))
+        k, query_type, rerank = self._query_args(search_type, level)
+        retrieval = service.query_pipelined(question, k, query_type, rerank, embedding)
+        # starts the searches before waiting for the semantic cache lookup
+        step = asyncio.create_task(anext(retrieval))
+        started = {}
+        try:
+            if embedding is not None:
+                embedding = await embedding
+                cached = self.semantic_cache.lookup(embedding, search_type, self.k)
+                if cached is not None:
+                    return None, cached, None
+            contexts, final = await step
+            while not final:
+                self._answer_early(question, self._select(contexts), started)
+                contexts, final = await anext(retrieval)
+            selected = self._select(contexts)
+            self._answer_early(question, selected, started)
+            if self.compute_policy:
+                self.compute_policy.record(len(contexts), len(selected), len(selected) < len(contexts))
+            ans = []
+            for context in selected:
+                task, i = started[str(context['id'])]
+                answer = (await task)[i]
+                with stage('postprocess'):
+                    ans.append(self._format_answer(context, answer))
+            return embedding, None, ans
+        finally:
+            # the searches are still running after a semantic cache hit or an error
+            step.cancel()
+            await asyncio.gather(step, return_exceptions=True)
+            await retrieval.aclose()
+            # answers of contexts that dropped out of the top k
+            tasks = {task for task, _ in started.values()}
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def _answer_early(self, question: str, contexts: list[dict], started: dict) -> None:
+        '''
+        starts answering the contexts not in started in one task, 
+        started maps passage id to (task, index of the context's answer)
+        '''
+        new = [context for context in contexts if str(context['id']) not in started]
+        if not new:
+            return
+        task = asyncio.create_task(self.qa_service.get_answers(question, new, in_thread=True))
+        for i, context in enumerate(new):
+            started[str(context['id'])] = (task, i)
+    
+    def _select(self, contexts: list[dict]) -> list[dict]:
+        '''
+        contexts (in rank order) answered under compute_policy
+        '''
+        if self.compute_policy is None:
+            return contexts
+        return contexts[:self.compute_policy.select(contexts)]
+    
+    async def _retrieve(self, question: str, search_type: SearchType, level: int=FULL):
+        '''
+        returns (embedding, cached, contexts):
+            embedding = query embedding if the semantic cache applies, o.w. None
+            cached = response from semantic cache, o.w. None
+            contexts = top k reranked contexts if not cached
+        level = admission degradation level, cached responses are full quality and used at 
+        any level, computed ones use fewer contexts, no reranking or vector search only
+        '''
+        embedding = None
+        # the semantic cache only applies to search types that compute the query embedding anyway
+        if self.semantic_cache is not None and search_type.uses_vectors:
+            embedding = await self.nearest_neighbor_service.embed(question)
+            cached = self.semantic_cache.lookup(embedding, search_type, self.k)
+            if cached is not None:
+                return None, cached, None
+        k, search_type, rerank = self._query_args(search_type, level)
+        contexts = await self.nearest_neighbor_service.query(
+                        question, 
+                        k, 
+                        search_type, 
+                        rerank = rerank,
+                        embedding=embedding
+                    )
+        return embedding, None, contexts
+    
+    def _query_args(self, search_type: SearchType, level: int) -> tuple:
+        '''
+        (k, search type, rerank) of the query at admission degradation level,
+        from VECTOR_ONLY on hybrid searches (VECTOR_AND_FULLTEXT and HYBRID) only search vectors
+        '''
+        k = self.k
+        if level >= SMALLER_K:
+            k = self.admission.degraded_k or max(1, self.k//2)
+        if level >= VECTOR_ONLY and search_type in (SearchType.VECTOR_AND_FULLTEXT, SearchType.HYBRID):
+            search_type = SearchType.VECTOR_ONLY
+        return k, search_type, level < SKIP_RERANK
+    
+    async def _answer_batches(self, question: str, contexts: list[dict], batch_size: int=None):
+        '''
+        async generator running question answering on the contexts selected by compute_policy,
+        yields (contexts, answers) for each batch of batch_size contexts in rank order
+        by default answers all contexts in one batch, unless the policy stops on confident answers
+        '''
+        policy = self.compute_policy
+        retrieved = len(contexts)
+        if policy:
+            contexts = contexts[:policy.select(contexts)]
+        if batch_size is None:
+            batch_size = len(contexts)
+            if policy and policy.qa_confidence is not None:
+                batch_size = policy.qa_batch_size
+        answered = 0
+        for i in range(0, len(contexts), max(batch_size, 1)):
+            batch = contexts[i:i+batch_size]
+            answers = await self.qa_service.get_answers(question, batch)
+            answered += len(batch)
+            yield batch, answers
+            # stop at the first confident answer
+            if policy and policy.is_confident(answers):
+                break
+        if policy:
+            policy.record(retrieved, answered, answered < retrieved)
+    
+    def _format_answer(self, context: dict, answer: dict) -> dict:
+        return {'score' : float(context['score']),
+                'ans' : answer['answer'],
                 'HNSW_score' : float(context['score']),
-                'QA_score' : answers[i]['score'],
+                'QA_score' : answer['score'],
                 'href': self.hrefs[int(context['id'])], 
                 'id': context['id'],
                 'title': self.titles[int(context['id'])],
-                'text': context['text']} for i, context in enumerate(contexts)]
-        return ans
+                'text': context['text']}
+    
+    def _passage(self, context: dict) -> dict:
+        '''
+        retrieved passage info sent before answers, context is a search result or formatted answer
+        '''
+        return {'id': context['id'],
+                'score': float(context['score']),
+                'href': context.get('href', self.hrefs[int(context['id'])]),
+                'title': context.get('title', self.titles[int(context['id'])]),
+                'text': context['text']}
+    
+    def stats(self) -> dict:
+        '''
+        backend hedging, cache, compute policy and admission counters for monitoring
+        '''
+        stats = {}
+        for name, hedger in self.nearest_neighbor_service.hedgers.items():
+            stats[name] = hedger.stats()
+        reranker = self.nearest_neighbor_service.reranking_model
+        if reranker is not None and reranker.score_cache:
+            stats['rerank_cache'] = reranker.score_cache.stats()
+        if self.nearest_neighbor_service.passage_store is not None:
+            stats['passage_store'] = self.nearest_neighbor_service.passage_store.stats()
+        if self.qa_service.answer_cache:
+            stats['qa_cache'] = self.qa_service.answer_cache.stats()
+        if self.response_cache:
+            stats['response_cache'] = self.response_cache.stats()
+        if self.semantic_cache:
+            stats['semantic_cache'] = self.semantic_cache.stats()
+        if self.compute_policy:
+            stats['compute_policy'] = self.compute_policy.stats()
+        if self.qa_service.context_trimmer:
+            stats['context_trimming'] = self.qa_service.context_trimmer.stats()
+        if self.admission:
+            stats['admission'] = self.admission.stats()
+        return stats
@@ -0,0 +1,47 @@
+from batching import bucketed_batches
+from metrics import record_batch
+import asyncio, random
+
+class Fake_QA_Client:
+    def __init__(self,
+                 latency_ms: float=0.0,
+                 per_pair_ms: float=0.0,
+                 per_token_ms: float=0.0,
+                 jitter_ms: float=0.0,
+                 seed: int=0,
+                 max_padding: float=0.25
+                ):
+        '''
+        stand-in for Triton_Inference_QA_Client with injected latency per request of
+            latency_ms + per_pair_ms x pairs + per_token_ms x padded tokens, +/- uniform jitter_ms
+        tokens are approximated by words, the answer is the first context word not in the question
+        pairs are batched like Triton_Inference_QA_Client, see max_padding there
+        '''
+        self.latency_ms = latency_ms
+        self.per_pair_ms = per_pair_ms
+        self.per_token_ms = per_token_ms
+        self.jitter_ms = jitter_ms
+        self.max_padding = max_padding
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.pairs = 0
+
+    async def answer(self, questions: list[str], contexts: list[str], max_batch_tokens: int=None, context_ids: list=None) -> list[dict]:
+        lengths = [len(q.split())+len(c.split()) for q, c in zip(questions, contexts)]
+        padded_tokens = 0
+        for batch in bucketed_batches(lengths, max_batch_tokens or sum(lengths), self.max_padding):
+            record_batch('qa', [lengths[i] for i in batch])
+            # padding='longest' pads every pair in a batch to the longest one
+            padded_tokens += max(lengths[i] for i in batch)*len(batch)
+        ms = self.latency_ms+self.per_pair_ms*len(lengths)+self.per_token_ms*padded_tokens
+        ms += self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if ms > 0:
+            await asyncio.sleep(ms/1000)
+        self.requests += 1
+        self.pairs += len(lengths)
+        results = []
+        for question, context in zip(questions, contexts):
+            asked = set(question.lower().split())
+            words = [w for w in context.split() if w.lower() not in asked] or ['']
+            results.append({'answer': words[0], 'score': 0.5})
+        return results
@@ -1,5 +1,68 @@
 from transformers import AutoTokenizer, pipeline
 from optimum.intel import OVModelForQuestionAnswering
+from batching import bucketed_batches
+from metrics import record_batch
+from token_store import PairEncoder, TokenStore
+import numpy as np
+
+# question answering pipelines split contexts into windows of at most this many tokens,
+# consecutive windows share PIPELINE_DOC_STRIDE passage tokens
+PIPELINE_MAX_SEQ_LEN = 384
+PIPELINE_DOC_STRIDE = 128
+
+def pipeline_batch_size(max_batch_tokens: int=None) -> int:
+    '''
+    pipeline batches are padded up to PIPELINE_MAX_SEQ_LEN tokens in the worst case
+    '''
+    if max_batch_tokens is None:
+        return 1
+    return max(1, max_batch_tokens//PIPELINE_MAX_SEQ_LEN)
+
+def best_spans(start_logits: np.ndarray, end_logits: np.ndarray, mask: np.ndarray, max_answer_len: int=15) -> list[tuple]:
+    '''
+    (start, end, score) per row maximizing p_start x p_end with start <= end < start+max_answer_len
+    and start, end in mask, (-1, -1, 0.0) for rows without tokens in mask
+    probabilities are softmax over the tokens in mask and [CLS] (position 0), which is never
+    the answer, as in the question answering pipeline
+    '''
+    n = start_logits.shape[1]
+    band = np.triu(np.tril(np.ones((n, n), dtype=bool), max_answer_len-1))
+    spans = []
+    for start, end, row in zip(start_logits, end_logits, mask):
+        if not row.any():
+            spans.append((-1, -1, 0.0))
+            continue
+        row = row.copy()
+        row[0] = True
+        p_start, p_end = _softmax(np.where(row, start, -np.inf)), _softmax(np.where(row, end, -np.inf))
+        p_start[0] = p_end[0] = 0.0
+        scores = np.where(band, np.outer(p_start, p_end), 0.0)
+        i, j = np.unravel_index(int(scores.argmax()), scores.shape)
+        spans.append((int(i), int(j), float(scores[i, j])))
+    return spans
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits-logits.max())
+    return exp/exp.sum()
+
+def word_continuations(tokenizer) -> np.ndarray:
+    '''
+    True for token ids continuing the previous token's word (WordPiece ##), answers are
+    extended to whole words as in the pipeline (align_to_words)
+    '''
+    tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    return np.array([token.startswith('##') for token in tokens], dtype=bool)
+
+def align_to_words(continuations: np.ndarray, ids: np.ndarray, start: int, end: int) -> tuple[int, int]:
+    '''
+    extends passage token span [start, end] to the first token of its first word and the last
+    token of its last word
+    '''
+    while start > 0 and continuations[ids[start]]:
+        start -= 1
+    while end+1 < len(ids) and continuations[ids[end+1]]:
+        end += 1
+    return start, end
 
 class Default_Hugging_Face_QA:
     def __init__(self, model_name):
@@ -8,19 +71,86 @@ class Default_Hugging_Face_QA:
         '''
         self.model = pipeline('question-answering', model = model_name)
     
-    def answer(self, questions, contexts):
-        return self.model(question=questions, context=contexts)
+    def answer(self, questions, contexts, max_batch_tokens=None, context_ids=None):
+        return self.model(
+                    question=questions, 
+                    context=contexts, 
+                    batch_size=pipeline_batch_size(max_batch_tokens)
+                )
 
 class OpenVINO_QA:
-    def __init__(self, model_name, model_path):
+    def __init__(self, model_name, model_path, cache_dir=None, token_store: TokenStore=None, max_padding=0.25, compile=True):
         '''
         wrapper for Hugging Face question answering pipeline using INT8 quantized version of: model_name
             model_name: name of original Hugging Face model, required for tokenizer
             model_path: path to OpenVino model
+            cache_dir: optional OpenVINO compiled model cache, skips compilation on later startups
+            token_store: optional passage tokens from ingestion, then the model runs on pairs 
+                built from stored tokens instead of the pipeline, only questions are tokenized
+            max_padding: with token_store, pairs are sorted by length and batched with at most this
+                fraction of padding tokens, see batching.bucketed_batches
+            compile: False only reads the model, compile_model compiles it later (e.g., after fork)
         '''
         tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = OVModelForQuestionAnswering.from_pretrained(model_path)
-        self.model = pipeline("question-answering", model=model, tokenizer=tokenizer)
+        ov_config = {'CACHE_DIR': cache_dir} if cache_dir else {}
+        self.ov_model = OVModelForQuestionAnswering.from_pretrained(model_path, ov_config=ov_config, compile=compile)
+        self.model = pipeline("question-answering", model=self.ov_model, tokenizer=tokenizer)
+        self.encoder = PairEncoder(tokenizer, token_store) if token_store is not None else None
+        self.continuations = word_continuations(tokenizer) if token_store is not None else None
+        self.max_padding = max_padding
     
-    def answer(self, questions, contexts):
-        return self.model(question=questions, context=contexts)
+    def compile_model(self, num_threads: int=None) -> None:
+        '''
+        compiles the model if loaded with compile=False, num_threads = inference threads (default all cores)
+        '''
+        if num_threads:
+            self.ov_model.ov_config['INFERENCE_NUM_THREADS'] = num_threads
+        self.ov_model.compile()
+    
+    def answer(self, questions, contexts, max_batch_tokens=None, context_ids=None):
+        if self.encoder is not None and context_ids is not None:
+            return self._answer_encoded(questions, contexts, context_ids, max_batch_tokens)
+        return self.model(
+                    question=questions, 
+                    context=contexts, 
+                    batch_size=pipeline_batch_size(max_batch_tokens)
+                )
+    
+    def _answer_encoded(self, questions, contexts, context_ids, max_batch_tokens=None):
+        '''
+        same answers and scores as the pipeline: passages are split into windows of
+        PIPELINE_MAX_SEQ_LEN tokens with PIPELINE_DOC_STRIDE overlap, each window's answer is
+        scored with its own softmax, and the best scoring window's answer is extended to whole words
+        '''
+        windows, passages = self.encoder.encode_windows(questions, contexts, context_ids, PIPELINE_MAX_SEQ_LEN, PIPELINE_DOC_STRIDE)
+        lengths = [len(input_ids) for _, input_ids, _, _ in windows]
+        batches = bucketed_batches(lengths, max_batch_tokens or sum(lengths), self.max_padding)
+        pairs = [(input_ids, first, None) for _, input_ids, first, _ in windows]
+        best = [(-1, -1, 0.0)]*len(contexts) # passage token span and score per context
+        for batch in batches:
+            record_batch('qa', [lengths[i] for i in batch])
+            inputs = self.encoder.pad(pairs, batch)
+            outputs = self.ov_model(**inputs)
+            # answers are passage tokens, between the first [SEP] and the last one
+            first = np.array([pairs[i][1] for i in batch])[:, None]
+            positions = np.arange(inputs['input_ids'].shape[1])
+            mask = (positions >= first) & (positions < inputs['attention_mask'].sum(axis=1, keepdims=True)-1)
+            spans = best_spans(np.asarray(outputs.start_logits), np.asarray(outputs.end_logits), mask)
+            for w, (start, end, score) in zip(batch, spans):
+                i, _, offset, window_start = windows[w]
+                if start >= 0 and (best[i][0] < 0 or score > best[i][2]):
+                    best[i] = (start-offset+window_start, end-offset+window_start, score)
+        results = []
+        for context, (ids, char_spans), (start, end, score) in zip(contexts, passages, best):
+            if start < 0:
+                results.append({'score': 0.0, 'start': 0, 'end': 0, 'answer': ''})
+                continue
+            start, end = align_to_words(self.continuations, ids, start, end)
+            char_start, char_end = int(char_spans[start][0]), int(char_spans[end][1])
+            results.append({
+                'score': score, 
+                'start': char_start, 
+                'end': char_end, 
+                'answer': context[char_start:char_end]
+            })
+        return results
@@ -1,66 +1,198 @@
 from huggingface_qa import Default_Hugging_Face_QA, OpenVINO_QA
 from triton_inference_qa import Triton_Inference_QA_Client
+from fake_qa import Fake_QA_Client
 from transformers import AutoTokenizer
-import logging, time
+from score_cache import ScoreCache
+from token_store import load_token_store, QA_TOKENS
+from context_trimming import ContextTrimmer
+from instrumentation import stage, backend_name
+import asyncio, threading
 
 class QA_Service:
-    def __init__(self, qa_model, is_async=False):
+    def __init__(self, 
+                 qa_model, 
+                 is_async=False, 
+                 answer_cache: ScoreCache=None, 
+                 max_batch_tokens: int=16384, 
+                 context_trimmer: ContextTrimmer=None
+                ):
         self.qa_model = qa_model
         self.is_async = is_async # only used for triton inference
-        # set logging
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
-        console_handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-        console_handler.setFormatter(formatter) 
-        self.logger.addHandler(console_handler)
+        # optional cache of answer spans for (question, passage id) pairs
+        self.answer_cache = answer_cache
+        # max tokens (including padding) per inference batch for get_answers_batch
+        self.max_batch_tokens = max_batch_tokens
+        # optional trimming of long passages to the sentences relevant to the question,
+        # answer start and end offsets still refer to the full passage
+        self.context_trimmer = context_trimmer
+        # synchronous models run on the event loop or in worker threads (get_answers in_thread),
+        # one call at a time as compiled OpenVINO models are not thread safe
+        self._lock = threading.Lock()
 
     @classmethod
-    def make_default_service(cls) -> 'QA_Service':
+    def make_default_service(cls, answer_cache: ScoreCache=None) -> 'QA_Service':
         '''
         returns Hugging Face model: distilbert-base-cased-distilled-squad
         '''
         # change model name to whatever you want to use
         qa_model_name = "distilbert/distilbert-base-cased-distilled-squad"
         qa_model = Default_Hugging_Face_QA(qa_model_name)
-        return QA_Service(qa_model)
+        return QA_Service(qa_model, answer_cache=answer_cache)
     
-    @classmethod
-    def make_quantized_service(cls) -> 'QA_Service':
+    @staticmethod
+    def load_quantized_model(cache_dir: str=None, token_store_path: str=QA_TOKENS, compile: bool=True) -> OpenVINO_QA:
         '''
-        returns INT8 quantized model running in OpenVino
+        INT8 quantized model, cache_dir = optional OpenVINO compiled model cache
+        token_store_path = passage tokens from ingestion.py, used if the file exists
+        compile = False defers compilation to OpenVINO_QA.compile_model
         '''
         # assumes model is quantized from something available on Hugging Face 
         # name of original Hugging Face model, required to use correct tokenizer
         qa_model_name = 'distilbert/distilbert-base-cased-distilled-squad'
         int8_model_path = './models/distilbert-base-cased-distilled-squad_INT8_PTQ'
-        qa_model = OpenVINO_QA(qa_model_name, int8_model_path)
-        return QA_Service(qa_model)
+        return OpenVINO_QA(qa_model_name, int8_model_path, cache_dir, load_token_store(token_store_path), compile=compile)
+    
+    @staticmethod
+    def load_triton_tokenizer():
+        # regardless of backed: PyTorch, OpenVino, TensorRT; we need tokenizer from Hugging Face
+        # name of Hugging Face model to use for tokenizer
+        qa_model_name = 'distilbert/distilbert-base-cased-distilled-squad'
+        return AutoTokenizer.from_pretrained(qa_model_name)
     
     @classmethod
-    def make_triton_service(cls, host: str, port: int) -> 'QA_Service':
+    def make_quantized_service(cls, answer_cache: ScoreCache=None, qa_model: OpenVINO_QA=None) -> 'QA_Service':
+        '''
+        returns INT8 quantized model running in OpenVino, qa_model = preloaded model
+        '''
+        if qa_model is None:
+            qa_model = cls.load_quantized_model()
+        return QA_Service(qa_model, answer_cache=answer_cache)
+    
+    @classmethod
+    def make_triton_service(cls, 
+                            host: str, 
+                            port: int, 
+                            answer_cache: ScoreCache=None, 
+                            tokenizer=None, 
+                            token_store_path: str=QA_TOKENS,
+                            model_name: str='distilbert-base-cased-distilled-squad'
+                           ) -> 'QA_Service':
         '''
         returns client from Nvidia Triton Inference Server running on {host}:{port}
+        model_name = name of the model in the Triton model repository
+        tokenizer = preloaded tokenizer
+        token_store_path = passage tokens from ingestion.py, used if the file exists
         '''
-        # regardless of backed: PyTorch, OpenVino, TensorRT; we need tokenizer from Hugging Face
-        # name of Hugging Face model to use for tokenizer
-        qa_model_name = 'distilbert/distilbert-base-cased-distilled-squad'
-        tokenizer = AutoTokenizer.from_pretrained(qa_model_name)
-        qa_model = Triton_Inference_QA_Client(host, port, tokenizer)
-        return QA_Service(qa_model, is_async=True)
+        if tokenizer is None:
+            tokenizer = cls.load_triton_tokenizer()
+        qa_model = Triton_Inference_QA_Client(host, port, model_name, tokenizer, token_store=load_token_store(token_store_path))
+        return QA_Service(qa_model, is_async=True, answer_cache=answer_cache)
     
-    async def get_answers(self, question, contexts):
+    @classmethod
+    def make_fake_service(cls, 
+                          latency_ms: float=0.0, 
+                          per_pair_ms: float=0.0, 
+                          per_token_ms: float=0.0,
+                          jitter_ms: float=0.0,
+                          answer_cache: ScoreCache=None
+                         ) -> 'QA_Service':
         '''
-        returns one answer to question for each context in contexts
+        returns service using an in-process stand-in for the Triton client with injected latency,
+        for benchmarking without network or models
         '''
-        k = len(contexts)
-        questions = [question]*k
-        qa_contexts = [context['text'] for context in contexts]
-        s = time.time()
+        qa_model = Fake_QA_Client(latency_ms, per_pair_ms, per_token_ms, jitter_ms)
+        return QA_Service(qa_model, is_async=True, answer_cache=answer_cache)
+    
+    async def warmup(self, question: str, context: str, batch_size: int=8) -> None:
+        '''
+        answers a synthetic batch, bypassing the answer cache and stage metrics,
+        synchronous models run in a thread so the event loop keeps serving liveness checks
+        '''
+        questions, contexts = [question]*batch_size, [context]*batch_size
         if self.is_async:
-            results = await self.qa_model.answer(questions = questions, contexts = qa_contexts)
+            await self.qa_model.answer(questions=questions, contexts=contexts, max_batch_tokens=self.max_batch_tokens)
         else:
-            results = self.qa_model.answer(questions = questions, contexts = qa_contexts)
-        t = 1000*(time.time()-s)
-        self.logger.info(f'qa compute time: {t}')
+            await asyncio.to_thread(self._answer_sync, questions, contexts, self.max_batch_tokens)
+    
+    async def get_answers(self, question, contexts, in_thread: bool=False):
+        '''
+        returns one answer to question for each context in contexts
+        in_thread = synchronous models run in a worker thread, so the event loop can run
+            other stages of the request meanwhile
+        '''
+        if not contexts:
+            return []
+        return await self._answer([(question, context) for context in contexts], in_thread=in_thread)
+    
+    async def get_answers_batch(self, questions: list[str], contexts_lists: list[list[dict]]) -> list[list[dict]]:
+        '''
+        get_answers for several questions, all pairs run together in token budgeted batches,
+        synchronous models run in a worker thread so large batches don't block other requests
+        '''
+        pairs = [(question, context) for question, contexts in zip(questions, contexts_lists) for context in contexts]
+        answers = await self._answer(pairs, self.max_batch_tokens, in_thread=True) if pairs else []
+        results, i = [], 0
+        for contexts in contexts_lists:
+            results.append(answers[i:i+len(contexts)])
+            i += len(contexts)
+        return results
+    
+    async def _answer(self, pairs: list[tuple], max_batch_tokens: int=None, in_thread: bool=False) -> list[dict]:
+        '''
+        answers (question, context) pairs, skipping pairs in answer_cache
+        '''
+        compute = lambda pairs: self._answer_pairs(pairs, max_batch_tokens, in_thread)
+        if self.answer_cache is None:
+            return await compute(pairs)
+        return await self.answer_cache.amemoize(pairs, compute)
+    
+    def _answer_sync(self, questions: list[str], contexts: list[str], max_batch_tokens: int=None, context_ids: list=None):
+        with self._lock:
+            return self.qa_model.answer(
+                        questions = questions, 
+                        contexts = contexts, 
+                        max_batch_tokens = max_batch_tokens,
+                        context_ids = context_ids
+                    )
+    
+    async def _answer_pairs(self, pairs: list[tuple], max_batch_tokens: int=None, in_thread: bool=False) -> list[dict]:
+        questions = [question for question, _ in pairs]
+        qa_contexts = [context['text'] for _, context in pairs]
+        context_ids = [context.get('id') for _, context in pairs]
+        offsets = [0]*len(pairs)
+        if self.context_trimmer is not None:
+            with stage('trim'):
+                for i, (question, text) in enumerate(zip(questions, qa_contexts)):
+                    qa_contexts[i], offsets[i] = self.context_trimmer.trim(question, text)
+                    if qa_contexts[i] != text:
+                        # stored passage tokens are for the full passage
+                        context_ids[i] = None
+        with stage('qa', backend_name(self.qa_model)):
+            if self.is_async:
+                results = await self.qa_model.answer(
+                                questions = questions, 
+                                contexts = qa_contexts, 
+                                max_batch_tokens = max_batch_tokens,
+                                context_ids = context_ids
+                            )
+            elif in_thread or not self._lock.acquire(blocking=False):
+                # the model may be busy in a worker thread (e.g., a batch), don't wait on the event loop
+                results = await asyncio.to_thread(self._answer_sync, questions, qa_contexts, max_batch_tokens, context_ids)
+            else:
+                try:
+                    results = self.qa_model.answer(
+                                questions = questions, 
+                                contexts = qa_contexts, 
+                                max_batch_tokens = max_batch_tokens,
+                                context_ids = context_ids
+                            )
+                finally:
+                    self._lock.release()
+        # Hugging Face pipelines return a dict instead of a list for a single input
+        if isinstance(results, dict):
+            results = [results]
+        for answer, offset in zip(results, offsets):
+            if offset and 'start' in answer:
+                answer['start'] += offset
+                answer['end'] += offset
         return results
\ No newline at end of file
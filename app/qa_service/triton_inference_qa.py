@@ -1,20 +1,61 @@
 import tritonclient.http.aio as httpclient
+from batching import bucketed_batches
+from metrics import record_batch
+from token_store import PairEncoder, TokenStore
 import numpy as np
+import asyncio
 
 class Triton_Inference_QA_Client:
-    def __init__(self, host: str, port: str, model_name: str, tokenizer):
+    def __init__(self, 
+                 host: str, 
+                 port: str, 
+                 model_name: str, 
+                 tokenizer, 
+                 token_store: TokenStore=None, 
+                 max_padding: float=0.25
+                ):
         '''
         client for triton inference server at host:port
+        token_store = optional passage tokens from ingestion, only questions are tokenized
+        max_padding = pairs are sorted by length and batched with at most this fraction of padding
+            tokens, None only applies max_batch_tokens (see batching.bucketed_batches)
         '''
         self.client = httpclient.InferenceServerClient(url=f'{host}:{port}')
         self.tokenizer = tokenizer
         self.model = model_name
+        self.encoder = PairEncoder(tokenizer, token_store) if token_store is not None else None
+        self.max_padding = max_padding
     
-    async def answer(self, questions: list[str], contexts: list[str]) -> list[dict]:
+    async def answer(self, questions: list[str], contexts: list[str], max_batch_tokens: int=None, context_ids: list=None) -> list[dict]:
         '''
         returns an answer to each question, context pair using extractive question answering
+        pairs are split into length sorted batches of at most max_batch_tokens tokens 
+        (including padding) which are sent concurrently
+        context_ids = passage ids for the token store
         '''
-        tokens = self.tokenizer(questions, contexts, padding='longest', return_tensors='np')
+        if self.encoder is not None and context_ids is not None:
+            encoded = self.encoder.encode(questions, contexts, context_ids)
+            lengths = [len(input_ids) for input_ids, _, _ in encoded]
+            pad = lambda batch: self.encoder.pad(encoded, batch)
+        else:
+            tokens = self.tokenizer(questions, contexts, truncation=True)
+            lengths = [len(ids) for ids in tokens['input_ids']]
+            pad = lambda batch: self.tokenizer.pad(
+                        {name: [values[i] for i in batch] for name, values in tokens.items()},
+                        padding='longest',
+                        return_tensors='np'
+                    )
+        batches = bucketed_batches(lengths, max_batch_tokens or sum(lengths), self.max_padding)
+        for batch in batches:
+            record_batch('qa', [lengths[i] for i in batch])
+        results = await asyncio.gather(*[self._answer(pad(batch)) for batch in batches])
+        answers = [None]*len(lengths)
+        for batch, batch_results in zip(batches, results):
+            for i, answer in zip(batch, batch_results):
+                answers[i] = answer
+        return answers
+    
+    async def _answer(self, tokens) -> list[dict]:
         input_ids = tokens['input_ids']
         attention_mask = tokens['attention_mask']
 
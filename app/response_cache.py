@@ -0,0 +1,254 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from instrumentation import current_trace, note_degraded
+import asyncio, json, os, re, sqlite3, time
+
+# punctuation at the start or end of a word, symbols inside a word (C++, C#, 3.5) are kept
+_punctuation_regex = re.compile(r'''(?<!\S)[?!.,;:'"]+|[?!.,;:'"]+(?!\S)''')
+_whitespace_regex = re.compile(r'\s+')
+
+def normalize_question(question: str) -> str:
+    '''
+    lower cases question, removes punctuation around words and collapses whitespace so
+    trivially different questions share cache entries, e.g.,
+        'How many teeth do  dogs have?' -> 'how many teeth do dogs have'
+        'What is C++?' -> 'what is c++'
+    '''
+    question = _punctuation_regex.sub(' ', question.lower())
+    return _whitespace_regex.sub(' ', question).strip()
+
+def _dumps(value) -> str:
+    # model outputs may contain numpy floats
+    return json.dumps(value, default=float)
+
+class CacheStore(ABC):
+    '''
+    persistent tier for ResponseCache, survives restarts and can be shared between workers
+    '''
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        ...
+
+class SQLite_Store(CacheStore):
+    def __init__(self, path: str):
+        '''
+        on-disk store backed by sqlite file at path
+        '''
+        self.path = path
+        self._pid = None
+        self._connection().execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+        self.conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections must not be used across fork (prefork.py creates the app before 
+        # forking workers), each process opens its own
+        if self._pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._pid = os.getpid()
+        return self.conn
+
+    def _get(self, key):
+        row = self._connection().execute('SELECT value, expires FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def _set(self, key, value, ttl):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)',
+            (key, value, time.time()+ttl)
+        )
+        self.conn.commit()
+
+    async def get(self, key):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key, value, ttl):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+class Redis_Store(CacheStore):
+    def __init__(self, host: str='localhost', port: str='6379', prefix: str='qa:'):
+        '''
+        store backed by redis at host:port, entries expire using redis ttl
+        '''
+        import redis
+        self.client = redis.asyncio.Redis(host=host, port=port, decode_responses=True)
+        self.prefix = prefix
+
+    async def get(self, key):
+        return await self.client.get(self.prefix+key)
+
+    async def set(self, key, value, ttl):
+        await self.client.set(self.prefix+key, value, ex=max(1, int(ttl)))
+
+def make_store(uri: str) -> CacheStore | None:
+    '''
+    uri = redis://host:port for Redis_Store, otherwise uri is path to sqlite file
+    '''
+    if not uri:
+        return None
+    if uri.startswith('redis://'):
+        host, _, port = uri[len('redis://'):].partition(':')
+        return Redis_Store(host, port or '6379')
+    return SQLite_Store(uri)
+
+class ResponseCache:
+    def __init__(self,
+                 max_entries: int=10000,
+                 max_bytes: int=64*2**20,
+                 ttl: float=3600,
+                 store: CacheStore=None
+                ):
+        '''
+        in memory LRU cache with ttl for complete responses, bounded by both max_entries
+        and max_bytes (size of json encoded responses). Concurrent requests for the same
+        key are coalesced, so only the first computes the response.
+        If store is provided, misses are looked up in store before computing.
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict() # key -> (expires, size, value)
+        self._in_flight = {} # key -> task computing the response
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(question: str, search_type, k: int) -> str:
+        return f'{search_type.name}|{k}|{normalize_question(question)}'
+
+    def get(self, key: str):
+        '''
+        returns cached value or None, does not update counters
+        '''
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, size, value = entry
+        if expires < time.time():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value, size: int=None) -> None:
+        if size is None:
+            size = len(_dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time()+self.ttl, size, value)
+        self.bytes += size
+        # evict least recently used entries
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    async def get_or_compute(self, key: str, compute, cacheable=None):
+        '''
+        returns cached value for key, otherwise awaits compute() and caches the result
+        unless cacheable() is False, e.g., for degraded responses
+        compute() runs in a task owned by the cache, so a cancelled caller (e.g., its client
+        disconnected) stops waiting without cancelling the callers coalesced with it
+        '''
+        value = self._memory_lookup(key)
+        if value is not None:
+            return value
+        task = self._in_flight.get(key)
+        if task is not None:
+            # identical request is already running, wait for its result
+            self.coalesced += 1
+            value, degraded = await asyncio.shield(task)
+            # degraded responses aren't cached, report them in this request's trace too
+            for description in degraded:
+                note_degraded(description)
+            return value
+        task = asyncio.create_task(self._compute(key, compute, cacheable))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda task: self._finished(key, task))
+        value, _ = await asyncio.shield(task)
+        return value
+
+    async def _compute(self, key, compute, cacheable):
+        '''
+        returns (value, degradation of the computing request), the task shares its trace
+        '''
+        value = await self._store_lookup(key)
+        if value is None:
+            self.misses += 1
+            value = await compute()
+            if cacheable is None or cacheable():
+                await self.save(key, value)
+        trace = current_trace()
+        return value, list(trace.degraded) if trace is not None else []
+
+    def _finished(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # avoid warning if every caller was cancelled
+
+    async def fetch(self, key: str):
+        '''
+        returns cached value for key from memory or store, o.w. None, 
+        for callers that compute and save values themselves
+        '''
+        value = self._memory_lookup(key)
+        if value is None:
+            value = await self._store_lookup(key)
+        if value is None:
+            self.misses += 1
+        return value
+
+    async def save(self, key: str, value) -> None:
+        serialized = _dumps(value)
+        self.put(key, value, len(serialized))
+        if self.store:
+            await self.store.set(key, serialized, self.ttl)
+
+    def _memory_lookup(self, key):
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+        return value
+
+    async def _store_lookup(self, key):
+        if self.store is None:
+            return None
+        stored = await self.store.get(key)
+        if stored is None:
+            return None
+        self.store_hits += 1
+        value = json.loads(stored)
+        self.put(key, value, len(stored))
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits+self.coalesced+self.store_hits+self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'coalesced': self.coalesced,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': (lookups-self.misses)/lookups if lookups else 0.0
+        }
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from response_cache import normalize_question
+
+class ScoreCache:
+    def __init__(self, max_entries: int=100000):
+        '''
+        bounded LRU memo cache for model outputs keyed by (normalized question, passage id),
+        e.g., reranker scores or extracted answer spans
+        '''
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0 # repeated passages within a single request
+        self.evictions = 0
+
+    def _lookup(self, pairs: list[tuple]):
+        '''
+        returns cached values (None if missing) and map of missing keys to indexes in pairs
+        '''
+        normalized = {}
+        values = [None]*len(pairs)
+        missing = {}
+        for i, (question, context) in enumerate(pairs):
+            if question not in normalized:
+                normalized[question] = normalize_question(question)
+            key = (normalized[question], str(context['id']))
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                values[i] = self._entries[key]
+                self.hits += 1
+            elif key in missing:
+                missing[key].append(i)
+                self.duplicates += 1
+            else:
+                missing[key] = [i]
+                self.misses += 1
+        return values, missing
+
+    def _fill(self, values: list, missing: dict, computed: list) -> list:
+        for (key, idxs), value in zip(missing.items(), computed):
+            for i in idxs:
+                values[i] = value
+            self._entries[key] = value
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return values
+
+    def memoize(self, pairs: list[tuple], compute) -> list:
+        '''
+        returns compute(pairs) for list of (question, context) pairs, only calling compute on
+        pairs whose (question, id) is not cached, duplicate pairs are computed once
+        '''
+        values, missing = self._lookup(pairs)
+        if not missing:
+            return values
+        computed = compute([pairs[idxs[0]] for idxs in missing.values()])
+        return self._fill(values, missing, computed)
+
+    async def amemoize(self, pairs: list[tuple], compute) -> list:
+        '''
+        same as memoize for async compute
+        '''
+        values, missing = self._lookup(pairs)
+        if not missing:
+            return values
+        computed = await compute([pairs[idxs[0]] for idxs in missing.values()])
+        return self._fill(values, missing, computed)
+
+    def stats(self) -> dict:
+        lookups = self.hits+self.misses+self.duplicates
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'duplicates': self.duplicates,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits+self.duplicates)/lookups if lookups else 0.0
+        }
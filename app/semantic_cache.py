@@ -0,0 +1,82 @@
+import numpy as np
+import time
+
+class SemanticCache:
+    def __init__(self,
+                 dim: int=384,
+                 max_entries: int=4096,
+                 threshold: float=0.95,
+                 ttl: float=3600
+                ):
+        '''
+        caches responses by query embedding, a lookup hits when a previous query with the
+        same search type and k has cosine similarity >= threshold, e.g., paraphrases like
+            'how many teeth does a dog have' and 'number of teeth in dogs'
+        embeddings are stored in a fixed size matrix, for a few thousand entries a single
+        matrix-vector product is faster than maintaining an HNSW graph and the results are exact.
+        when full, the least recently used entry is evicted.
+        '''
+        self.threshold = threshold
+        self.ttl = ttl
+        self.embeddings = np.zeros((max_entries, dim), dtype=np.float32)
+        self.partitions = np.full(max_entries, -1, dtype=np.int32) # -1 = empty slot
+        self.expires = np.zeros(max_entries)
+        self.last_used = np.zeros(max_entries)
+        self.values = [None]*max_entries
+        # maps (search type, k) to partition id, entries only match queries in same partition
+        self._partition_ids = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _partition(self, search_type, k: int) -> int:
+        key = (search_type.name, k)
+        if key not in self._partition_ids:
+            self._partition_ids[key] = len(self._partition_ids)
+        return self._partition_ids[key]
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding/max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def lookup(self, embedding, search_type, k: int):
+        '''
+        returns cached value for most similar query above threshold, otherwise None
+        '''
+        now = time.time()
+        similarity = self.embeddings @ self._normalize(embedding)
+        valid = (self.partitions == self._partition(search_type, k)) & (self.expires >= now)
+        similarity[~valid] = -np.inf
+        i = int(np.argmax(similarity))
+        if similarity[i] < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.last_used[i] = now
+        return self.values[i]
+
+    def insert(self, embedding, search_type, k: int, value) -> None:
+        now = time.time()
+        free = np.flatnonzero((self.partitions == -1) | (self.expires < now))
+        if len(free):
+            i = int(free[0])
+        else:
+            i = int(np.argmin(self.last_used))
+            self.evictions += 1
+        self.embeddings[i] = self._normalize(embedding)
+        self.partitions[i] = self._partition(search_type, k)
+        self.expires[i] = now+self.ttl
+        self.last_used[i] = now
+        self.values[i] = value
+
+    def stats(self) -> dict:
+        lookups = self.hits+self.misses
+        now = time.time()
+        return {
+            'entries': int(np.sum((self.partitions != -1) & (self.expires >= now))),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits/lookups if lookups else 0.0
+        }
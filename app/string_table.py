@@ -0,0 +1,91 @@
+'''
+read-only table of strings stored in one file as an offsets array and a UTF-8 blob,
+the file is memory-mapped so all worker processes share the same pages (page cache),
+and lookup by index is O(1) without creating a Python str per entry up front
+
+file layout (little endian):
+    magic       8 bytes, b'STRTAB01'
+    n           uint64, number of strings
+    offsets     uint64 x (n+1), string i = blob[offsets[i]:offsets[i+1]]
+    blob        UTF-8 encoded strings, concatenated
+
+builds a table from a newline separated text file, e.g., the titles and hrefs from ingestion:
+    python string_table.py /data/popular_titles.txt /data/popular_titles.bin
+'''
+from collections.abc import Sequence
+from array import array
+import numpy as np
+import mmap, os, shutil, struct, sys, tempfile
+
+MAGIC = b'STRTAB01'
+_header = struct.Struct('<8sQ')
+
+class StringTable(Sequence):
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n = _header.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a string table')
+        self._offsets = np.frombuffer(self._mmap, dtype='<u8', count=n+1, offset=_header.size)
+        self._blob = _header.size+8*(n+1)
+        self._n = n
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError('string table index out of range')
+        start, end = int(self._offsets[i]), int(self._offsets[i+1])
+        return self._mmap[self._blob+start:self._blob+end].decode('utf-8')
+
+    @staticmethod
+    def build(strings, path: str) -> int:
+        '''
+        writes strings (any iterable) to a string table at path, returns the number of strings
+        the blob is streamed through a temporary file, only the offsets are kept in memory
+        '''
+        offsets = array('Q', [0])
+        with tempfile.TemporaryFile() as blob:
+            for s in strings:
+                offsets.append(offsets[-1]+blob.write(s.encode('utf-8')))
+            blob.seek(0)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            n = len(offsets)-1
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_header.pack(MAGIC, n))
+                offsets.tofile(f)
+                shutil.copyfileobj(blob, f)
+        # readers never see a partially written table
+        os.replace(tmp_path, path)
+        return n
+
+    @classmethod
+    def from_text_file(cls, text_path: str, path: str) -> int:
+        '''
+        builds a table with one string per line of text_path,
+        same entries as f.read().split('\\n') (see QA_Manager.load_page_info)
+        '''
+        with open(text_path, 'r') as f:
+            return cls.build(_split_lines(f), path)
+
+def _split_lines(f):
+    line = ''
+    for line in f:
+        yield line[:-1] if line.endswith('\n') else line
+    # split('\n') ends with an empty string for empty files or a trailing newline
+    if line == '' or line.endswith('\n'):
+        yield ''
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python string_table.py input.txt output.bin')
+    n = StringTable.from_text_file(sys.argv[1], sys.argv[2])
+    print(f'wrote {n} strings to {sys.argv[2]}')
@@ -0,0 +1,223 @@
+'''
+passage token ids and character offsets for one tokenizer, written at ingestion (see ingestion.py)
+so the reranker and QA model only tokenize the question at query time
+
+file layout (little endian), memory-mapped so all worker processes share the same pages:
+    magic       8 bytes, b'TOKSTR01'
+    n           uint64, number of passages, indexed by passage id
+    name_size   uint64, bytes in the tokenizer name
+    name        UTF-8 tokenizer name, zero padded to a multiple of 8 bytes
+    offsets     uint64 x (n+1), tokens of passage i = [offsets[i], offsets[i+1])
+    ids         int32 x offsets[n], token ids without special tokens
+    spans       int32 x 2*offsets[n], (start, end) character offsets of each token in the passage
+'''
+from array import array
+import numpy as np
+import mmap, os, shutil, struct, sys, tempfile
+
+MAGIC = b'TOKSTR01'
+_header = struct.Struct('<8sQQ')
+
+# default store locations, used by the reranker and QA model loaders when the files exist
+RERANKER_TOKENS = '/data/reranker_tokens.bin'
+QA_TOKENS = '/data/qa_tokens.bin'
+
+class TokenStore:
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, name_size = _header.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a token store')
+        self.name = self._mmap[_header.size:_header.size+name_size].decode('utf-8')
+        start = _header.size+_padded(name_size)
+        self._offsets = np.frombuffer(self._mmap, dtype='<u8', count=n+1, offset=start)
+        total = int(self._offsets[-1])
+        start += 8*(n+1)
+        self._ids = np.frombuffer(self._mmap, dtype='<i4', count=total, offset=start)
+        self._spans = np.frombuffer(self._mmap, dtype='<i4', count=2*total, offset=start+4*total).reshape(-1, 2)
+        self._n = n
+
+    def __len__(self) -> int:
+        return self._n
+
+    def get(self, passage_id) -> tuple[np.ndarray, np.ndarray] | None:
+        '''
+        returns (token ids, character spans) of the passage, views into the mapped file,
+        None if the id is not in the store or the passage has no tokens
+        '''
+        try:
+            i = int(passage_id)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= i < self._n:
+            return None
+        start, end = int(self._offsets[i]), int(self._offsets[i+1])
+        if start == end:
+            return None
+        return self._ids[start:end], self._spans[start:end]
+
+    @staticmethod
+    def build(entries, path: str, name: str) -> int:
+        '''
+        writes (token ids, character spans) for passages 0, 1, ... to a token store at path,
+        returns the number of passages, ids and spans are streamed through temporary files
+        name = tokenizer name, checked by PairEncoder
+        '''
+        offsets = array('Q', [0])
+        with tempfile.TemporaryFile() as ids_file, tempfile.TemporaryFile() as spans_file:
+            for ids, spans in entries:
+                ids_file.write(np.asarray(ids, dtype='<i4').tobytes())
+                spans_file.write(np.asarray(spans, dtype='<i4').reshape(-1, 2).tobytes())
+                offsets.append(offsets[-1]+len(ids))
+            ids_file.seek(0)
+            spans_file.seek(0)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            n = len(offsets)-1
+            name = name.encode('utf-8')
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_header.pack(MAGIC, n, len(name)))
+                f.write(name.ljust(_padded(len(name)), b'\0'))
+                offsets.tofile(f)
+                shutil.copyfileobj(ids_file, f)
+                shutil.copyfileobj(spans_file, f)
+        # readers never see a partially written store
+        os.replace(tmp_path, path)
+        return n
+
+def _padded(size: int) -> int:
+    return (size+7)//8*8
+
+def load_token_store(path: str) -> TokenStore | None:
+    return TokenStore(path) if path and os.path.exists(path) else None
+
+def _truncate(first: int, second: int, budget: int) -> tuple[int, int]:
+    '''
+    longest first truncation, removes tokens from the longer sequence until the pair fits
+    '''
+    excess = first+second-budget
+    if excess <= 0:
+        return first, second
+    diff = min(excess, abs(first-second))
+    if first > second:
+        first -= diff
+    else:
+        second -= diff
+    excess -= diff
+    return first-(excess+1)//2, second-excess//2
+
+class PairEncoder:
+    def __init__(self, tokenizer, store: TokenStore=None, max_length: int=None):
+        '''
+        builds (question, passage) model inputs from token ids, only questions and passages
+        missing from store are tokenized, inputs are padded with NumPy
+            tokenizer = the model's (fast) tokenizer, store must be built with the same tokenizer
+            store = optional TokenStore of passage tokens
+            max_length = max tokens per pair, default the tokenizer's model_max_length
+        pairs are [CLS] question [SEP] passage [SEP] (BERT style tokenizers)
+        '''
+        if store is not None and store.name != tokenizer.name_or_path:
+            raise ValueError(f'token store built with {store.name}, model uses {tokenizer.name_or_path}')
+        self.cls, self.sep = tokenizer.cls_token_id, tokenizer.sep_token_id
+        if tokenizer.build_inputs_with_special_tokens([0], [1]) != [self.cls, 0, self.sep, 1, self.sep]:
+            raise ValueError(f'{tokenizer.name_or_path} does not use [CLS] a [SEP] b [SEP] pairs')
+        self.tokenizer = tokenizer
+        self.store = store
+        self.pad_id = tokenizer.pad_token_id
+        self.token_type_ids = 'token_type_ids' in tokenizer.model_input_names
+        self.max_length = max_length or tokenizer.model_max_length
+
+    def tokenize(self, texts: list[str]) -> list[tuple[np.ndarray, np.ndarray]]:
+        '''
+        (token ids, character spans) of each text without special tokens, as stored by ingestion
+        '''
+        if not texts:
+            return []
+        tokens = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+        return [(np.array(ids, dtype=np.int32), np.array(spans, dtype=np.int32).reshape(-1, 2))
+                for ids, spans in zip(tokens['input_ids'], tokens['offset_mapping'])]
+
+    def _tokens(self, questions: list[str], texts: list[str], passage_ids: list=None) -> tuple[dict, list]:
+        '''
+        (question -> token ids, (token ids, character spans) of each passage), passage tokens
+        come from the store by passage id when available
+        '''
+        unique = list(dict.fromkeys(questions))
+        question_ids = {q: ids for q, (ids, _) in zip(unique, self.tokenize(unique))}
+        passages = [None]*len(texts)
+        if self.store is not None and passage_ids is not None:
+            passages = [self.store.get(i) for i in passage_ids]
+        missing = [i for i, passage in enumerate(passages) if passage is None]
+        for i, passage in zip(missing, self.tokenize([texts[i] for i in missing])):
+            passages[i] = passage
+        return question_ids, passages
+
+    def _pair(self, question_ids: np.ndarray, passage_ids: np.ndarray) -> np.ndarray:
+        input_ids = np.empty(len(question_ids)+len(passage_ids)+3, dtype=np.int64)
+        input_ids[0], input_ids[len(question_ids)+1], input_ids[-1] = self.cls, self.sep, self.sep
+        input_ids[1:len(question_ids)+1] = question_ids
+        input_ids[len(question_ids)+2:-1] = passage_ids
+        return input_ids
+
+    def encode(self, questions: list[str], texts: list[str], passage_ids: list=None) -> list[tuple]:
+        '''
+        returns (input_ids, first segment length, passage spans) for each (question, text) pair,
+        passage tokens come from the store by passage id when available
+        '''
+        question_ids, passages = self._tokens(questions, texts, passage_ids)
+        pairs = []
+        for question, (ids, spans) in zip(questions, passages):
+            q = question_ids[question]
+            n_question, n_passage = _truncate(len(q), len(ids), self.max_length-3)
+            pairs.append((self._pair(q[:n_question], ids[:n_passage]), n_question+2, spans[:n_passage]))
+        return pairs
+
+    def encode_windows(self, questions: list[str], texts: list[str], passage_ids: list=None, max_length: int=None, stride: int=0) -> tuple[list, list]:
+        '''
+        splits passages that don't fit into overlapping windows instead of truncating them, as
+        tokenizers do with truncation='only_second' and return_overflowing_tokens, windows of a
+        passage start every max_length-(question length+3)-stride passage tokens
+        returns (windows, passages):
+            windows = (pair index, input_ids, first segment length, first passage token) per window
+            passages = (token ids, character spans) of each passage
+        questions too long to leave room for stride+1 passage tokens are truncated (longest first)
+        '''
+        max_length = max_length or self.max_length
+        question_ids, passages = self._tokens(questions, texts, passage_ids)
+        windows = []
+        for i, (question, (ids, _)) in enumerate(zip(questions, passages)):
+            q = question_ids[question]
+            budget = max_length-len(q)-3
+            if budget <= stride:
+                n_question, n_passage = _truncate(len(q), len(ids), max_length-3)
+                windows.append((i, self._pair(q[:n_question], ids[:n_passage]), n_question+2, 0))
+                continue
+            start = 0
+            while True:
+                windows.append((i, self._pair(q, ids[start:start+budget]), len(q)+2, start))
+                if start+budget >= len(ids):
+                    break
+                start += budget-stride
+        return windows, passages
+
+    def pad(self, pairs: list[tuple], batch: list[int], pad_to_multiple_of: int=None) -> dict:
+        '''
+        model inputs for pairs[i] for i in batch, padded to the longest pair, rounded up to a
+        multiple of pad_to_multiple_of if given
+        '''
+        lengths = np.array([len(pairs[i][0]) for i in batch])
+        width = int(lengths.max())
+        if pad_to_multiple_of:
+            width = -(-width//pad_to_multiple_of)*pad_to_multiple_of
+        input_ids = np.full((len(batch), width), self.pad_id, dtype=np.int64)
+        for row, i in enumerate(batch):
+            input_ids[row, :lengths[row]] = pairs[i][0]
+        positions = np.arange(width)
+        inputs = {'input_ids': input_ids, 'attention_mask': (positions < lengths[:, None]).astype(np.int64)}
+        if self.token_type_ids:
+            first = np.array([pairs[i][1] for i in batch])
+            second = (positions >= first[:, None]) & (positions < lengths[:, None])
+            inputs['token_type_ids'] = second.astype(np.int64)
+        return inputs
@@ -0,0 +1,12 @@
+'''
+adds the app folders to sys.path so benchmarks can import the services in-process,
+the app uses flat imports within each service folder
+'''
+import os, sys
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'app'))
+# the app folder must come first, o.w. qa_service resolves to qa_service/qa_service.py
+for folder in ['qa_service', 'nearest_neighbors_service', '']:
+    path = os.path.join(APP_DIR, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
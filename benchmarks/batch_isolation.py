@@ -0,0 +1,101 @@
+'''
+checks that a large /ask/batch (QA_Manager.answer_batch) doesn't stall other requests: while
+the batch runs, single questions are answered one after another and a heartbeat measures how
+late the event loop wakes up (liveness checks, /metrics and streaming share the loop)
+    single_idle_ms = single question latency percentiles without the batch
+    single_during_batch_ms = the same while the batch runs
+    answered_during_batch = single questions answered before the batch finished
+    max_loop_lag_ms = longest delay of a 1 ms sleep while the batch runs
+
+with --backend fake (default), models block their thread for the injected latency like real
+synchronous models, e.g.,
+    cd app && python ../benchmarks/batch_isolation.py ../squad_questions.jsonl --batch-questions 1000
+exits with status 1 if no single question is answered during the batch or the loop lag is
+above --max-loop-lag-ms
+'''
+import app_path
+from nearest_neighbors_service.ann_service import SearchType
+from qa_manager import QA_Manager
+from squad_metrics import load_questions
+from harness import percentiles
+import argparse, asyncio, json, sys, time
+
+def make_manager(args) -> QA_Manager:
+    if args.backend == 'fake':
+        return QA_Manager.make_fake_manager(
+                    num_passages = args.fake_passages,
+                    embed_ms = args.embed_ms,
+                    search_ms = args.search_ms,
+                    rerank_ms_per_pair = args.rerank_ms_per_pair,
+                    qa_ms_per_pair = args.qa_ms_per_pair
+                )
+    return QA_Manager.make_default_manager(
+                args.vdb_host, args.vdb_port, args.ft_host, args.ft_port
+            )
+
+async def singles(manager, questions: list[str], search_type, until=None) -> list[float]:
+    '''
+    answers questions one at a time (cycling) until until is done, o.w. each once, returns latencies (ms)
+    '''
+    latencies, i = [], 0
+    while (until is None and i < len(questions)) or (until is not None and not until.done()):
+        s = time.perf_counter()
+        await manager.answer(questions[i % len(questions)], search_type)
+        if until is None or not until.done():
+            latencies.append(1000*(time.perf_counter()-s))
+        i += 1
+    return latencies
+
+async def heartbeat(until) -> float:
+    lag = 0.0
+    while not until.done():
+        s = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lag = max(lag, 1000*(time.perf_counter()-s)-1)
+    return lag
+
+async def main(args) -> int:
+    questions = [q['question'] for q in load_questions(args.questions, args.batch_questions+args.singles)]
+    batch, single = questions[:args.batch_questions], questions[args.batch_questions:]
+    manager = make_manager(args)
+    # every question is new, so the response cache doesn't answer them
+    manager.response_cache = None
+    search_type = SearchType.from_string(args.search_type)
+    await manager.warmup()
+    idle = await singles(manager, single, search_type)
+    s = time.perf_counter()
+    running = asyncio.create_task(manager.answer_batch(batch, search_type))
+    during, lag = await asyncio.gather(singles(manager, single, search_type, running), heartbeat(running))
+    await running
+    result = {
+        'batch_seconds': round(time.perf_counter()-s, 3),
+        'single_idle_ms': percentiles(idle),
+        'single_during_batch_ms': percentiles(during) if during else None,
+        'answered_during_batch': len(during),
+        'max_loop_lag_ms': round(lag, 2)
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 1 if not during or lag > args.max_loop_lag_ms else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--batch-questions', type=int, default=1000, help='questions in the batch (BATCH_MAX_QUESTIONS)')
+    parser.add_argument('--singles', type=int, default=50, help='distinct single questions')
+    parser.add_argument('--search-type', default='VEC_FT', help='VEC, FT or VEC_FT')
+    parser.add_argument('--max-loop-lag-ms', type=float, default=50)
+    parser.add_argument('--backend', choices=['fake', 'default'], default='fake')
+    parser.add_argument('--fake-passages', type=int, default=10000)
+    parser.add_argument('--embed-ms', type=float, default=1.0, help='per question')
+    parser.add_argument('--search-ms', type=float, default=2.0)
+    parser.add_argument('--rerank-ms-per-pair', type=float, default=0.5)
+    parser.add_argument('--qa-ms-per-pair', type=float, default=1.0)
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    parser.add_argument('--output', default=None, help='write results as json')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,51 @@
+'''
+measures the accuracy and latency trade-off of AdaptiveComputePolicy settings against
+answering all k contexts, reports answers per question as a proxy for QA compute
+
+run from the app folder so model and data paths resolve, e.g.,
+    cd app && python ../benchmarks/early_exit.py ../squad_questions.jsonl --limit 1000
+'''
+import app_path
+from nearest_neighbors_service.ann_service import SearchType
+from qa_manager import QA_Manager
+from compute_policy import AdaptiveComputePolicy
+from squad_metrics import load_questions
+from evaluation import evaluate
+import argparse, asyncio, json
+
+POLICIES = {
+    'all-contexts': None,
+    'max-3': {'max_contexts': 3},
+    'min-score-0.5': {'min_score': 0.5},
+    'gap-0.3': {'max_gap': 0.3},
+    'gap-0.3-min-score-0.5': {'max_gap': 0.3, 'min_score': 0.5},
+    'qa-confidence-0.5': {'qa_confidence': 0.5},
+    'gap-0.3-qa-confidence-0.5': {'max_gap': 0.3, 'qa_confidence': 0.5},
+}
+
+async def main(args):
+    questions = load_questions(args.questions, args.limit)
+    manager = QA_Manager.make_default_manager(
+                    args.vdb_host, args.vdb_port, args.ft_host, args.ft_port
+                )
+    search_type = SearchType.from_string(args.search_type)
+    results = {}
+    for name, policy_args in POLICIES.items():
+        manager.compute_policy = AdaptiveComputePolicy(**policy_args) if policy_args else None
+        results[name] = await evaluate(manager, questions, search_type)
+        print(name, results[name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--search-type', default='VEC_FT', help='VEC, FT or VEC_FT')
+    parser.add_argument('--output', default=None, help='write results as json')
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    asyncio.run(main(parser.parse_args()))
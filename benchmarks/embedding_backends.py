@@ -0,0 +1,71 @@
+'''
+compares the query embedding model in PyTorch against the OpenVINO FP32 and INT8 exports:
+    - agreement, cosine similarity of each question's embedding with the PyTorch embedding
+    - CPU latency of single questions (p50/p95) and throughput of batches
+
+export the OpenVINO models first, then run from the app folder, e.g.,
+    cd app && python nearest_neighbors_service/embedding_models.py Snowflake/snowflake-arctic-embed-s ./models/snowflake-arctic-embed-s_OV --int8
+    python ../benchmarks/embedding_backends.py ../squad_questions.jsonl --limit 1000 --min-cosine 0.99
+exits with status 1 if the mean cosine of a backend is below --min-cosine
+'''
+import app_path
+from nearest_neighbors_service.ann_service import NearestNeighborService
+from squad_metrics import load_questions
+import numpy as np
+import argparse, json, sys, time
+
+def cosines(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a/np.linalg.norm(a, axis=1, keepdims=True)
+    b = b/np.linalg.norm(b, axis=1, keepdims=True)
+    return (a*b).sum(axis=1)
+
+def benchmark(model, questions: list[str], batch_size: int, single: int) -> tuple[np.ndarray, dict]:
+    # first calls compile and allocate
+    model.encode(questions[:batch_size], prompt_name='query')
+    latencies = []
+    for question in questions[:single]:
+        s = time.perf_counter()
+        model.encode(question, prompt_name='query')
+        latencies.append(1000*(time.perf_counter()-s))
+    embeddings = []
+    s = time.perf_counter()
+    for i in range(0, len(questions), batch_size):
+        embeddings.append(model.encode(questions[i:i+batch_size], prompt_name='query'))
+    elapsed = time.perf_counter()-s
+    return np.concatenate(embeddings), {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'questions_per_s': len(questions)/elapsed
+    }
+
+def main(args) -> int:
+    questions = [q['question'] for q in load_questions(args.questions, args.limit)]
+    results, reference, status = {}, None, 0
+    for embedding_type in ['torch']+args.backends:
+        model = NearestNeighborService.load_embedding_model(embedding_type, args.ov_cache_dir)
+        embeddings, results[embedding_type] = benchmark(model, questions, args.batch_size, args.single)
+        if reference is None:
+            reference = embeddings
+        else:
+            agreement = cosines(reference, embeddings)
+            results[embedding_type]['mean_cosine'] = float(agreement.mean())
+            results[embedding_type]['min_cosine'] = float(agreement.min())
+            if agreement.mean() < args.min_cosine:
+                status = 1
+        print(embedding_type, results[embedding_type])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return status
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--backends', nargs='+', default=['openvino', 'openvino_int8'])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--single', type=int, default=200, help='questions timed one at a time')
+    parser.add_argument('--min-cosine', type=float, default=0.99)
+    parser.add_argument('--ov-cache-dir', default=None)
+    parser.add_argument('--output', default=None, help='write results as json')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,27 @@
+import app_path
+from nearest_neighbors_service.ann_service import SearchType
+from squad_metrics import score_answers
+import time
+import numpy as np
+
+async def evaluate(manager, questions: list[dict], search_type=SearchType.VECTOR_AND_FULLTEXT) -> dict:
+    '''
+    answers questions one at a time, returns EM/F1 (in %), answers per question and latency (ms)
+    '''
+    latencies, totals, answered = [], {}, 0
+    for q in questions:
+        s = time.perf_counter()
+        answers = await manager.answer(q['question'], search_type)
+        latencies.append(1000*(time.perf_counter()-s))
+        answered += len(answers)
+        scores = score_answers([a['ans'] for a in answers], q['answers'])
+        for metric, value in scores.items():
+            totals[metric] = totals.get(metric, 0.0)+value
+    result = {metric: round(100*value/len(questions), 2) for metric, value in totals.items()}
+    result.update({
+        'answers_per_question': round(answered/len(questions), 2),
+        'mean_ms': round(float(np.mean(latencies)), 2),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+    })
+    return result
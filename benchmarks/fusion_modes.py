@@ -0,0 +1,52 @@
+'''
+compares latency and EM/F1 of hybrid retrieval modes:
+    rerank-all = concatenate vector and full-text results, cross-encoder over all (default)
+    rrf        = reciprocal rank fusion, no reranking
+    norm       = normalized score fusion, no reranking
+    rrf-top-n  = reciprocal rank fusion, rerank the top n fused results
+
+run from the app folder so model and data paths resolve, e.g.,
+    cd app && python ../benchmarks/fusion_modes.py ../squad_questions.jsonl --limit 1000
+'''
+import app_path
+from nearest_neighbors_service.ann_service import SearchType, Fusion
+from qa_manager import QA_Manager
+from squad_metrics import load_questions
+from evaluation import evaluate
+import argparse, asyncio, json
+
+def modes(top_n: int) -> dict:
+    return {
+        'rerank-all': (Fusion.CONCAT, None),
+        'rrf': (Fusion.RRF, 0),
+        'norm': (Fusion.NORMALIZED, 0),
+        f'rrf-top-{top_n}': (Fusion.RRF, top_n),
+    }
+
+async def main(args):
+    questions = load_questions(args.questions, args.limit)
+    # caches are off by default in make_default_manager so every question runs the full pipeline
+    manager = QA_Manager.make_default_manager(
+                    args.vdb_host, args.vdb_port, args.ft_host, args.ft_port
+                )
+    service = manager.nearest_neighbor_service
+    results = {}
+    for name, (fusion, rerank_top_n) in modes(args.top_n).items():
+        service.fusion, service.rerank_top_n = fusion, rerank_top_n
+        results[name] = await evaluate(manager, questions)
+        print(name, results[name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--output', default=None, help='write results as json')
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    asyncio.run(main(parser.parse_args()))
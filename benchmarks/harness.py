@@ -0,0 +1,247 @@
+'''
+replays a question file against QA_Manager (in-process) or the /ask endpoint (http),
+at a fixed concurrency (closed loop) or Poisson arrival rate (open loop), and reports
+throughput, end to end and per stage latency percentiles, and EM/F1 for each search type
+
+question file = jsonl, one {"question": str, "answers": [str, ...]} per line, answers are optional
+
+examples:
+    cd app && python ../benchmarks/harness.py ../requests.jsonl --concurrency 8 --output run.json
+    python benchmarks/harness.py requests.jsonl --mode http --url http://localhost:8000 --rate 20
+    python benchmarks/harness.py requests.jsonl --mode http --compare baseline.json
+    python benchmarks/harness.py questions.jsonl --backend fake --search-ms 5 --qa-ms 20 --concurrency 16
+    python benchmarks/harness.py questions.jsonl --backend fake --search-ms 5 --search-tail-ms 100 \
+        --search-tail-probability 0.05 --replicas 1 --hedge-percentile 95
+
+with --compare, exits with status 1 if p95 latency or F1 regressed by more than --tolerance
+'''
+import app_path
+from nearest_neighbors_service.ann_service import SearchType
+from instrumentation import start_trace
+from squad_metrics import load_questions, score_answers
+import argparse, asyncio, json, random, sys, time
+import numpy as np
+
+STAGES = ['embed', 'vector_search', 'fulltext_search', 'hybrid_search', 'rerank', 'qa']
+
+def in_process_sender(manager):
+    async def send(question: str, search_type: str):
+        trace = start_trace()
+        answers = await manager.answer(question, SearchType.from_string(search_type))
+        return [a['ans'] for a in answers], trace.stages
+    return send
+
+def parse_server_timing(header: str) -> dict:
+    stages = {}
+    for entry in filter(None, (e.strip() for e in header.split(','))):
+        name, _, dur = entry.partition(';dur=')
+        if dur:
+            stages[name] = float(dur)
+    return stages
+
+def http_sender(session, url: str):
+    async def send(question: str, search_type: str):
+        params = {'question': question, 'search_type': search_type}
+        async with session.get(f'{url}/ask', params=params) as response:
+            response.raise_for_status()
+            answers = await response.json()
+            stages = parse_server_timing(response.headers.get('Server-Timing', ''))
+        return [a['ans'] for a in answers], stages
+    return send
+
+async def timed_request(send, item: dict, search_type: str, start: float) -> dict:
+    '''
+    start = when the request should have been sent, so open loop latency includes queueing
+    '''
+    record = {'stages': {}, 'answers': [], 'error': None}
+    try:
+        record['answers'], record['stages'] = await send(item['question'], search_type)
+    except Exception as e:
+        record['error'] = repr(e)
+    record['latency_ms'] = 1000*(time.perf_counter()-start)
+    record['truths'] = item.get('answers')
+    return record
+
+async def closed_loop(send, items, search_type, concurrency):
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    records = []
+
+    async def worker():
+        while not queue.empty():
+            item = queue.get_nowait()
+            records.append(await timed_request(send, item, search_type, time.perf_counter()))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return records
+
+async def open_loop(send, items, search_type, rate, seed=0):
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    arrival, tasks = 0.0, []
+    for item in items:
+        arrival += rng.expovariate(rate)
+        delay = start+arrival-time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(timed_request(send, item, search_type, start+arrival)))
+    return await asyncio.gather(*tasks)
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    return {f'p{p}': round(float(np.percentile(values, p)), 2) for p in (50, 95, 99)}
+
+def summarize(records: list[dict], elapsed: float) -> dict:
+    ok = [r for r in records if r['error'] is None]
+    summary = {
+        'requests': len(records),
+        'errors': len(records)-len(ok),
+        'throughput_qps': round(len(ok)/elapsed, 2) if elapsed else 0.0,
+        'latency_ms': percentiles([r['latency_ms'] for r in ok]),
+        'stages_ms': {name: percentiles([r['stages'][name] for r in ok if name in r['stages']]) for name in STAGES},
+    }
+    scored = [r for r in ok if r['truths']]
+    if scored:
+        totals = {}
+        for r in scored:
+            for metric, value in score_answers(r['answers'], r['truths']).items():
+                totals[metric] = totals.get(metric, 0.0)+value
+        summary['accuracy'] = {metric: round(100*value/len(scored), 2) for metric, value in totals.items()}
+    return summary
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    '''
+    returns descriptions of p95 latency or F1 regressions larger than tolerance (fraction)
+    '''
+    regressions = []
+    for search_type, current in results['results'].items():
+        previous = baseline['results'].get(search_type)
+        if previous is None:
+            continue
+        old_p95, new_p95 = previous['latency_ms'].get('p95'), current['latency_ms'].get('p95')
+        if old_p95 and new_p95 and new_p95 > old_p95*(1+tolerance):
+            regressions.append(f'{search_type}: p95 latency {old_p95} -> {new_p95} ms')
+        old_f1 = previous.get('accuracy', {}).get('F1')
+        new_f1 = current.get('accuracy', {}).get('F1')
+        if old_f1 and new_f1 is not None and new_f1 < old_f1*(1-tolerance):
+            regressions.append(f'{search_type}: F1 {old_f1} -> {new_f1}')
+    return regressions
+
+def make_manager(args):
+    from qa_manager import QA_Manager
+    from admission import AdmissionController
+    admission = None
+    if args.admission_max_concurrent:
+        admission = AdmissionController(
+                        args.admission_max_concurrent, 
+                        args.admission_max_queue,
+                        args.admission_max_queue_ms/1000 if args.admission_max_queue_ms else None
+                    )
+    if args.backend == 'fake':
+        # hermetic run, measures pipeline overhead, batching and concurrency behavior
+        return QA_Manager.make_fake_manager(
+                    num_passages = args.fake_passages,
+                    embed_ms = args.embed_ms,
+                    search_ms = args.search_ms,
+                    rerank_ms_per_pair = args.rerank_ms_per_pair,
+                    qa_ms = args.qa_ms,
+                    qa_ms_per_pair = args.qa_ms_per_pair,
+                    jitter_ms = args.jitter_ms,
+                    search_tail_ms = args.search_tail_ms,
+                    search_tail_probability = args.search_tail_probability,
+                    replicas = args.replicas,
+                    ids_only = args.ids_only,
+                    vector_timeout = args.search_timeout_ms/1000 if args.search_timeout_ms else None,
+                    fulltext_timeout = args.search_timeout_ms/1000 if args.search_timeout_ms else None,
+                    hedge_percentile = args.hedge_percentile,
+                    admission = admission,
+                    pipelined = args.pipelined
+                )
+    return QA_Manager.make_default_manager(
+                args.vdb_host, 
+                args.vdb_port, 
+                args.ft_host, 
+                args.ft_port, 
+                admission = admission,
+                pipelined = args.pipelined
+            )
+
+async def run(args, send) -> dict:
+    items = load_questions(args.questions, args.limit)
+    results = {}
+    for search_type in args.search_types.split(','):
+        if args.warmup:
+            await closed_loop(send, items[:args.warmup], search_type, 1)
+        start = time.perf_counter()
+        if args.rate:
+            records = await open_loop(send, items, search_type, args.rate)
+        else:
+            records = await closed_loop(send, items, search_type, args.concurrency)
+        results[search_type] = summarize(records, time.perf_counter()-start)
+        print(search_type, json.dumps(results[search_type]))
+    return results
+
+async def main(args):
+    if args.mode == 'http':
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            results = await run(args, http_sender(session, args.url.rstrip('/')))
+    else:
+        results = await run(args, in_process_sender(make_manager(args)))
+    output = {
+        'config': {name: value for name, value in vars(args).items() if name not in ['output', 'compare']},
+        'timestamp': time.time(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(output, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl question file')
+    parser.add_argument('--mode', choices=['in-process', 'http'], default='in-process')
+    parser.add_argument('--url', default='http://localhost:8000', help='server for http mode')
+    parser.add_argument('--search-types', default='VEC_FT,VEC,FT', help='comma separated VEC, FT, VEC_FT, HYBRID')
+    parser.add_argument('--concurrency', type=int, default=1, help='closed loop concurrent requests')
+    parser.add_argument('--rate', type=float, default=None, help='open loop arrival rate (requests/s)')
+    parser.add_argument('--limit', type=int, default=None, help='max questions to replay')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests before each run')
+    parser.add_argument('--output', default=None, help='write results as json')
+    parser.add_argument('--compare', default=None, help='baseline results json to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--backend', choices=['default', 'fake'], default='default', help='in-process backends')
+    parser.add_argument('--fake-passages', type=int, default=10000)
+    parser.add_argument('--embed-ms', type=float, default=0.0, help='fake embedding latency per question')
+    parser.add_argument('--search-ms', type=float, default=0.0, help='fake latency per search request')
+    parser.add_argument('--rerank-ms-per-pair', type=float, default=0.0, help='fake reranker latency per pair')
+    parser.add_argument('--qa-ms', type=float, default=0.0, help='fake QA latency per request')
+    parser.add_argument('--qa-ms-per-pair', type=float, default=0.0, help='fake QA latency per pair')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform noise added to fake latencies')
+    parser.add_argument('--search-tail-ms', type=float, default=0.0, help='extra latency of slow fake searches')
+    parser.add_argument('--search-tail-probability', type=float, default=0.0, help='fraction of slow fake searches')
+    parser.add_argument('--replicas', type=int, default=0, help='fake replicas per search backend')
+    parser.add_argument('--ids-only', action='store_true', help='fake backends return ids, text comes from a passage store')
+    parser.add_argument('--search-timeout-ms', type=float, default=None, help='fake search deadline')
+    parser.add_argument('--hedge-percentile', type=float, default=None, help='hedge fake searches after this percentile')
+    parser.add_argument('--pipelined', action='store_true', help='overlap the stages of each request')
+    parser.add_argument('--admission-max-concurrent', type=int, default=None, help='in-process admission control')
+    parser.add_argument('--admission-max-queue', type=int, default=128)
+    parser.add_argument('--admission-max-queue-ms', type=float, default=None)
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    return parser
+
+if __name__ == '__main__':
+    asyncio.run(main(parser().parse_args()))
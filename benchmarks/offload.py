@@ -0,0 +1,89 @@
+'''
+measures throughput per CPU core with models running in the API process against models offloaded
+to Nvidia Triton Inference Server (EMBEDDING_TYPE, RERANKER_TYPE and QA_TYPE = triton):
+    cpu_s_per_request = CPU time of this process (all threads) per request
+    qps_per_core = requests per CPU second, the throughput of one fully used core
+with --server-pid (Triton running on the same host), the server's CPU time is reported too and
+included in qps_per_core_total
+
+run from the app folder so model and data paths resolve, with Triton serving the models (see
+nearest_neighbors_service/triton_inference_models.py), e.g.,
+    cd app && python ../benchmarks/offload.py ../squad_questions.jsonl --limit 500 --concurrency 16
+'''
+import app_path
+from qa_manager import QA_Manager
+from squad_metrics import load_questions
+from harness import in_process_sender, closed_loop, summarize
+import argparse, asyncio, json, os, time
+
+CONFIGS = {
+    'in-process': {'qa_type': 'openvino', 'reranker_type': 'openvino'},
+    'triton': {'qa_type': 'triton', 'reranker_type': 'triton', 'embedding_type': 'triton'},
+}
+
+def process_cpu_seconds(pid: int) -> float:
+    '''
+    user+system CPU time of process pid (Linux)
+    '''
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11])+int(fields[12]))/os.sysconf('SC_CLK_TCK')
+
+async def measure(manager, items, search_type: str, concurrency: int, server_pid: int=None) -> dict:
+    send = in_process_sender(manager)
+    await closed_loop(send, items[:concurrency], search_type, concurrency)
+    cpu, server_cpu = time.process_time(), process_cpu_seconds(server_pid) if server_pid else None
+    start = time.perf_counter()
+    records = await closed_loop(send, items, search_type, concurrency)
+    elapsed = time.perf_counter()-start
+    cpu = time.process_time()-cpu
+    summary = summarize(records, elapsed)
+    completed = summary['requests']-summary['errors']
+    summary['cpu_s_per_request'] = round(cpu/max(completed, 1), 5)
+    summary['qps_per_core'] = round(completed/cpu, 2) if cpu else 0.0
+    if server_pid:
+        server_cpu = process_cpu_seconds(server_pid)-server_cpu
+        summary['server_cpu_s_per_request'] = round(server_cpu/max(completed, 1), 5)
+        summary['qps_per_core_total'] = round(completed/(cpu+server_cpu), 2) if cpu+server_cpu else 0.0
+    return summary
+
+async def main(args):
+    items = load_questions(args.questions, args.limit)
+    results = {}
+    for name in args.configs.split(','):
+        config = {'embedding_type': args.embedding_type, **CONFIGS[name]}
+        manager = await QA_Manager.load_default_manager(
+                        vector_db_host = args.vdb_host,
+                        vector_db_port = args.vdb_port,
+                        fulltext_host = args.ft_host,
+                        fulltext_port = args.ft_port,
+                        inference_host = args.inference_host,
+                        inference_port = args.inference_port,
+                        **config
+                    )
+        await manager.warmup()
+        # the Triton server only does work for offloaded models
+        server_pid = args.server_pid if name == 'triton' else None
+        results[name] = await measure(manager, items, args.search_type, args.concurrency, server_pid)
+        print(name, json.dumps(results[name]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--search-type', default='VEC_FT', help='VEC, FT or VEC_FT')
+    parser.add_argument('--concurrency', type=int, default=16, help='closed loop concurrent requests')
+    parser.add_argument('--configs', default='in-process,triton', help=f'comma separated, from {", ".join(CONFIGS)}')
+    parser.add_argument('--embedding-type', default='openvino_int8', help='in-process embedding runtime')
+    parser.add_argument('--server-pid', type=int, default=None, help='pid of a local Triton server')
+    parser.add_argument('--output', default=None, help='write results as json')
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    parser.add_argument('--inference-host', default='localhost')
+    parser.add_argument('--inference-port', default='9000')
+    asyncio.run(main(parser.parse_args()))
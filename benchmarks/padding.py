@@ -0,0 +1,107 @@
+'''
+measures padding in reranker and QA inference on retrieved contexts, for batches padded to the
+longest pair (max_padding None) and length bucketed batches (see batching.bucketed_batches):
+    useful tokens = real tokens of all pairs, computed tokens = tokens including padding
+
+each question's contexts are reranked and answered on their own (as in /ask), and all pairs
+of --batch-size questions together (as in /ask/batch)
+
+run from the app folder so model and data paths resolve, e.g.,
+    cd app && python ../benchmarks/padding.py ../squad_questions.jsonl --limit 500
+QA padding is only measured for the Triton client and OpenVINO QA with a token store (ingestion.py),
+the Hugging Face pipeline pads internally
+'''
+import app_path
+from nearest_neighbors_service.ann_service import SearchType
+from qa_service.huggingface_qa import OpenVINO_QA
+from qa_manager import QA_Manager
+from metrics import INFERENCE_TOKENS
+from squad_metrics import load_questions
+import argparse, asyncio, json, time
+
+def run_reranker(reranker, groups: list[list[tuple]]) -> None:
+    for pairs in groups:
+        reranker.predict_pairs(pairs)
+
+async def run_qa(qa_service, groups: list[list[tuple]]) -> None:
+    model = qa_service.qa_model
+    for pairs in groups:
+        answer = lambda: model.answer(
+                    questions = [question for question, _ in pairs],
+                    contexts = [context['text'] for _, context in pairs],
+                    max_batch_tokens = qa_service.max_batch_tokens,
+                    context_ids = [context['id'] for _, context in pairs]
+                )
+        if qa_service.is_async:
+            await answer()
+        else:
+            answer()
+
+async def measure(name: str, run) -> dict:
+    '''
+    useful and computed tokens and latency of run(), tokens are read from the inference metrics
+    '''
+    before = [INFERENCE_TOKENS.get(model=name, kind=kind) for kind in ['input', 'padded']]
+    s = time.perf_counter()
+    result = run()
+    if asyncio.iscoroutine(result):
+        await result
+    elapsed = time.perf_counter()-s
+    useful, computed = [INFERENCE_TOKENS.get(model=name, kind=kind)-b for kind, b in zip(['input', 'padded'], before)]
+    return {
+        'useful_tokens': int(useful),
+        'computed_tokens': int(computed),
+        'padding_fraction': round(1-useful/computed, 4) if computed else 0.0,
+        'seconds': round(elapsed, 3)
+    }
+
+async def main(args):
+    questions = [q['question'] for q in load_questions(args.questions, args.limit)]
+    manager = QA_Manager.make_default_manager(
+                    args.vdb_host, args.vdb_port, args.ft_host, args.ft_port, qa_type=args.qa_type
+                )
+    search_type = SearchType.from_string(args.search_type)
+    contexts_lists = [await manager.nearest_neighbor_service.query(q, manager.k, search_type, rerank=False)
+                      for q in questions]
+    pairs = [[(q, context) for context in contexts] for q, contexts in zip(questions, contexts_lists)]
+    workloads = {
+        'per_question': pairs,
+        'batched': [[pair for group in pairs[i:i+args.batch_size] for pair in group]
+                    for i in range(0, len(pairs), args.batch_size)]
+    }
+    reranker = manager.nearest_neighbor_service.reranking_model
+    qa_service = manager.qa_service
+    qa = qa_service.qa_model
+    measure_qa = not (isinstance(qa, OpenVINO_QA) and qa.encoder is None)
+    results = {}
+    for workload, groups in workloads.items():
+        for max_padding in [None, args.max_padding]:
+            mode = f'{workload}/max_padding={max_padding}'
+            reranker.max_padding = max_padding
+            # first pass warms up compiled shapes, the second is measured
+            run_reranker(reranker, groups)
+            results[f'rerank/{mode}'] = await measure('reranker', lambda: run_reranker(reranker, groups))
+            print(f'rerank/{mode}', results[f'rerank/{mode}'])
+            if measure_qa:
+                qa.max_padding = max_padding
+                await run_qa(qa_service, groups)
+                results[f'qa/{mode}'] = await measure('qa', lambda: run_qa(qa_service, groups))
+                print(f'qa/{mode}', results[f'qa/{mode}'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--search-type', default='VEC_FT', help='VEC, FT or VEC_FT')
+    parser.add_argument('--batch-size', type=int, default=32, help='questions per batch in the batched workload')
+    parser.add_argument('--max-padding', type=float, default=0.25)
+    parser.add_argument('--qa-type', default='openvino', help='openvino or triton')
+    parser.add_argument('--output', default=None, help='write results as json')
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,66 @@
+'''
+measures per request latency of sequential stages against overlapped stages (QA_Manager pipelined):
+full-text search during query embedding, reranking and question answering on the first search
+results while the other search runs; EM/F1 should not change, only latency
+
+run from the app folder so model and data paths resolve, e.g.,
+    cd app && python ../benchmarks/pipelining.py ../squad_questions.jsonl --limit 500
+with --backend fake, stage latencies are injected (--embed-ms, --vector-search-ms, ...) and the
+critical path can be compared with the sum of stages without models or backends
+'''
+import app_path
+from nearest_neighbors_service.ann_service import SearchType
+from qa_manager import QA_Manager
+from squad_metrics import load_questions
+from evaluation import evaluate
+import argparse, asyncio, json
+
+def make_manager(args) -> QA_Manager:
+    if args.backend == 'fake':
+        return QA_Manager.make_fake_manager(
+                    num_passages = args.fake_passages,
+                    embed_ms = args.embed_ms,
+                    search_ms = args.vector_search_ms,
+                    fulltext_search_ms = args.fulltext_search_ms,
+                    rerank_ms_per_pair = args.rerank_ms_per_pair,
+                    qa_ms = args.qa_ms,
+                    qa_ms_per_pair = args.qa_ms_per_pair
+                )
+    return QA_Manager.make_default_manager(
+                args.vdb_host, args.vdb_port, args.ft_host, args.ft_port
+            )
+
+async def main(args):
+    questions = load_questions(args.questions, args.limit)
+    manager = make_manager(args)
+    search_type = SearchType.from_string(args.search_type)
+    await manager.warmup()
+    results = {}
+    for pipelined in [False, True]:
+        name = 'pipelined' if pipelined else 'sequential'
+        manager.pipelined = pipelined
+        results[name] = await evaluate(manager, questions, search_type)
+        print(name, results[name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--search-type', default='VEC_FT', help='VEC, FT or VEC_FT')
+    parser.add_argument('--output', default=None, help='write results as json')
+    parser.add_argument('--backend', choices=['default', 'fake'], default='default')
+    parser.add_argument('--fake-passages', type=int, default=1000, help='fake searches scan all passages in Python')
+    parser.add_argument('--embed-ms', type=float, default=10.0, help='fake embedding latency per question')
+    parser.add_argument('--vector-search-ms', type=float, default=10.0)
+    parser.add_argument('--fulltext-search-ms', type=float, default=30.0)
+    parser.add_argument('--rerank-ms-per-pair', type=float, default=2.0)
+    parser.add_argument('--qa-ms', type=float, default=5.0, help='fake QA latency per request')
+    parser.add_argument('--qa-ms-per-pair', type=float, default=3.0)
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    asyncio.run(main(parser.parse_args()))
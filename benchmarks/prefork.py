@@ -0,0 +1,104 @@
+'''
+measures throughput and per worker memory vs number of workers for the pre-fork server
+(app/prefork.py), with models loaded once in the master and shared copy-on-write (preload)
+against models loaded in each worker (independent, same as uvicorn --workers):
+    rss_mb = resident memory per worker, counts shared pages in full
+    pss_mb = proportional set size, shared pages divided between the processes sharing them
+    uss_mb = memory private to the worker
+    total_pss_mb = memory used by the whole server (master and workers)
+
+run from the app folder so model and data paths resolve, e.g.,
+    cd app && python ../benchmarks/prefork.py ../squad_questions.jsonl --workers 1,2,4
+server settings come from the environment (see main.py), e.g., FAKE_BACKENDS=1 for the
+server without models and backends
+'''
+import app_path
+from squad_metrics import load_questions
+from harness import http_sender, closed_loop, summarize
+import aiohttp
+import psutil
+import argparse, asyncio, json, signal, sys, time
+
+MODES = {'preload': [], 'independent': ['--no-preload']}
+
+async def start_server(workers: int, mode: str, port: int, pin: bool, timeout: float):
+    '''
+    starts prefork.py, returns the master process once all workers are ready
+    '''
+    command = [sys.executable, 'prefork.py', '--port', str(port), '--workers', str(workers), *MODES[mode]]
+    if not pin:
+        command.append('--no-pin')
+    process = await asyncio.create_subprocess_exec(*command, stderr=asyncio.subprocess.PIPE)
+    deadline = time.perf_counter()+timeout
+    while True:
+        remaining = deadline-time.perf_counter()
+        line = await asyncio.wait_for(process.stderr.readline(), max(remaining, 0.001))
+        if not line:
+            raise RuntimeError(f'server exited with status {await process.wait()}')
+        if b'workers ready' in line:
+            break
+    # keep reading logs so the server never blocks on a full pipe
+    asyncio.create_task(drain(process.stderr))
+    return process
+
+async def drain(stream):
+    while await stream.readline():
+        pass
+
+def memory(pid: int) -> dict:
+    '''
+    mean per worker rss, pss and uss, and total pss of the master and its workers (MB)
+    '''
+    master = psutil.Process(pid)
+    workers = [process.memory_full_info() for process in master.children()]
+    mean = lambda name: round(sum(getattr(info, name) for info in workers)/len(workers)/2**20, 1)
+    return {
+        'rss_mb': mean('rss'),
+        'pss_mb': mean('pss'),
+        'uss_mb': mean('uss'),
+        'total_pss_mb': round((master.memory_full_info().pss+sum(info.pss for info in workers))/2**20, 1),
+    }
+
+async def measure(args, items, workers: int, mode: str) -> dict:
+    process = await start_server(workers, mode, args.port, not args.no_pin, args.startup_timeout)
+    try:
+        concurrency = args.concurrency_per_worker*workers
+        timeout = aiohttp.ClientTimeout(total=None)
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            send = http_sender(session, f'http://localhost:{args.port}')
+            await closed_loop(send, items[:concurrency], args.search_type, concurrency)
+            start = time.perf_counter()
+            records = await closed_loop(send, items, args.search_type, concurrency)
+            summary = summarize(records, time.perf_counter()-start)
+        summary.update(memory(process.pid))
+        return summary
+    finally:
+        process.send_signal(signal.SIGTERM)
+        await process.wait()
+
+async def main(args):
+    items = load_questions(args.questions, args.limit)
+    results = {}
+    for mode in args.modes.split(','):
+        results[mode] = {}
+        for workers in [int(n) for n in args.workers.split(',')]:
+            results[mode][workers] = await measure(args, items, workers, mode)
+            print(mode, workers, json.dumps(results[mode][workers]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--search-type', default='VEC_FT', help='VEC, FT or VEC_FT')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--modes', default='preload,independent', help=f'comma separated, from {", ".join(MODES)}')
+    parser.add_argument('--concurrency-per-worker', type=int, default=4, help='closed loop concurrent requests per worker')
+    parser.add_argument('--no-pin', action='store_true', help="don't pin workers to cores")
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--startup-timeout', type=float, default=600, help='seconds until all workers are ready')
+    parser.add_argument('--output', default=None, help='write results as json')
+    asyncio.run(main(parser.parse_args()))
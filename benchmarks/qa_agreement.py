@@ -0,0 +1,70 @@
+'''
+checks that OpenVINO QA on pre-tokenized pairs (the token store path, OpenVINO_QA._answer_encoded)
+gives the same answers and scores as the question answering pipeline on SQuAD contexts:
+    answer_agreement = fraction of questions with identical answers
+    max_score_diff and mean_score_diff = absolute QA_score differences
+    EM/F1 (in %) of both paths against the SQuAD answers
+passages are tokenized at query time here, with a token store the same tokens are read from
+the store, e.g.,
+    cd app && python ../benchmarks/qa_agreement.py --limit 2000
+exits with status 1 if answer_agreement is below --min-agreement
+'''
+import app_path
+from qa_service.qa_service import QA_Service
+from qa_service.huggingface_qa import word_continuations
+from token_store import PairEncoder
+from squad_metrics import score_answers
+import numpy as np
+import argparse, json, sys
+
+def load_squad(split: str, limit: int) -> list[dict]:
+    from datasets import load_dataset
+    rows = load_dataset('rajpurkar/squad', split=split).select(range(limit))
+    return [{'question': row['question'], 'context': row['context'], 'answers': row['answers']['text']} for row in rows]
+
+def main(args) -> int:
+    rows = load_squad(args.split, args.limit)
+    model = QA_Service.load_quantized_model(token_store_path=None)
+    # the token store path without a store, passages are tokenized by the encoder
+    model.encoder = PairEncoder(model.model.tokenizer)
+    model.continuations = word_continuations(model.model.tokenizer)
+    pipeline, encoded = [], []
+    for i in range(0, len(rows), args.batch_size):
+        batch = rows[i:i+args.batch_size]
+        questions, contexts = [r['question'] for r in batch], [r['context'] for r in batch]
+        answers = model.model(question=questions, context=contexts)
+        pipeline.extend(answers if isinstance(answers, list) else [answers])
+        encoded.extend(model._answer_encoded(questions, contexts, [None]*len(batch)))
+    diffs = np.abs([p['score']-e['score'] for p, e in zip(pipeline, encoded)])
+    result = {
+        'questions': len(rows),
+        'answer_agreement': round(float(np.mean([p['answer'] == e['answer'] for p, e in zip(pipeline, encoded)])), 4),
+        'max_score_diff': round(float(diffs.max()), 6),
+        'mean_score_diff': round(float(diffs.mean()), 6),
+    }
+    for name, answers in [('pipeline', pipeline), ('encoded', encoded)]:
+        totals = {}
+        for row, answer in zip(rows, answers):
+            for metric, value in score_answers([answer['answer']], row['answers'], n=1).items():
+                totals[metric] = totals.get(metric, 0.0)+value
+        result[name] = {metric: round(100*value/len(rows), 2) for metric, value in totals.items()}
+    disagreements = [
+        {'question': r['question'], 'pipeline': p['answer'], 'encoded': e['answer']}
+        for r, p, e in zip(rows, pipeline, encoded) if p['answer'] != e['answer']
+    ]
+    result['disagreement_examples'] = disagreements[:args.examples]
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 1 if result['answer_agreement'] < args.min_agreement else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--split', default='validation')
+    parser.add_argument('--limit', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--min-agreement', type=float, default=0.99)
+    parser.add_argument('--examples', type=int, default=10, help='disagreements to print')
+    parser.add_argument('--output', default=None, help='write results as json')
+    sys.exit(main(parser.parse_args()))
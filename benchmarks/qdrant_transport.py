@@ -0,0 +1,110 @@
+'''
+compares QDRANT_Client over REST and gRPC, with whole payloads and with payloads projected
+to the id (as with a passage store), and ingestion with one waiting upsert against concurrent
+batched upserts that don't wait (insert_group):
+    latency_ms = percentiles of single queries, one at a time
+    throughput_qps = single queries at --concurrency
+    batch_qps = queries per second with query_group batches of --batch-size
+    one_upsert_pps and concurrent_pps = points per second inserted into a temporary collection,
+        concurrent upserts return before the points are indexed, so this is the client side rate
+
+queries are random unit vectors against the app's collection (transport and payload cost don't
+depend on the query), e.g.,
+    python benchmarks/qdrant_transport.py --queries 2000 --concurrency 16
+'''
+import app_path
+from nearest_neighbors_service.qdrantdb_client import QDRANT_Client, DB_Entry, Distance
+from harness import percentiles
+import numpy as np
+import argparse, asyncio, json, time
+
+def random_vectors(n: int, dim: int, seed: int=0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return vectors/np.linalg.norm(vectors, axis=1, keepdims=True)
+
+async def measure_queries(client: QDRANT_Client, index: str, vectors: np.ndarray, args) -> dict:
+    latencies = []
+    for vector in vectors[:args.sequential]:
+        start = time.perf_counter()
+        await client.query(index, vector, args.k)
+        latencies.append(1000*(time.perf_counter()-start))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def query(vector):
+        async with semaphore:
+            await client.query(index, vector, args.k)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[query(vector) for vector in vectors])
+    throughput = len(vectors)/(time.perf_counter()-start)
+    start = time.perf_counter()
+    for i in range(0, len(vectors), args.batch_size):
+        await client.query_group(index, list(vectors[i:i+args.batch_size]), args.k)
+    batch_throughput = len(vectors)/(time.perf_counter()-start)
+    return {
+        'latency_ms': percentiles(latencies),
+        'throughput_qps': round(throughput, 2),
+        'batch_qps': round(batch_throughput, 2)
+    }
+
+async def measure_inserts(client: QDRANT_Client, entries: list[DB_Entry], concurrent: bool, dim: int) -> float:
+    '''
+    points per second inserted into a temporary collection, concurrent = insert_group defaults,
+    o.w. all points in one upsert that waits
+    '''
+    index = 'transport_benchmark'
+    await client.delete_index(index)
+    await client.create_index(index, dim, Distance.COSINE, np.float32)
+    start = time.perf_counter()
+    if concurrent:
+        await client.insert_group(entries)
+    else:
+        client.upsert_batch_size = len(entries)
+        await client.insert_group(entries, wait=True)
+    elapsed = time.perf_counter()-start
+    await client.delete_index(index)
+    return round(len(entries)/elapsed, 2)
+
+async def main(args):
+    vectors = random_vectors(args.queries, args.dim)
+    entries = [
+        DB_Entry(str(i), vector, {'id': str(i), 'content': 'x'*args.payload_chars})
+        for i, vector in enumerate(random_vectors(args.points, args.dim, seed=1))
+    ]
+    results = {}
+    for transport in args.transports.split(','):
+        grpc_port = args.grpc_port if transport == 'grpc' else None
+        client = QDRANT_Client(args.host, args.port, grpc_port)
+        for fields in ['all', 'id']:
+            client.configure_query(None if fields == 'all' else ['id'])
+            await measure_queries(client, args.index, vectors[:args.concurrency], args)
+            name = f'{transport}/{fields}'
+            results[name] = await measure_queries(client, args.index, vectors, args)
+            print(name, json.dumps(results[name]))
+        if args.points:
+            results[f'{transport}/insert'] = {
+                'one_upsert_pps': await measure_inserts(client, entries, False, args.dim),
+                'concurrent_pps': await measure_inserts(QDRANT_Client(args.host, args.port, grpc_port), entries, True, args.dim),
+            }
+            print(f'{transport}/insert', json.dumps(results[f'{transport}/insert']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='6333', help='REST port')
+    parser.add_argument('--grpc-port', default='6334')
+    parser.add_argument('--transports', default='rest,grpc')
+    parser.add_argument('--index', default='wiki')
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--sequential', type=int, default=500, help='queries for the latency percentiles')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--points', type=int, default=20000, help='points to insert, 0 skips inserts')
+    parser.add_argument('--payload-chars', type=int, default=600, help='text per inserted point')
+    parser.add_argument('--output', default=None, help='write results as json')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+'''
+measures how often the semantic cache (app/semantic_cache.py) would serve another question's
+answers, before choosing SEMANTIC_CACHE_THRESHOLD:
+    hit_rate = fraction of questions answered from the cache
+    false_hit_rate = fraction of questions served a cached question whose SQuAD answers share
+        no (normalized) answer with their own
+    hit_precision = fraction of hits that are not false hits
+    contrast_hits = fraction of CONTRAST_PAIRS (entity and number swaps, different answers)
+        with cosine similarity >= threshold
+
+questions are distinct after normalization (exact repeats are response cache hits), each is
+looked up and then inserted, as in the app, e.g.,
+    cd app && python ../benchmarks/semantic_false_hits.py ../squad_questions.jsonl --thresholds 0.9,0.95,0.97,0.99
+exits with status 1 if the false hit rate at --threshold is above --max-false-hit-rate
+'''
+import app_path
+from nearest_neighbors_service.ann_service import NearestNeighborService, SearchType
+from semantic_cache import SemanticCache
+from response_cache import normalize_question
+from squad_metrics import load_questions, normalize_answer
+import numpy as np
+import argparse, json, sys
+
+CONTRAST_PAIRS = [
+    ('How many teeth does a dog have?', 'How many teeth does a cat have?'),
+    ('Who won Super Bowl 50?', 'Who won Super Bowl 49?'),
+    ('What is the capital of Austria?', 'What is the capital of Australia?'),
+    ('When did World War I begin?', 'When did World War II begin?'),
+    ('Who was the first president of the United States?', 'Who was the second president of the United States?'),
+    ('What is the boiling point of water in Celsius?', 'What is the boiling point of water in Fahrenheit?'),
+    ('Which river flows through Paris?', 'Which river flows through London?'),
+    ('What year did the Berlin Wall fall?', 'What year was the Berlin Wall built?'),
+    ('How long does a train take from Paris to Lyon?', 'How long does a train take from Paris to Nice?'),
+    ('What is the population of Warsaw in 2010?', 'What is the population of Warsaw in 1950?'),
+]
+
+def distinct(questions: list[dict]) -> list[dict]:
+    seen, result = set(), []
+    for q in questions:
+        key = normalize_question(q['question'])
+        if key not in seen:
+            seen.add(key)
+            result.append(q)
+    return result
+
+def replay(questions: list[dict], embeddings: np.ndarray, threshold: float, examples: int) -> dict:
+    '''
+    looks up and inserts each question in a semantic cache large enough for all of them
+    '''
+    cache = SemanticCache(embeddings.shape[1], max_entries=len(questions), threshold=threshold, ttl=float('inf'))
+    false_hits = []
+    for q, embedding in zip(questions, embeddings):
+        cached = cache.lookup(embedding, SearchType.VECTOR_AND_FULLTEXT, 5)
+        if cached is None:
+            cache.insert(embedding, SearchType.VECTOR_AND_FULLTEXT, 5, q)
+        elif not {normalize_answer(a) for a in q['answers']} & {normalize_answer(a) for a in cached['answers']}:
+            false_hits.append((q['question'], cached['question']))
+    return {
+        'hit_rate': round(cache.hits/len(questions), 4),
+        'false_hit_rate': round(len(false_hits)/len(questions), 4),
+        'hit_precision': round(1-len(false_hits)/cache.hits, 4) if cache.hits else None,
+        'false_hit_examples': false_hits[:examples]
+    }
+
+def main(args) -> int:
+    questions = distinct(load_questions(args.questions, args.limit))
+    model = NearestNeighborService.load_embedding_model(args.embedding_type)
+    encode = lambda texts: np.concatenate([
+        np.asarray(model.encode(texts[i:i+args.batch_size], prompt_name='query'))
+        for i in range(0, len(texts), args.batch_size)
+    ])
+    embeddings = encode([q['question'] for q in questions])
+    first = encode([a for a, _ in CONTRAST_PAIRS])
+    second = encode([b for _, b in CONTRAST_PAIRS])
+    contrast = [float(np.dot(SemanticCache._normalize(a), SemanticCache._normalize(b))) for a, b in zip(first, second)]
+    print(f'{len(questions)} distinct questions, contrast pair cosine min {min(contrast):.3f} max {max(contrast):.3f}')
+    results = {}
+    for threshold in sorted({float(t) for t in args.thresholds.split(',')} | {args.threshold}):
+        results[threshold] = replay(questions, embeddings, threshold, args.examples)
+        results[threshold]['contrast_hits'] = round(float(np.mean([c >= threshold for c in contrast])), 4)
+        print(threshold, json.dumps(results[threshold]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({str(t): r for t, r in results.items()}, f, indent=2)
+    if results[args.threshold]['false_hit_rate'] > args.max_false_hit_rate:
+        print(f'false hit rate at {args.threshold} is above {args.max_false_hit_rate}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=10000)
+    parser.add_argument('--embedding-type', default='torch', help='torch, openvino or openvino_int8')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--thresholds', default='0.9,0.93,0.95,0.97,0.99', help='comma separated thresholds to report')
+    parser.add_argument('--threshold', type=float, default=0.95, help='threshold checked against --max-false-hit-rate')
+    parser.add_argument('--max-false-hit-rate', type=float, default=0.001)
+    parser.add_argument('--examples', type=int, default=5, help='false hits to print per threshold')
+    parser.add_argument('--output', default=None, help='write results as json')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+from collections import Counter
+import json, re, string
+
+def normalize_answer(s: str) -> str:
+    '''
+    official SQuAD normalization: lower case, remove punctuation, articles and extra whitespace
+    '''
+    s = s.lower()
+    s = ''.join(ch for ch in s if ch not in set(string.punctuation))
+    s = re.sub(r'\b(a|an|the)\b', ' ', s)
+    return ' '.join(s.split())
+
+def exact_match(prediction: str, truths: list[str]) -> float:
+    return float(any(normalize_answer(prediction) == normalize_answer(t) for t in truths))
+
+def f1(prediction: str, truths: list[str]) -> float:
+    best = 0.0
+    pred_tokens = normalize_answer(prediction).split()
+    for truth in truths:
+        truth_tokens = normalize_answer(truth).split()
+        common = Counter(pred_tokens) & Counter(truth_tokens)
+        same = sum(common.values())
+        if same == 0:
+            continue
+        precision = same/len(pred_tokens)
+        recall = same/len(truth_tokens)
+        best = max(best, 2*precision*recall/(precision+recall))
+    return best
+
+def score_answers(predictions: list[str], truths: list[str], n: int=5) -> dict:
+    '''
+    EM and F1 for the first prediction, EM@n and F1@n for the best of the first n predictions
+    '''
+    if not predictions:
+        return {'EM': 0.0, 'F1': 0.0, f'EM@{n}': 0.0, f'F1@{n}': 0.0}
+    return {
+        'EM': exact_match(predictions[0], truths),
+        'F1': f1(predictions[0], truths),
+        f'EM@{n}': max(exact_match(p, truths) for p in predictions[:n]),
+        f'F1@{n}': max(f1(p, truths) for p in predictions[:n]),
+    }
+
+def load_questions(path: str, limit: int=None) -> list[dict]:
+    '''
+    reads jsonl file with one question per line: {"question": str, "answers": [str, ...]}
+    '''
+    questions = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                questions.append(json.loads(line))
+            if limit and len(questions) >= limit:
+                break
+    return questions
+
+def export_squad(path: str, split: str='validation') -> None:
+    '''
+    writes SQuAD questions and answers to path in the format read by load_questions
+    '''
+    from datasets import load_dataset
+    with open(path, 'w') as f:
+        for row in load_dataset('rajpurkar/squad', split=split):
+            f.write(json.dumps({'question': row['question'], 'answers': row['answers']['text']})+'\n')
+
+if __name__ == '__main__':
+    import sys
+    export_squad(sys.argv[1] if len(sys.argv) > 1 else 'squad_questions.jsonl')
@@ -0,0 +1,49 @@
+'''
+measures EM/F1 and latency of trimming long passages to the sentences most relevant to the
+question before QA (see ContextTrimmer) against answering full passages, on the SQuAD questions
+used for the README table, and the words sent to QA
+
+run from the app folder so model and data paths resolve, e.g.,
+    cd app && python ../benchmarks/trim_contexts.py ../squad_questions.jsonl --limit 1000
+'''
+import app_path
+from nearest_neighbors_service.ann_service import SearchType
+from qa_manager import QA_Manager
+from context_trimming import ContextTrimmer
+from squad_metrics import load_questions
+from evaluation import evaluate
+import argparse, asyncio, json
+
+async def main(args):
+    questions = load_questions(args.questions, args.limit)
+    manager = QA_Manager.make_default_manager(
+                    args.vdb_host, args.vdb_port, args.ft_host, args.ft_port
+                )
+    search_type = SearchType.from_string(args.search_type)
+    results = {}
+    for max_words in [None]+args.max_words:
+        name = 'full-passages' if max_words is None else f'max-words-{max_words}'
+        trimmer = ContextTrimmer(max_words) if max_words is not None else None
+        manager.qa_service.context_trimmer = trimmer
+        results[name] = await evaluate(manager, questions, search_type)
+        if trimmer is not None:
+            stats = trimmer.stats()
+            results[name]['trimmed_fraction'] = round(stats['trimmed']/max(stats['passages'], 1), 4)
+            results[name]['words_kept'] = round(stats['words_out']/max(stats['words_in'], 1), 4)
+        print(name, results[name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('questions', help='jsonl file from squad_metrics.py')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--search-type', default='VEC_FT', help='VEC, FT or VEC_FT')
+    parser.add_argument('--max-words', type=int, nargs='+', default=[60, 120, 200])
+    parser.add_argument('--output', default=None, help='write results as json')
+    parser.add_argument('--vdb-host', default='localhost')
+    parser.add_argument('--vdb-port', default='6333')
+    parser.add_argument('--ft-host', default='localhost')
+    parser.add_argument('--ft-port', default='9200')
+    asyncio.run(main(parser.parse_args()))